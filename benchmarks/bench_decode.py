@@ -0,0 +1,93 @@
+"""
+Checks that the selective wire-format scanner matches the generated protobuf classes,
+then compares its throughput with a full decode.
+
+Run from the repository root:
+    python -m benchmarks.bench_decode --trips 2000 --stops 30
+"""
+import argparse
+import logging
+import random
+import time
+from typing import List, Optional
+
+from src.data_transformation.binary_decoder import protobuf_backend
+from src.data_transformation.transformer import process_feed
+from src.data_transformation.wire_decoder import scan_feed
+from src.data_loading.tf_loader import TRIP_UPDATE_COLUMNS, VEHICLE_POSITION_COLUMNS, ALERT_COLUMNS
+from benchmarks.bench_transform import build_feed
+
+COLUMNS = (TRIP_UPDATE_COLUMNS, VEHICLE_POSITION_COLUMNS, ALERT_COLUMNS)
+
+
+def add_edge_cases(feed, seed: int = 0) -> None:
+    """Adds entities with missing optional fields, alerts and unhandled entities."""
+    rng = random.Random(seed)
+    entity = feed.entity.add(id="empty_trip")
+    entity.trip_update.trip.SetInParent()
+    entity.trip_update.stop_time_update.add(stop_id="X01N").departure.time = 1
+    entity = feed.entity.add(id="empty_arrival")
+    entity.trip_update.trip.trip_id = "empty_arrival"
+    entity.trip_update.trip.schedule_relationship = 3
+    entity.trip_update.stop_time_update.add(stop_id="X02N").arrival.SetInParent()
+    entity = feed.entity.add(id="bare_vehicle")
+    entity.vehicle.position.latitude = 40.7
+    entity.vehicle.position.longitude = -73.9
+    for a in range(20):
+        entity = feed.entity.add(id=f"alert{a}")
+        for _ in range(rng.randint(0, 3)):
+            informed_entity = entity.alert.informed_entity.add(route_id="A")
+            if rng.random() < 0.5:
+                informed_entity.trip.trip_id = f"trip{a}"
+                informed_entity.trip.route_id = "A"
+        for language in ("en", "es")[:rng.randint(0, 2)]:
+            entity.alert.header_text.translation.add(text=f"Délais {a}\t{language}", language=language)
+    feed.entity.add(id="deleted", is_deleted=True)
+
+
+def check_identical(binary_data: bytes) -> None:
+    """Raises AssertionError if the scanner output differs from the generated classes."""
+    for columnar in (False, True):
+        expected = process_feed(binary_data, None, columnar=columnar)
+        actual = scan_feed(binary_data, columnar=columnar)
+        for columns, expected_rows, actual_rows in zip(COLUMNS, expected, actual):
+            if columnar:
+                assert expected_rows.to_tuples(columns) == actual_rows.to_tuples(columns), columns
+            else:
+                assert expected_rows == actual_rows, columns
+
+
+def best_rate(decode, binary_data: bytes, repeat: int) -> float:
+    """Returns the best rows per second over `repeat` runs."""
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = sum(len(batch) for batch in decode(binary_data))
+        best = max(best, rows / (time.perf_counter() - start))
+    return best
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--trips", type=int, default=2000)
+    parser.add_argument("--stops", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)  # the edge-case entities log "Unhandled entity type" on every run
+
+    feed = build_feed(args.trips, args.stops)
+    add_edge_cases(feed)
+    binary_data = feed.SerializeToString()
+
+    check_identical(binary_data)
+    print("selective scanner output is identical to the generated classes")
+
+    full_rate = best_rate(lambda data: process_feed(data, None, columnar=True), binary_data, args.repeat)
+    selective_rate = best_rate(lambda data: scan_feed(data, columnar=True), binary_data, args.repeat)
+    print(f"protobuf backend: {protobuf_backend()}")
+    print(f"full decode:      {full_rate:12,.0f} rows/s")
+    print(f"selective scan:   {selective_rate:12,.0f} rows/s ({selective_rate / full_rate:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
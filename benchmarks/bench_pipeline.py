@@ -0,0 +1,270 @@
+"""
+Times the decode, transform and load stages end to end on generated feeds.
+
+Each decode/transform variant is run against each sink and the best time of `--repeat` runs
+is reported per stage. Sinks:
+    null      converts rows to load-ready tuples and discards them
+    copy      runs tf_loader.copy_rows into an in-memory COPY buffer
+    postgres  loads with tf_loader.load_all_data into a scratch schema of the database in
+              config.bench_db_params (BENCH_DB_*); only run when requested with --sinks
+
+Results are written as JSON so runs can be compared. From the repository root:
+    python -m benchmarks.bench_pipeline --trips 500 --output before.json
+    BENCH_DB_NAME=scratch python -m benchmarks.bench_pipeline --sinks null copy postgres
+    python -m benchmarks.bench_pipeline --trips 500 --output after.json --compare before.json
+"""
+import argparse
+import datetime
+import io
+import json
+import logging
+import platform
+import subprocess
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import psycopg2
+
+from config import bench_db_params, db_params, gtfs_path
+from src.data_transformation.binary_decoder import decode_binary, protobuf_backend
+from src.data_transformation.transformer import extract_rows, extract_columnar, enrich_rows
+from src.data_transformation.wire_decoder import scan_feed
+from src.data_transformation.static_index import get_static_index
+from src.data_loading.loader import ensure_table_exists
+from src.data_loading.tf_loader import (copy_rows, load_all_data, _as_tuples, TRIP_UPDATE_COLUMNS,
+                                        VEHICLE_POSITION_COLUMNS, ALERT_COLUMNS)
+from benchmarks.feed_generator import FeedGenerator, FeedSpec, DEFAULT_SPEC
+
+TABLES = (('realtime_trip_updates', TRIP_UPDATE_COLUMNS),
+          ('realtime_vehicle_positions', VEHICLE_POSITION_COLUMNS),
+          ('realtime_alerts', ALERT_COLUMNS))
+
+# name -> (decode, transform); a None decode means the transform reads the raw bytes itself
+VARIANTS: Dict[str, Tuple[Optional[Callable], Callable]] = {
+    'protobuf-dict': (decode_binary, extract_rows),
+    'protobuf-columnar': (decode_binary, extract_columnar),
+    'selective-columnar': (None, lambda binary_data: scan_feed(binary_data, True)),
+}
+
+BENCH_SCHEMA = 'benchmark'
+
+
+class NullSink:
+    """Converts rows to tuples like every load does, then drops them."""
+    name = 'null'
+
+    def load(self, trip_updates, vehicle_positions, alerts) -> int:
+        return sum(len(_as_tuples(rows, columns))
+                   for rows, (_, columns) in zip((trip_updates, vehicle_positions, alerts), TABLES))
+
+    def close(self) -> None:
+        pass
+
+
+class _BufferCursor:
+    """The part of a psycopg2 cursor that copy_rows uses, writing COPY data to memory."""
+
+    def __init__(self):
+        self.buffer = io.StringIO()
+
+    def execute(self, query, params=None) -> None:
+        pass  # savepoints
+
+    def copy_expert(self, sql, file) -> None:
+        self.buffer.write(file.read())
+
+
+class CopyBufferSink:
+    """Runs the real COPY formatting path of copy_rows without a database."""
+    name = 'copy'
+
+    def __init__(self):
+        self.bytes = 0
+
+    def load(self, trip_updates, vehicle_positions, alerts) -> int:
+        cur = _BufferCursor()
+        loaded = sum(copy_rows(cur, table, columns, rows)
+                     for rows, (table, columns) in zip((trip_updates, vehicle_positions, alerts), TABLES))
+        self.bytes += cur.buffer.tell()
+        return loaded
+
+    def close(self) -> None:
+        pass
+
+
+class PostgresSink:
+    """Loads with load_all_data into the realtime tables of a scratch schema, dropped on close."""
+    name = 'postgres'
+
+    def __init__(self, params: Optional[dict] = bench_db_params):
+        if params is None:
+            raise ValueError("no benchmark database configured, set BENCH_DB_NAME and the other BENCH_DB_* settings")
+        if all(params[key] == db_params[key] for key in ('dbname', 'host', 'port')):
+            raise ValueError(f"the benchmark database is the ingest database {db_params['dbname']!r}, "
+                             f"its {BENCH_SCHEMA} schema would be dropped")
+        self.conn = psycopg2.connect(connect_timeout=3, **params)
+        with self.conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+            cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+            cur.execute(f"SET search_path TO {BENCH_SCHEMA}")
+        self.conn.commit()
+        ensure_table_exists(self.conn)
+
+    def load(self, trip_updates, vehicle_positions, alerts) -> int:
+        rows = sum(len(rows) for rows in (trip_updates, vehicle_positions, alerts))
+        load_all_data(trip_updates, vehicle_positions, alerts, self.conn)
+        return rows
+
+    def close(self) -> None:
+        with self.conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        self.conn.commit()
+        self.conn.close()
+
+
+def make_sinks(names: List[str]) -> list:
+    sinks = []
+    for name in names:
+        if name == 'null':
+            sinks.append(NullSink())
+        elif name == 'copy':
+            sinks.append(CopyBufferSink())
+        elif name == 'postgres':
+            try:
+                sinks.append(PostgresSink())
+            except ValueError as e:
+                print(f"Skipping postgres sink, {e}")
+            except psycopg2.Error as e:
+                print(f"Skipping postgres sink, no database available: {str(e).strip()}")
+    return sinks
+
+
+def run_variant(snapshots: List[bytes], variant: str, sink, repeat: int, static_index=None) -> Dict[str, float]:
+    """
+    Runs one variant over all snapshots `repeat` times and returns the best time of each stage.
+
+    Args:
+        snapshots (List[bytes]): Serialized feeds.
+        variant (str): A key of VARIANTS.
+        sink: The sink the rows are loaded into.
+        repeat (int): Number of runs.
+        static_index: If given, rows are enriched during the transform stage.
+
+    Returns:
+        Dict[str, float]: Best seconds per stage, and the number of rows loaded per run.
+    """
+
+    decode, transform = VARIANTS[variant]
+    best = {'decode': float('inf'), 'transform': float('inf'), 'load': float('inf'), 'total': float('inf')}
+    rows = 0
+    for _ in range(repeat):
+        timings = {'decode': 0.0, 'transform': 0.0, 'load': 0.0}
+        rows = 0
+        for binary_data in snapshots:
+            start = time.perf_counter()
+            message = decode(binary_data) if decode else binary_data
+            decoded = time.perf_counter()
+            trip_updates, vehicle_positions, alerts = transform(message)
+            if static_index is not None:
+                enrich_rows(trip_updates, static_index)
+                enrich_rows(vehicle_positions, static_index)
+            transformed = time.perf_counter()
+            rows += sink.load(trip_updates, vehicle_positions, alerts)
+            loaded = time.perf_counter()
+            timings['decode'] += decoded - start
+            timings['transform'] += transformed - decoded
+            timings['load'] += loaded - transformed
+        timings['total'] = sum(timings.values())
+        best = {stage: min(best[stage], seconds) for stage, seconds in timings.items()}
+    best['rows'] = rows
+    return best
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[dict], baseline_path: str) -> None:
+    """Prints the speedup of every result over the matching result of a previous run."""
+    with open(baseline_path) as f:
+        baseline = {(r['variant'], r['sink'], r['stage']): r for r in json.load(f)['results']}
+    print(f"\nCompared with {baseline_path} (>1 is faster):")
+    for result in results:
+        previous = baseline.get((result['variant'], result['sink'], result['stage']))
+        if previous and result['seconds'] and previous['seconds']:
+            print(f"  {result['variant']:20} {result['sink']:9} {result['stage']:10} "
+                  f"{previous['seconds'] / result['seconds']:6.2f}x")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--trips", type=int, default=DEFAULT_SPEC.trips)
+    parser.add_argument("--stops-per-trip", type=int, default=DEFAULT_SPEC.stops_per_trip)
+    parser.add_argument("--vehicles", type=int, default=DEFAULT_SPEC.vehicles)
+    parser.add_argument("--alerts", type=int, default=DEFAULT_SPEC.alerts)
+    parser.add_argument("--snapshots", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--variants", nargs='+', choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--sinks", nargs='+', choices=('null', 'copy', 'postgres'),
+                        default=['null', 'copy'], help="postgres needs BENCH_DB_NAME")
+    parser.add_argument("--enrich", action='store_true', help="Enrich rows from the static GTFS index")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="A previous --output file to compare with")
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+
+    spec = FeedSpec(args.trips, args.stops_per_trip, args.vehicles, args.alerts)
+    snapshots = FeedGenerator(gtfs_path, args.seed).snapshots(spec, args.snapshots)
+    feed_bytes = sum(len(snapshot) for snapshot in snapshots)
+    static_index = get_static_index(gtfs_path) if args.enrich else None
+
+    results = []
+    sinks = make_sinks(args.sinks)
+    try:
+        for sink in sinks:
+            for variant in args.variants:
+                timings = run_variant(snapshots, variant, sink, args.repeat, static_index)
+                for stage in ('decode', 'transform', 'load', 'total'):
+                    if stage == 'decode' and VARIANTS[variant][0] is None:
+                        continue  # decoding happens inside the transform
+                    if stage in ('decode', 'transform') and sink is not sinks[0]:
+                        continue  # decode and transform do not depend on the sink
+                    seconds = timings[stage]
+                    results.append({
+                        'variant': variant, 'sink': sink.name, 'stage': stage, 'seconds': round(seconds, 6),
+                        'rows': timings['rows'],
+                        'rows_per_second': round(timings['rows'] / seconds, 1) if seconds else None,
+                        'mib_per_second': round(feed_bytes / seconds / 2 ** 20, 2) if seconds else None,
+                    })
+    finally:
+        for sink in sinks:
+            sink.close()
+
+    print(f"{'variant':20} {'sink':9} {'stage':10} {'seconds':>10} {'rows/s':>14} {'MiB/s':>8}")
+    for r in results:
+        print(f"{r['variant']:20} {r['sink']:9} {r['stage']:10} {r['seconds']:10.4f} "
+              f"{r['rows_per_second'] or 0:14,.0f} {r['mib_per_second'] or 0:8.2f}")
+
+    report = {
+        'run_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'protobuf_backend': protobuf_backend(),
+        'spec': {**spec._asdict(), 'snapshots': args.snapshots, 'repeat': args.repeat,
+                 'enrich': args.enrich, 'feed_bytes': feed_bytes},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Measures CLI startup: the time to print `main.py --help` and to import each command's modules.
+
+Every measurement runs in a fresh interpreter and the best of `--repeat` runs is kept. It also
+checks that importing the CLI loads none of the heavy modules, which only the commands that
+need them may import. From the repository root:
+    python -m benchmarks.bench_startup --output before.json
+    python -m benchmarks.bench_startup --output after.json --compare before.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+from src.cli import COMMANDS
+
+# Modules that must not be imported by `import src.cli`
+HEAVY_MODULES = ('psycopg2', 'google.protobuf', 'numpy', 'pandas', 'pyarrow', 'requests')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(code: str) -> str:
+    return subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True,
+                          check=True).stdout.strip()
+
+
+def import_seconds(modules: List[str], repeat: int) -> float:
+    """Returns the best time in seconds to import `modules` in a fresh interpreter."""
+    code = ("import time; start = time.perf_counter(); import importlib; "
+            f"[importlib.import_module(m) for m in {modules!r}]; print(time.perf_counter() - start)")
+    return min(float(_run(code)) for _ in range(repeat))
+
+
+def help_seconds(repeat: int) -> float:
+    """Returns the best wall time in seconds of `python main.py --help`, interpreter start included."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, 'main.py', '--help'], cwd=ROOT, capture_output=True, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def heavy_imports() -> List[str]:
+    """Returns the heavy modules loaded by importing the CLI."""
+    code = f"import sys, src.cli; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    return [module for module in _run(code).split(',') if module]
+
+
+def compare(results: List[dict], baseline_path: str) -> None:
+    """Prints the speedup of every result over the matching result of a previous run."""
+    with open(baseline_path) as f:
+        baseline = {r['command']: r for r in json.load(f)['results']}
+    print(f"\nCompared with {baseline_path} (>1 is faster):")
+    for result in results:
+        previous = baseline.get(result['command'])
+        if previous and result['seconds'] and previous['seconds']:
+            print(f"  {result['command']:14} {previous['seconds'] / result['seconds']:6.2f}x")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="A previous --output file to compare with")
+    args = parser.parse_args(argv)
+
+    results: List[Dict[str, object]] = [{'command': '--help', 'seconds': round(help_seconds(args.repeat), 4)}]
+    results.append({'command': 'import src.cli', 'seconds': round(import_seconds(['src.cli'], args.repeat), 4)})
+    for name, (_, modules) in COMMANDS.items():
+        if modules:
+            results.append({'command': name, 'seconds': round(import_seconds(list(modules), args.repeat), 4)})
+
+    print(f"{'command':14} {'seconds':>8}")
+    for r in results:
+        print(f"{r['command']:14} {r['seconds']:8.4f}")
+    heavy = heavy_imports()
+    print(f"Heavy modules loaded by the CLI: {', '.join(heavy) or 'none'}")
+
+    report = {
+        'run_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'heavy_imports': heavy,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+    if heavy:
+        sys.exit(f"Importing the CLI loads {', '.join(heavy)}; import them inside the commands instead")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Measures the build time, memory footprint and lookup throughput of the static GTFS index.
+
+Run from the repository root:
+    python -m benchmarks.bench_static_index --lookups 200000
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from typing import List, Optional
+
+from config import gtfs_path
+from src.data_transformation.static_index import StaticGTFSIndex, _trip_suffix
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--path", default=gtfs_path)
+    parser.add_argument("--lookups", type=int, default=200000)
+    args = parser.parse_args(argv)
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = StaticGTFSIndex(args.path)
+    build_time = time.perf_counter() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"build:  {build_time * 1000:8.1f} ms, {memory / 1024 / 1024:.2f} MiB "
+          f"for {len(index.trip_route)} trips and {len(index.stop_name)} stops")
+
+    rng = random.Random(0)
+    # Realtime feeds carry the shortened trip ids, so look those up like transform does
+    trip_ids = [_trip_suffix(trip_id) for trip_id in rng.sample(sorted(index._trip_rows), min(5000, len(index._trip_rows)))]
+    stop_ids = rng.sample(sorted(index._stop_rows), min(1000, len(index._stop_rows)))
+    trips = [rng.choice(trip_ids) for _ in range(args.lookups)]
+    stops = [rng.choice(stop_ids) for _ in range(args.lookups)]
+
+    for label, start_date in (("cold", "20231017"), ("warm", "20231017")):
+        start = time.perf_counter()
+        for trip_id in trips:
+            index.trip(trip_id, start_date)
+        rate = args.lookups / (time.perf_counter() - start)
+        print(f"trip lookups ({label}):  {rate:12,.0f} /s")
+
+    start = time.perf_counter()
+    for stop_id in stops:
+        index.parent_station(stop_id)
+    print(f"stop lookups:         {args.lookups / (time.perf_counter() - start):12,.0f} /s")
+
+
+if __name__ == "__main__":
+    main()
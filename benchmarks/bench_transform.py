@@ -0,0 +1,90 @@
+"""
+Compares rows per second of the dict-based and the columnar transform paths.
+
+Run from the repository root:
+    python -m benchmarks.bench_transform --trips 2000 --stops 30
+"""
+import argparse
+import time
+from typing import List, Optional
+
+from src.data_transformation import gtfs_realtime_pb2
+from src.data_transformation.transformer import (
+    extract_trip_updates, extract_vehicle_positions, extract_alerts, extract_columnar
+)
+from src.data_loading.tf_loader import (
+    _as_tuples, TRIP_UPDATE_COLUMNS, VEHICLE_POSITION_COLUMNS, ALERT_COLUMNS
+)
+
+
+def build_feed(trips: int, stops: int) -> gtfs_realtime_pb2.FeedMessage:
+    """Builds a FeedMessage with one trip update and one vehicle position per trip."""
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "1.0"
+    feed.header.timestamp = now = int(time.time())
+    for t in range(trips):
+        trip_id = f"{t:06d}_A..N{t % 50:02d}R"
+        entity = feed.entity.add(id=f"tu{t}")
+        entity.trip_update.trip.trip_id = trip_id
+        entity.trip_update.trip.route_id = "A"
+        entity.trip_update.trip.start_date = "20231017"
+        for s in range(stops):
+            stop_time_update = entity.trip_update.stop_time_update.add(stop_id=f"A{s:02d}N")
+            stop_time_update.arrival.time = now + 90 * s
+            stop_time_update.departure.time = now + 90 * s + 30
+        entity = feed.entity.add(id=f"vp{t}")
+        entity.vehicle.trip.trip_id = trip_id
+        entity.vehicle.trip.route_id = "A"
+        entity.vehicle.current_stop_sequence = t % stops
+        entity.vehicle.stop_id = f"A{t % stops:02d}N"
+        entity.vehicle.timestamp = now
+    return feed
+
+
+def dict_path(feed) -> int:
+    trip_updates, vehicle_positions, alerts = [], [], []
+    for entity in feed.entity:
+        if entity.HasField('trip_update'):
+            trip_updates.extend(extract_trip_updates(entity))
+        elif entity.HasField('vehicle'):
+            vehicle_positions.extend(extract_vehicle_positions(entity))
+        elif entity.HasField('alert'):
+            alerts.extend(extract_alerts(entity))
+    return (len(_as_tuples(trip_updates, TRIP_UPDATE_COLUMNS))
+            + len(_as_tuples(vehicle_positions, VEHICLE_POSITION_COLUMNS))
+            + len(_as_tuples(alerts, ALERT_COLUMNS)))
+
+
+def columnar_path(feed) -> int:
+    trip_updates, vehicle_positions, alerts = extract_columnar(feed)
+    return (len(_as_tuples(trip_updates, TRIP_UPDATE_COLUMNS))
+            + len(_as_tuples(vehicle_positions, VEHICLE_POSITION_COLUMNS))
+            + len(_as_tuples(alerts, ALERT_COLUMNS)))
+
+
+def best_rate(path, feed, repeat: int) -> float:
+    """Returns the best rows per second over `repeat` runs, measured up to load-ready tuples."""
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = path(feed)
+        best = max(best, rows / (time.perf_counter() - start))
+    return best
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--trips", type=int, default=2000)
+    parser.add_argument("--stops", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    feed = build_feed(args.trips, args.stops)
+    dict_rate = best_rate(dict_path, feed, args.repeat)
+    columnar_rate = best_rate(columnar_path, feed, args.repeat)
+    print(f"dict path:     {dict_rate:12,.0f} rows/s")
+    print(f"columnar path: {columnar_rate:12,.0f} rows/s ({columnar_rate / dict_rate:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Builds synthetic GTFS-realtime FeedMessages from the static GTFS trips and stops.
+
+Trip ids, routes, directions and stop sequences are taken from the files in gtfs_path so the
+feeds look like the NYCT ones (and match the static index), at any scale. Without static
+files the generator falls back to made-up ids.
+
+Write a feed to disk from the repository root:
+    python -m benchmarks.feed_generator --trips 500 --stops-per-trip 30 --output feed.pb
+"""
+import argparse
+import csv
+import datetime
+import os
+import random
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from config import gtfs_path
+from src.data_transformation import gtfs_realtime_pb2
+from src.data_transformation.static_index import _trip_suffix
+
+
+class FeedSpec(NamedTuple):
+    """The scale of a generated feed."""
+    trips: int = 500
+    stops_per_trip: int = 30
+    vehicles: int = 400
+    alerts: int = 10
+
+
+DEFAULT_SPEC = FeedSpec()
+
+
+def _read_rows(file_path: str) -> List[Dict[str, str]]:
+    if not os.path.exists(file_path):
+        return []
+    with open(file_path, newline='', encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+
+class FeedGenerator:
+    """
+    Generates FeedMessages with trip updates, vehicle positions and alerts.
+
+    Args:
+        path (str): Directory containing trips.txt and stops.txt.
+        seed (int): Seed for reproducible feeds.
+    """
+
+    def __init__(self, path: str = gtfs_path, seed: int = 0):
+        self.rng = random.Random(seed)
+        # (realtime trip id, route_id, direction_id)
+        self.trips: List[Tuple[str, str, int]] = [
+            (_trip_suffix(row['trip_id']), row['route_id'], int(row.get('direction_id') or 0))
+            for row in _read_rows(os.path.join(path, 'trips.txt'))
+        ]
+        # Parent stations grouped by the first character of their id, which NYCT uses for the line
+        self.stations: Dict[str, List[str]] = {}
+        for row in _read_rows(os.path.join(path, 'stops.txt')):
+            if not row.get('parent_station'):
+                self.stations.setdefault(row['stop_id'][:1], []).append(row['stop_id'])
+        self.routes = sorted({route_id for _, route_id, _ in self.trips}) or ['A']
+
+    def _trip(self, index: int) -> Tuple[str, str, int]:
+        if self.trips:
+            return self.trips[self.rng.randrange(len(self.trips))]
+        return f"{index:06d}_A..N{index % 50:02d}R", 'A', index % 2
+
+    def _stops(self, route_id: str, direction_id: int, count: int) -> List[str]:
+        """Returns `count` consecutive platform ids of the route's line in the trip's direction."""
+        stations = self.stations.get(route_id[:1]) or self.rng.choice(list(self.stations.values()) or [[]])
+        suffix = 'S' if direction_id else 'N'
+        if not stations:
+            return [f"X{s:02d}{suffix}" for s in range(count)]
+        first = self.rng.randrange(len(stations))
+        return [stations[(first + s) % len(stations)] + suffix for s in range(count)]
+
+    def generate(self, spec: FeedSpec = DEFAULT_SPEC, now: Optional[int] = None) -> gtfs_realtime_pb2.FeedMessage:
+        """
+        Builds one FeedMessage.
+
+        Args:
+            spec (FeedSpec): Number of trips, stop updates per trip, vehicles and alerts.
+            now (Optional[int]): The header timestamp, defaults to the current time.
+
+        Returns:
+            gtfs_realtime_pb2.FeedMessage: The feed.
+        """
+
+        now = int(time.time()) if now is None else now
+        start_date = datetime.datetime.fromtimestamp(now).strftime('%Y%m%d')
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.header.gtfs_realtime_version = "1.0"
+        feed.header.timestamp = now
+
+        trips = [self._trip(t) for t in range(spec.trips)]
+        for t, (trip_id, route_id, direction_id) in enumerate(trips):
+            entity = feed.entity.add(id=f"{t:06d}")
+            entity.trip_update.trip.trip_id = trip_id
+            entity.trip_update.trip.route_id = route_id
+            entity.trip_update.trip.start_date = start_date
+            arrival = now + self.rng.randint(-120, 600)
+            for stop_id in self._stops(route_id, direction_id, spec.stops_per_trip):
+                stop_time_update = entity.trip_update.stop_time_update.add(stop_id=stop_id)
+                stop_time_update.arrival.time = arrival
+                stop_time_update.departure.time = arrival + self.rng.choice((0, 0, 30))
+                arrival += self.rng.randint(60, 180)
+
+        for v in range(min(spec.vehicles, spec.trips)):
+            trip_id, route_id, direction_id = trips[v]
+            entity = feed.entity.add(id=f"{spec.trips + v:06d}")
+            entity.vehicle.trip.trip_id = trip_id
+            entity.vehicle.trip.route_id = route_id
+            entity.vehicle.trip.start_date = start_date
+            entity.vehicle.current_stop_sequence = self.rng.randrange(max(spec.stops_per_trip, 1))
+            entity.vehicle.stop_id = self._stops(route_id, direction_id, 1)[0]
+            entity.vehicle.current_status = self.rng.randrange(3)
+            entity.vehicle.timestamp = now - self.rng.randint(0, 60)
+
+        for a in range(spec.alerts):
+            entity = feed.entity.add(id=f"alert:{a}")
+            for route_id in self.rng.sample(self.routes, min(len(self.routes), self.rng.randint(1, 3))):
+                entity.alert.informed_entity.add(route_id=route_id)
+            if trips and self.rng.random() < 0.3:
+                entity.alert.informed_entity.add().trip.trip_id = self.rng.choice(trips)[0]
+            entity.alert.header_text.translation.add(text=f"Delays on line {a}", language="en")
+            entity.alert.description_text.translation.add(
+                text="Trains are running with delays because of a signal problem.", language="en"
+            )
+        return feed
+
+    def snapshots(self, spec: FeedSpec, count: int, interval: int = 30, start: Optional[int] = None) -> List[bytes]:
+        """
+        Builds a series of serialized feeds `interval` seconds apart, e.g. for replay or diff benchmarks.
+
+        Args:
+            spec (FeedSpec): The scale of each feed.
+            count (int): Number of snapshots.
+            interval (int): Seconds between header timestamps.
+            start (Optional[int]): Timestamp of the first snapshot.
+
+        Returns:
+            List[bytes]: The serialized feeds.
+        """
+        start = int(time.time()) if start is None else start
+        return [self.generate(spec, start + i * interval).SerializeToString() for i in range(count)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--path", default=gtfs_path)
+    parser.add_argument("--trips", type=int, default=DEFAULT_SPEC.trips)
+    parser.add_argument("--stops-per-trip", type=int, default=DEFAULT_SPEC.stops_per_trip)
+    parser.add_argument("--vehicles", type=int, default=DEFAULT_SPEC.vehicles)
+    parser.add_argument("--alerts", type=int, default=DEFAULT_SPEC.alerts)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    feed = FeedGenerator(args.path, args.seed).generate(
+        FeedSpec(args.trips, args.stops_per_trip, args.vehicles, args.alerts)
+    )
+    with open(args.output, 'wb') as f:
+        f.write(feed.SerializeToString())
+    print(f"Wrote {len(feed.entity)} entities, {os.path.getsize(args.output)} bytes to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,16 @@ db_params = {
     "port": os.getenv("DB_PORT", "default_db_port"),
 }
 
+# Scratch database of the pipeline benchmark's postgres sink, which drops and recreates a schema
+# in it. Unset unless BENCH_DB_NAME is given, so benchmarks never touch the ingest database.
+bench_db_params = {
+    "dbname": os.getenv("BENCH_DB_NAME"),
+    "user": os.getenv("BENCH_DB_USER", db_params["user"]),
+    "password": os.getenv("BENCH_DB_PASSWORD", db_params["password"]),
+    "host": os.getenv("BENCH_DB_HOST", db_params["host"]),
+    "port": os.getenv("BENCH_DB_PORT", db_params["port"]),
+} if os.getenv("BENCH_DB_NAME") else None
+
 # Path to the static GTFS dataset
 gtfs_path = "./data/gtfs/"
 
@@ -25,4 +35,100 @@ api_endpoint_urls = ["https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyc
                      "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-nqrw", # NQRW Lines API Endpoint
                      "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-l",    # L Line API Endpoint
                      "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs",      # 1-7 Lines API Endpoint
-                     "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-si"]   # SIR API Endpoint
\ No newline at end of file
+                     "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-si"]   # SIR API Endpoint
+
+# Feed fetching
+fetch_timeout = float(os.getenv("FETCH_TIMEOUT", 10))          # Per-request timeout in seconds
+fetch_max_workers = int(os.getenv("FETCH_MAX_WORKERS", 8))     # Concurrent fetches / pooled connections
+
+# Incremental diffing of realtime rows
+diff_trip_ttl = float(os.getenv("DIFF_TRIP_TTL", 3 * 60 * 60))  # Forget trips not seen for this many seconds
+diff_max_trips = int(os.getenv("DIFF_MAX_TRIPS", 50000))        # Upper bound on trips held in memory
+
+# Transform realtime feeds into typed column batches instead of lists of dictionaries
+columnar_transform = os.getenv("COLUMNAR_TRANSFORM", "true").lower() in ("1", "true", "yes")
+
+# Decode feeds with the selective wire-format scanner instead of the generated protobuf classes
+selective_decode = os.getenv("SELECTIVE_DECODE", "false").lower() in ("1", "true", "yes")
+
+# Ingest pipeline
+poll_interval = float(os.getenv("POLL_INTERVAL", 30))                   # Seconds between fetch ticks
+pipeline_queue_size = int(os.getenv("PIPELINE_QUEUE_SIZE", 32))             # Capacity of each stage queue
+pipeline_drop_policy = os.getenv("PIPELINE_DROP_POLICY", "drop_oldest")      # Full transform queue: block, drop_newest or drop_oldest
+pipeline_load_drop_policy = os.getenv("PIPELINE_LOAD_DROP_POLICY", "block")  # Full load queue; its feeds are already diffed
+
+# Adaptive polling: fetch each feed just after it is expected to publish, instead of every poll_interval
+adaptive_polling = os.getenv("ADAPTIVE_POLLING", "true").lower() in ("1", "true", "yes")
+poll_min_interval = float(os.getenv("POLL_MIN_INTERVAL", 2))        # Shortest time between fetches of one feed
+poll_max_interval = float(os.getenv("POLL_MAX_INTERVAL", 300))      # Longest time between fetches, also the error backoff cap
+poll_publish_delay = float(os.getenv("POLL_PUBLISH_DELAY", 0.5))    # Seconds to wait past the expected publish time
+poll_request_budget = float(os.getenv("POLL_REQUEST_BUDGET", 120))  # Requests per minute across all feeds
+
+# Database connection pool
+db_pool_max_size = int(os.getenv("DB_POOL_MAX_SIZE", 4))                      # Connections, and concurrent feed loads
+db_health_check_interval = float(os.getenv("DB_HEALTH_CHECK_INTERVAL", 30))  # Idle seconds before a connection is checked
+db_reconnect_max_backoff = float(os.getenv("DB_RECONNECT_MAX_BACKOFF", 60))  # Longest delay between reconnect attempts
+
+# Partitioning and retention of the realtime tables
+partition_interval = os.getenv("PARTITION_INTERVAL", "day")                        # day or hour
+partitions_ahead = int(os.getenv("PARTITIONS_AHEAD", 3))                           # Future partitions to pre-create
+retention_days = float(os.getenv("RETENTION_DAYS", 30))                            # Partitions older than this are dropped
+partition_maintenance_interval = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", 3600))  # Seconds between runs
+
+# Static GTFS loading
+static_load_workers = int(os.getenv("STATIC_LOAD_WORKERS", 4))  # Files loaded in parallel, one connection each
+
+# Enrich realtime rows with trip and stop attributes from the static GTFS files in gtfs_path
+static_enrichment = os.getenv("STATIC_ENRICHMENT", "true").lower() in ("1", "true", "yes")
+
+# Raw feed storage: "archive" appends compressed feeds to on-disk segments and stores only their
+# index in Postgres, "database" stores the bytes as BYTEA rows in realtime_binary_data
+raw_feed_storage = os.getenv("RAW_FEED_STORAGE", "archive")
+archive_path = os.getenv("ARCHIVE_PATH", "./data/archive/")                       # Segment directory
+archive_compression_level = int(os.getenv("ARCHIVE_COMPRESSION_LEVEL", 6))        # zlib level, 1 (fast) to 9 (small)
+
+# Replay/backfill of stored raw feeds (python -m src.automation.replay)
+replay_workers = int(os.getenv("REPLAY_WORKERS", os.cpu_count() or 1))  # Worker processes
+replay_shard_hours = int(os.getenv("REPLAY_SHARD_HOURS", 24))            # Hours of one feed per shard, divides 24
+replay_batch_rows = int(os.getenv("REPLAY_BATCH_ROWS", 50000))           # Rows buffered per table before each COPY
+
+# Parquet export of the realtime history for offline analysis (python main.py export)
+export_path = os.getenv("EXPORT_PATH", "./data/export/")                  # Root of the partitioned dataset
+export_compression = os.getenv("EXPORT_COMPRESSION", "zstd")              # Parquet codec: zstd, snappy, gzip or none
+export_batch_rows = int(os.getenv("EXPORT_BATCH_ROWS", 50000))            # Rows fetched from the server-side cursor at a time
+export_buffer_rows = int(os.getenv("EXPORT_BUFFER_ROWS", 250000))         # Rows held in memory per table before row groups are written
+export_file_rows = int(os.getenv("EXPORT_FILE_ROWS", 2000000))            # Rows per chunk; its files are published before the high-water mark moves
+export_late_window = float(os.getenv("EXPORT_LATE_WINDOW", 3600))         # Seconds that skipped ids are re-scanned for rows committed late
+
+# Prometheus-format metrics endpoint at http://<metrics_host>:<metrics_port>/metrics, 0 disables it
+metrics_port = int(os.getenv("METRICS_PORT", 9108))
+metrics_host = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Sharding the endpoints between several ingest instances through leases in Postgres
+ingest_sharding = os.getenv("INGEST_SHARDING", "false").lower() in ("1", "true", "yes")
+lease_ttl = float(os.getenv("LEASE_TTL", poll_interval * 0.6))                              # Seconds until a lease expires
+lease_heartbeat_interval = float(os.getenv("LEASE_HEARTBEAT_INTERVAL", poll_interval / 4))  # Seconds between renewals
+
+# Alerts stored once per distinct content with their entities, periods and translations, instead of
+# one realtime_alerts row per informed entity and header translation on every poll
+alert_state_store = os.getenv("ALERT_STATE_STORE", "true").lower() in ("1", "true", "yes")
+
+# Latest trip update per (trip_id, stop_id) and vehicle position per trip_id, upserted with every load
+current_state_tables = os.getenv("CURRENT_STATE_TABLES", "true").lower() in ("1", "true", "yes")
+current_state_max_age = float(os.getenv("CURRENT_STATE_MAX_AGE", diff_trip_ttl))  # Expire trips not seen in their feed for this many seconds
+
+# Streaming headway, delay and dwell rollups per stop
+headway_rollups = os.getenv("HEADWAY_ROLLUPS", "true").lower() in ("1", "true", "yes")
+headway_windows = [int(w) for w in os.getenv("HEADWAY_WINDOWS", "300,3600").split(",")]  # Rollup windows in seconds
+headway_flush_interval = float(os.getenv("HEADWAY_FLUSH_INTERVAL", 60))   # Seconds between rollup writes
+headway_bunching_ratio = float(os.getenv("HEADWAY_BUNCHING_RATIO", 0.25))  # Headways under this share of the average are bunched
+headway_max_seconds = float(os.getenv("HEADWAY_MAX_SECONDS", 2 * 60 * 60))  # Longer gaps are not counted as headways
+
+# Write-ahead spool between transform and load
+spool_enabled = os.getenv("SPOOL_ENABLED", "true").lower() in ("1", "true", "yes")
+spool_path = os.getenv("SPOOL_PATH", "./data/spool/")
+spool_max_bytes = int(os.getenv("SPOOL_MAX_BYTES", 1024 ** 3))              # Batches beyond this are dropped
+spool_segment_bytes = int(os.getenv("SPOOL_SEGMENT_BYTES", 16 * 1024 ** 2))  # Size of one segment file
+spool_fsync_interval = float(os.getenv("SPOOL_FSYNC_INTERVAL", 0.5))        # Longest time between fsyncs
+spool_fsync_batch = int(os.getenv("SPOOL_FSYNC_BATCH", 16))                 # Batches after which an fsync is forced
+spool_max_attempts = int(os.getenv("SPOOL_MAX_ATTEMPTS", 5))                # Failed loads before a batch is quarantined
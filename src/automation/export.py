@@ -0,0 +1,356 @@
+import argparse
+import bisect
+import datetime
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import psycopg2
+
+from src.data_transformation.transformer import process_feed
+from src.data_transformation.state_diff import TripStateDiffer
+from src.data_transformation.static_index import get_static_index
+from src.data_loading.feed_archive import FeedArchive
+from src.data_loading.parquet_writer import EXPORT_TABLES, FeedParquetWriter, PartitionedParquetWriter
+from src.automation.replay import plan_archive_shards, _archive_snapshots
+from config import (db_params, archive_path, columnar_transform, selective_decode, static_enrichment, gtfs_path,
+                    export_path, export_batch_rows, export_file_rows, export_late_window)
+
+# High-water marks of the incremental export, next to the dataset; readers skip _-prefixed files
+STATE_FILE = '_export_state.json'
+
+
+class ExportState:
+    """
+    The high-water marks of past exports: the last exported id and the ids skipped below it per
+    table for the database source, and the fetch time of the last exported snapshot per feed
+    for the archive source.
+
+    Args:
+        root (str): The root directory of the dataset.
+    """
+
+    def __init__(self, root: str):
+        self.path = os.path.join(root, STATE_FILE)
+        try:
+            with open(self.path) as f:
+                self.marks: Dict[str, Any] = json.load(f)
+        except FileNotFoundError:
+            self.marks = {}
+
+    def get(self, key: str, default: Any = 0) -> Any:
+        return self.marks.get(key, default)
+
+    def set(self, key: str, value: Any) -> None:
+        """Records a mark once the files it covers are published."""
+        self.update({key: value})
+
+    def update(self, marks: Dict[str, Any]) -> None:
+        """Records several marks at once, e.g. a table's high-water mark with its skipped ids."""
+        self.marks.update(marks)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(self.marks, f, indent=2, sort_keys=True)
+        os.replace(temporary, self.path)
+
+
+def _skipped_key(table: str) -> str:
+    return f"{table}/skipped"
+
+
+def _subtract(skipped: List[list], ids: List[int]) -> List[list]:
+    """Removes the given ids, sorted, from the skipped ranges [first, last, since]."""
+    remaining = []
+    for first, last, since in skipped:
+        for found in ids[bisect.bisect_left(ids, first):bisect.bisect_right(ids, last)]:
+            if first < found:
+                remaining.append([first, found - 1, since])
+            first = found + 1
+        if first <= last:
+            remaining.append([first, last, since])
+    return remaining
+
+
+def export_late_rows(
+        conn: psycopg2.extensions.connection,
+        table: str,
+        root: str,
+        state: ExportState,
+        batch_rows: int = export_batch_rows,
+        late_window: float = export_late_window
+    ) -> int:
+    """
+    Exports the rows that committed after higher ids were exported.
+
+    Ids are assigned at insert but rows only become visible at commit, so a transaction that
+    was still open during an export, e.g. a long spooled batch, leaves ids below the high-water
+    mark that export_table skipped. Those ranges are kept in the state and looked up again by
+    every run for `late_window` seconds; ids that never show up belonged to rolled-back rows.
+
+    Args:
+        conn (psycopg2.extensions.connection): A database connection object.
+        table (str): The table to export, a key of EXPORT_TABLES.
+        root (str): The root directory of the dataset.
+        state (ExportState): The high-water marks.
+        batch_rows (int): Rows fetched from the server per round-trip.
+        late_window (float): Seconds after which skipped ids are given up.
+
+    Returns:
+        int: The number of rows exported.
+    """
+
+    now = time.time()
+    skipped = [gap for gap in state.get(_skipped_key(table), []) if now - gap[2] < late_window]
+    if not skipped:
+        if state.get(_skipped_key(table), []):
+            state.set(_skipped_key(table), [])
+        return 0
+
+    columns = ', '.join(tuple(EXPORT_TABLES[table]) + ('last_updated',))
+    found: List[int] = []
+    writer = None
+    try:
+        with conn.cursor(name=f"export_late_{table}") as cur:
+            cur.itersize = batch_rows
+            cur.execute(
+                f"SELECT id, {columns} FROM {table} "
+                f"JOIN unnest(%s::bigint[], %s::bigint[]) AS skipped (first_id, last_id) "
+                f"ON id BETWEEN skipped.first_id AND skipped.last_id ORDER BY id",
+                ([gap[0] for gap in skipped], [gap[1] for gap in skipped])
+            )
+            while True:
+                rows = cur.fetchmany(batch_rows)
+                if not rows:
+                    break
+                if writer is None:
+                    # Named after the first id found, so a rerun after a crash replaces the files
+                    writer = PartitionedParquetWriter(root, table, file_tag=f"{rows[0][0]:020d}-late")
+                found.extend(row[0] for row in rows)
+                writer.write([row[1:] for row in rows])
+        conn.rollback()
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    if writer is not None:
+        writer.close()
+    state.set(_skipped_key(table), _subtract(skipped, found))
+    if found:
+        logging.info(f"Exported {len(found)} rows of {table} that were committed late")
+    return len(found)
+
+
+def export_table(
+        conn: psycopg2.extensions.connection,
+        table: str,
+        root: str,
+        state: ExportState,
+        file_rows: int = export_file_rows,
+        batch_rows: int = export_batch_rows
+    ) -> int:
+    """
+    Exports the rows of a realtime table added since the last export to the Parquet dataset.
+
+    Rows are streamed in id order through a server-side cursor, `batch_rows` at a time, in
+    chunks of at most `file_rows` rows. Every chunk is published as one file per date and
+    route partition before its last id is recorded as the table's high-water mark, so an
+    interrupted export resumes with the first unpublished chunk. Ids are assigned at insert,
+    so rows of spooled batches loaded late get new ids and are exported even though their
+    last_updated is in the past. Rows are only visible once committed, though, so ids missing
+    below the mark are recorded and looked up again by export_late_rows first.
+
+    Args:
+        conn (psycopg2.extensions.connection): A database connection object.
+        table (str): The table to export, a key of EXPORT_TABLES.
+        root (str): The root directory of the dataset.
+        state (ExportState): The high-water marks.
+        file_rows (int): Rows per chunk.
+        batch_rows (int): Rows fetched from the server per round-trip.
+
+    Returns:
+        int: The number of rows exported.
+    """
+
+    exported = export_late_rows(conn, table, root, state, batch_rows)
+    columns = ', '.join(tuple(EXPORT_TABLES[table]) + ('last_updated',))
+    start_id = int(state.get(table))
+    with conn.cursor() as cur:
+        # Rows inserted while the export runs are left for the next one
+        cur.execute(f"SELECT max(id) FROM {table}")
+        (end_id,) = cur.fetchone()
+    conn.rollback()
+
+    while end_id is not None and start_id < end_id:
+        last_id = start_id
+        skipped = []
+        now = time.time()
+        with PartitionedParquetWriter(root, table, file_tag=f"{start_id + 1:020d}") as writer:
+            # A named cursor keeps the result on the server and fetches it in batches
+            with conn.cursor(name=f"export_{table}") as cur:
+                cur.itersize = batch_rows
+                cur.execute(
+                    f"SELECT id, {columns} FROM {table} WHERE id > %s AND id <= %s ORDER BY id LIMIT %s",
+                    (start_id, end_id, file_rows)
+                )
+                while True:
+                    rows = cur.fetchmany(batch_rows)
+                    if not rows:
+                        break
+                    for row in rows:
+                        if row[0] > last_id + 1:
+                            skipped.append([last_id + 1, row[0] - 1, now])
+                        last_id = row[0]
+                    writer.write([row[1:] for row in rows])
+            conn.rollback()
+        if last_id == start_id:
+            break
+        state.update({table: last_id, _skipped_key(table): state.get(_skipped_key(table), []) + skipped})
+        exported += writer.rows
+        start_id = last_id
+        logging.info(f"Exported {exported} rows of {table} (up to id {last_id} of {end_id})")
+    return exported
+
+
+def export_archive(
+        root: str,
+        state: ExportState,
+        start: Optional[datetime.datetime] = None,
+        end: Optional[datetime.datetime] = None,
+        feeds: Optional[Sequence[str]] = None,
+        diff: bool = True
+    ) -> Dict[str, int]:
+    """
+    Decodes archived raw feeds and writes their rows straight to the Parquet dataset.
+
+    No database is involved, so history can be exported from the archive alone, e.g. on
+    another machine. Each shard of the archive (see replay.plan_archive_shards) is published
+    before the fetch time of its last snapshot is recorded as the feed's high-water mark, and
+    snapshots up to the mark are skipped on the next run.
+
+    Args:
+        root (str): The root directory of the dataset.
+        state (ExportState): The high-water marks.
+        start (Optional[datetime.datetime]): Start of the range (UTC, inclusive), all by default.
+        end (Optional[datetime.datetime]): End of the range (UTC, exclusive), now by default.
+        feeds (Optional[Sequence[str]]): Feed slugs to export, all by default.
+        diff (bool): Write only rows that changed between snapshots, like the live ingest and
+            the realtime tables. The first snapshot of every run is written in full.
+
+    Returns:
+        Dict[str, int]: The number of rows exported per table.
+    """
+
+    start = start or datetime.datetime(1970, 1, 1)
+    end = end or datetime.datetime.utcnow()
+    static_index = get_static_index(gtfs_path) if static_enrichment else None
+    differs: Dict[str, TripStateDiffer] = {}
+    exported = {table: 0 for table in EXPORT_TABLES}
+
+    for shard in plan_archive_shards(FeedArchive(archive_path), start, end, feeds):
+        slug = os.path.basename(shard.feed)
+        key = f"archive/{slug}"
+        mark = state.get(key)
+        differ = differs.setdefault(slug, TripStateDiffer()) if diff else None
+        writer = None
+        try:
+            for stamp, binary_data in _archive_snapshots(shard, archive_path):
+                fetched_at = stamp.replace(tzinfo=datetime.timezone.utc).timestamp()
+                if fetched_at <= mark:
+                    continue
+                try:
+                    trip_updates, vehicle_positions, alerts = process_feed(
+                        binary_data, None, columnar=columnar_transform, selective=selective_decode,
+                        static_index=static_index
+                    )
+                except Exception as e:
+                    logging.warning(f"Skipping undecodable snapshot of {slug} at {stamp}: {e}")
+                    continue
+                if differ is not None:
+                    trip_updates, vehicle_positions, _ = differ.diff(slug, trip_updates, vehicle_positions,
+                                                                     now=fetched_at)
+                if writer is None:
+                    writer = FeedParquetWriter(root, file_tag=f"{slug}-{int(fetched_at * 1000)}")
+                writer.write_feed(trip_updates, vehicle_positions, alerts, stamp)
+                mark = fetched_at
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+        if writer is None:
+            continue
+        writer.close()
+        state.set(key, mark)
+        for table, count in writer.rows.items():
+            exported[table] += count
+        logging.info(f"Exported shard {shard.key}: {sum(writer.rows.values())} rows")
+    return exported
+
+
+def export(
+        source: str,
+        root: str = export_path,
+        tables: Optional[Sequence[str]] = None,
+        start: Optional[datetime.datetime] = None,
+        end: Optional[datetime.datetime] = None,
+        feeds: Optional[Sequence[str]] = None,
+        diff: bool = True
+    ) -> Dict[str, float]:
+    """
+    Exports the realtime history added since the last export to the Parquet dataset under `root`.
+
+    Args:
+        source (str): 'database' to read the realtime tables, 'archive' to decode the raw feed archive.
+        root (str): The root directory of the dataset.
+        tables (Optional[Sequence[str]]): Tables to export from the database, all by default.
+        start (Optional[datetime.datetime]): Archive source: start of the range (UTC, inclusive).
+        end (Optional[datetime.datetime]): Archive source: end of the range (UTC, exclusive).
+        feeds (Optional[Sequence[str]]): Archive source: feed slugs to export.
+        diff (bool): Archive source: write only changed rows.
+
+    Returns:
+        Dict[str, float]: The number of rows exported per table and the elapsed seconds.
+    """
+
+    start_time = time.time()
+    state = ExportState(root)
+    if source == 'database':
+        conn = psycopg2.connect(**db_params)
+        try:
+            report: Dict[str, float] = {table: export_table(conn, table, root, state)
+                                        for table in tables or EXPORT_TABLES}
+        finally:
+            conn.close()
+    elif source == 'archive':
+        report = export_archive(root, state, start, end, feeds, diff)
+    else:
+        raise ValueError(f"Unknown export source {source!r}, expected 'database' or 'archive'")
+    report['seconds'] = round(time.time() - start_time, 3)
+    logging.info(f"Export report: {report}")
+    return report
+
+
+def _parse_time(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Export the realtime history to partitioned Parquet files.")
+    parser.add_argument('--source', choices=('database', 'archive'), default='database')
+    parser.add_argument('--output', default=export_path, help="Root directory of the dataset")
+    parser.add_argument('--table', action='append', dest='tables', choices=tuple(EXPORT_TABLES),
+                        help="Database source: table to export; repeatable")
+    parser.add_argument('--start', type=_parse_time, help="Archive source: ISO time, UTC (inclusive)")
+    parser.add_argument('--end', type=_parse_time, help="Archive source: ISO time, UTC (exclusive)")
+    parser.add_argument('--feed', action='append', dest='feeds', help="Archive source: feed slug; repeatable")
+    parser.add_argument('--no-diff', dest='diff', action='store_false',
+                        help="Archive source: write every row of every snapshot")
+    args = parser.parse_args(argv)
+    export(args.source, args.output, args.tables, args.start, args.end, args.feeds, args.diff)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
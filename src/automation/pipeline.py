@@ -0,0 +1,237 @@
+import logging
+import queue
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Optional
+
+# Put into a queue to tell the next stage that no more work will arrive
+_STOP = object()
+
+DROP_POLICIES = ("block", "drop_newest", "drop_oldest")
+
+
+class StageQueue:
+    """
+    A bounded queue between two pipeline stages with a configurable policy for when it is full.
+
+    - block: the producer waits for space (backpressure).
+    - drop_newest: the new item is discarded.
+    - drop_oldest: the oldest queued item is discarded to make room.
+
+    `on_drop`, if given, is called with every discarded item.
+    """
+
+    def __init__(self, name: str, maxsize: int, policy: str = "block",
+                 on_drop: Optional[Callable[[Any], None]] = None):
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy {policy!r}, expected one of {DROP_POLICIES}")
+        self.name = name
+        self.policy = policy
+        self.dropped = 0
+        self._on_drop = on_drop
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, item: Any) -> None:
+        """
+        Adds an item, applying the drop policy if the queue is full.
+
+        Args:
+            item: The work item for the next stage.
+        """
+        if self.policy == "block":
+            self._queue.put(item)
+            return
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                if self.policy == "drop_newest":
+                    self._dropped(item)
+                    return
+                try:
+                    oldest = self._queue.get_nowait()
+                    self._queue.task_done()
+                    self._dropped(oldest)
+                except queue.Empty:
+                    pass
+
+    def put_stop(self) -> None:
+        """Signals the consumer to finish once the queued items are processed. Never dropped."""
+        self._queue.put(_STOP)
+
+    def get(self) -> Any:
+        return self._queue.get()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def _dropped(self, item: Any) -> None:
+        self.dropped += 1
+        logging.warning(f"{self.name} queue full, dropped an item ({self.dropped} so far)")
+        if self._on_drop is not None:
+            self._on_drop(item)
+
+
+class Pipeline:
+    """
+    Runs fetch, transform and load as separate threads joined by bounded queues.
+
+    The fetch stage runs on a fixed-rate clock: tick n starts at `start + n * interval`
+    regardless of how long earlier ticks or the downstream stages took, so slow database
+    writes never shift the fetch cadence. Ticks that are missed entirely are skipped, not
+    queued up. When `next_delay` is given it replaces the clock: after each fetch the stage
+    sleeps for as long as it returns, e.g. until the next feed is due.
+
+    Args:
+        fetch (Callable[[], list]): Returns the work items of one poll.
+        transform (Callable[[Any], Any]): Turns a fetched item into a loadable item, or None to skip it.
+        load (Callable[[Any], None]): Writes a transformed item.
+        interval (float): Seconds between fetch ticks.
+        queue_size (int): Capacity of each queue.
+        drop_policy (str): What to do when the transform queue is full, see StageQueue.
+        on_drop (Optional[Callable[[Any], None]]): Called with every fetched item the transform
+            queue drops.
+        load_drop_policy (str): What to do when the load queue is full. Blocks by default, as
+            transformed items may carry state that was already advanced, e.g. diffed rows.
+        on_load_drop (Optional[Callable[[Any], None]]): Called with every transformed item the
+            load queue drops.
+        load_workers (int): Number of load threads, e.g. one per pooled database connection. Each
+            has its own queue of `queue_size` items.
+        next_delay (Optional[Callable[[], float]]): Returns the seconds until the next fetch.
+        load_key (Optional[Callable[[Any], str]]): Returns the key of a transformed item, e.g. its
+            feed url. Items with the same key always go to the same load thread, so they are loaded
+            one at a time and in order. Without it the items are spread round-robin.
+    """
+
+    def __init__(
+            self,
+            fetch: Callable[[], list],
+            transform: Callable[[Any], Any],
+            load: Callable[[Any], None],
+            interval: float,
+            queue_size: int,
+            drop_policy: str = "block",
+            load_workers: int = 1,
+            next_delay: Optional[Callable[[], float]] = None,
+            load_drop_policy: str = "block",
+            on_load_drop: Optional[Callable[[Any], None]] = None,
+            load_key: Optional[Callable[[Any], str]] = None,
+            on_drop: Optional[Callable[[Any], None]] = None
+        ):
+        self._fetch = fetch
+        self._transform = transform
+        self._load = load
+        self.interval = interval
+        self._next_delay = next_delay
+        self.transform_queue = StageQueue("transform", queue_size, drop_policy, on_drop)
+        self.load_queues = [
+            StageQueue(f"load-{i}", queue_size, load_drop_policy, on_load_drop) for i in range(load_workers)
+        ]
+        self._load_key = load_key
+        self._next_load_queue = 0
+        self.ticks = 0
+        self.missed_ticks = 0
+        self._stop_event = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._run_fetch, name="pipeline-fetch", daemon=True),
+            threading.Thread(target=self._run_transform, name="pipeline-transform", daemon=True),
+        ] + [
+            threading.Thread(target=self._run_load, args=(load_queue,), name=f"pipeline-load-{i}", daemon=True)
+            for i, load_queue in enumerate(self.load_queues)
+        ]
+
+    def start(self) -> None:
+        """Starts all stage threads."""
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        """Asks the fetch stage to stop; the queued work is still transformed and loaded."""
+        self._stop_event.set()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        """Waits for every stage to finish."""
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run(self) -> None:
+        """Starts the pipeline and blocks until it is stopped and drained."""
+        self.start()
+        try:
+            while any(thread.is_alive() for thread in self._threads):
+                self.join(timeout=1)
+        except KeyboardInterrupt:
+            logging.info("Stopping pipeline, draining queued work...")
+            self.stop()
+            self.join()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns tick, drop and queue depth counters."""
+        return {
+            "ticks": self.ticks,
+            "missed_ticks": self.missed_ticks,
+            "transform_queue_depth": self.transform_queue.qsize(),
+            "load_queue_depth": sum(load_queue.qsize() for load_queue in self.load_queues),
+            "transform_dropped": self.transform_queue.dropped,
+            "load_dropped": sum(load_queue.dropped for load_queue in self.load_queues),
+        }
+
+    def _run_fetch(self) -> None:
+        next_tick = time.monotonic()
+        try:
+            while not self._stop_event.is_set():
+                self.ticks += 1
+                try:
+                    for item in self._fetch():
+                        self.transform_queue.put(item)
+                except Exception as e:
+                    logging.exception(f"Fetch stage error: {e}")
+
+                if self._next_delay is not None:
+                    self._stop_event.wait(self._next_delay())
+                    continue
+                next_tick += self.interval
+                now = time.monotonic()
+                if now > next_tick:
+                    missed = int((now - next_tick) // self.interval) + 1
+                    self.missed_ticks += missed
+                    next_tick += missed * self.interval
+                    logging.warning(f"Fetch overran its interval, skipping {missed} tick(s)")
+                self._stop_event.wait(next_tick - time.monotonic())
+        finally:
+            self.transform_queue.put_stop()
+
+    def _run_transform(self) -> None:
+        try:
+            while True:
+                item = self.transform_queue.get()
+                if item is _STOP:
+                    return
+                try:
+                    transformed = self._transform(item)
+                    if transformed is not None:
+                        self._load_queue_for(transformed).put(transformed)
+                except Exception as e:
+                    logging.exception(f"Transform stage error: {e}")
+        finally:
+            for load_queue in self.load_queues:
+                load_queue.put_stop()
+
+    def _load_queue_for(self, item: Any) -> StageQueue:
+        if self._load_key is None:
+            self._next_load_queue = (self._next_load_queue + 1) % len(self.load_queues)
+            return self.load_queues[self._next_load_queue]
+        # crc32 rather than hash(), which is salted per process for strings
+        return self.load_queues[zlib.crc32(self._load_key(item).encode()) % len(self.load_queues)]
+
+    def _run_load(self, load_queue: StageQueue) -> None:
+        while True:
+            item = load_queue.get()
+            if item is _STOP:
+                return
+            try:
+                self._load(item)
+            except Exception as e:
+                logging.exception(f"Load stage error: {e}")
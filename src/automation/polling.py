@@ -0,0 +1,191 @@
+import logging
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence
+
+from config import (poll_interval, poll_min_interval, poll_max_interval, poll_publish_delay,
+                    poll_request_budget)
+
+# Publish intervals and publish-to-fetch lags remembered per feed
+_HISTORY = 20
+
+
+class _FeedSchedule:
+    """What the poller has learned about one feed."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.deltas: Deque[float] = deque(maxlen=_HISTORY)
+        self.lags: Deque[float] = deque(maxlen=_HISTORY)
+        self.last_header_timestamp: Optional[int] = None
+        self.next_fetch = 0.0
+        self.unchanged = 0
+        self.errors = 0
+        self.fetches = 0
+
+
+class AdaptivePoller:
+    """
+    Decides when each feed is fetched, from the cadence at which it publishes.
+
+    The publish interval of a feed is the median of the differences between its recent
+    distinct FeedHeader timestamps. The next fetch is planned for the next expected publish
+    plus the smallest delay after which a new snapshot has been seen, which absorbs clock skew
+    and the time the endpoint takes to serve it, plus `publish_delay`. A fetch that finds the
+    feed unchanged is retried at `min_interval`, doubling up to the publish interval; failed
+    fetches back off from the publish interval up to `max_interval`. Feeds without header
+    timestamps are polled every `default_interval`.
+
+    All fetches share a token bucket refilled at `request_budget` requests per minute; when it
+    is empty the most overdue feeds go first.
+
+    Args:
+        feeds (Sequence[str]): The feed endpoints.
+        default_interval (float): The interval until a feed's cadence is known.
+        min_interval (float): Shortest time between two fetches of one feed.
+        max_interval (float): Longest time between two fetches of one feed.
+        publish_delay (float): Seconds to wait past the expected publish time.
+        request_budget (float): Requests per minute across all feeds.
+    """
+
+    def __init__(
+            self,
+            feeds: Sequence[str],
+            default_interval: float = poll_interval,
+            min_interval: float = poll_min_interval,
+            max_interval: float = poll_max_interval,
+            publish_delay: float = poll_publish_delay,
+            request_budget: float = poll_request_budget
+        ):
+        if not min_interval <= default_interval <= max_interval:
+            raise ValueError(f"Poll intervals must satisfy min ({min_interval}s) <= default ({default_interval}s) "
+                             f"<= max ({max_interval}s)")
+        self.default_interval = default_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.publish_delay = publish_delay
+        self.request_rate = request_budget / 60
+        # A full bucket lets every feed be fetched at once, e.g. on start
+        self.bucket_size = max(len(feeds), 1)
+        self._tokens = float(self.bucket_size)
+        self._refilled = time.time()
+        self._feeds: Dict[str, _FeedSchedule] = {url: _FeedSchedule(default_interval) for url in feeds}
+        self._lock = threading.Lock()
+        self.deferred = 0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.bucket_size, self._tokens + max(now - self._refilled, 0.0) * self.request_rate)
+        self._refilled = now
+
+    def due(self, feeds: Optional[Sequence[str]] = None, now: Optional[float] = None) -> List[str]:
+        """
+        Returns the feeds to fetch now, most overdue first, and takes a request token for each.
+
+        Args:
+            feeds (Optional[Sequence[str]]): Limits the choice to these feeds, e.g. the ones this instance owns.
+            now (Optional[float]): The current epoch time, defaults to time.time().
+
+        Returns:
+            List[str]: The feeds to fetch.
+        """
+
+        now = time.time() if now is None else now
+        with self._lock:
+            self._refill(now)
+            candidates = [url for url in (self._feeds if feeds is None else feeds) if url in self._feeds]
+            overdue = sorted((url for url in candidates if self._feeds[url].next_fetch <= now),
+                             key=lambda url: self._feeds[url].next_fetch)
+            allowed = overdue[:int(self._tokens)]
+            self._tokens -= len(allowed)
+            if len(allowed) < len(overdue):
+                self.deferred += len(overdue) - len(allowed)
+                logging.debug(f"Request budget exhausted, deferring {len(overdue) - len(allowed)} feed(s)")
+            for url in allowed:
+                # Not due again until the result is recorded, or min_interval if it never is
+                self._feeds[url].next_fetch = now + self.min_interval
+                self._feeds[url].fetches += 1
+            return allowed
+
+    def next_delay(self, feeds: Optional[Sequence[str]] = None, now: Optional[float] = None) -> float:
+        """
+        Returns the seconds until a feed is due and a request token is available.
+
+        Args:
+            feeds (Optional[Sequence[str]]): Limits the choice to these feeds.
+            now (Optional[float]): The current epoch time, defaults to time.time().
+
+        Returns:
+            float: Seconds to wait, at most `max_interval`.
+        """
+
+        now = time.time() if now is None else now
+        with self._lock:
+            self._refill(now)
+            candidates = [self._feeds[url].next_fetch for url in (self._feeds if feeds is None else feeds)
+                          if url in self._feeds]
+            delay = min(candidates, default=now + self.default_interval) - now
+            if self._tokens < 1:
+                delay = max(delay, (1 - self._tokens) / self.request_rate)
+            return min(max(delay, 0.0), self.max_interval)
+
+    def record(self, url: str, changed: bool, header_timestamp: Optional[int], failed: bool = False,
+               fetched_at: Optional[float] = None) -> None:
+        """
+        Plans the next fetch of a feed from the outcome of the last one.
+
+        Args:
+            url (str): The feed endpoint.
+            changed (bool): Whether a new snapshot was fetched.
+            header_timestamp (Optional[int]): FeedHeader.timestamp of the fetched snapshot.
+            failed (bool): Whether the fetch failed.
+            fetched_at (Optional[float]): The epoch time of the fetch, defaults to time.time().
+        """
+
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        with self._lock:
+            feed = self._feeds.get(url)
+            if feed is None:
+                return
+            if failed:
+                feed.errors += 1
+                feed.unchanged = 0
+                delay = min(feed.interval * 2 ** (feed.errors - 1), self.max_interval)
+                feed.next_fetch = fetched_at + delay
+                return
+            feed.errors = 0
+
+            if changed and header_timestamp:
+                if feed.last_header_timestamp and header_timestamp > feed.last_header_timestamp:
+                    feed.deltas.append(header_timestamp - feed.last_header_timestamp)
+                    feed.interval = min(max(statistics.median(feed.deltas), self.min_interval), self.max_interval)
+                feed.lags.append(max(fetched_at - header_timestamp, 0.0))
+                feed.last_header_timestamp = header_timestamp
+            if changed:
+                feed.unchanged = 0
+            else:
+                feed.unchanged += 1
+
+            if not feed.last_header_timestamp:
+                feed.next_fetch = fetched_at + self.default_interval
+            elif feed.unchanged:
+                # Published late, or not fetched soon enough to see it yet
+                feed.next_fetch = fetched_at + min(self.min_interval * 2 ** (feed.unchanged - 1), feed.interval)
+            else:
+                expected = feed.last_header_timestamp + feed.interval + min(feed.lags) + self.publish_delay
+                feed.next_fetch = max(expected, fetched_at + self.min_interval)
+
+    def intervals(self) -> Dict[str, float]:
+        """Returns the learned publish interval of every feed, in seconds."""
+        with self._lock:
+            return {url: feed.interval for url, feed in self._feeds.items()}
+
+    def stats(self) -> Dict[str, int]:
+        """Returns fetch, error and deferral counters across all feeds."""
+        with self._lock:
+            return {
+                "fetches": sum(feed.fetches for feed in self._feeds.values()),
+                "backing_off": sum(1 for feed in self._feeds.values() if feed.errors),
+                "deferred": self.deferred,
+            }
@@ -0,0 +1,446 @@
+import argparse
+import datetime
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import psycopg2
+
+from src.data_transformation.transformer import process_feed
+from src.data_transformation.state_diff import TripStateDiffer
+from src.data_transformation.static_index import get_static_index
+from src.data_loading.feed_archive import FeedArchive, SEGMENT_SUFFIX
+from src.data_loading.tf_loader import (copy_rows, _as_tuples, TRIP_UPDATE_COLUMNS, VEHICLE_POSITION_COLUMNS,
+                                        ALERT_COLUMNS, TRIP_EVENT_COLUMNS)
+from config import (db_params, archive_path, columnar_transform, selective_decode, static_enrichment, gtfs_path,
+                    replay_workers, replay_shard_hours, replay_batch_rows)
+
+# Destination tables and their columns; every replayed row also gets the snapshot time as last_updated
+REPLAY_TABLES: Dict[str, Sequence[str]] = {
+    'realtime_trip_updates': TRIP_UPDATE_COLUMNS,
+    'realtime_vehicle_positions': VEHICLE_POSITION_COLUMNS,
+    'realtime_alerts': ALERT_COLUMNS,
+    'realtime_trip_events': TRIP_EVENT_COLUMNS,
+}
+
+CHECKPOINT_TABLE = 'realtime_replay_checkpoints'
+
+_TIME_FORMAT = '%Y%m%d%H'
+
+
+class ReplayShard(NamedTuple):
+    """
+    A unit of replay work: one feed over one time range.
+
+    For the archive source `segments` lists the segment files of the range; the database source
+    has no per-feed split, so `feed` is None and the range is read from realtime_binary_data.
+    """
+    source: str
+    feed: Optional[str]
+    start: datetime.datetime
+    end: datetime.datetime
+    segments: Tuple[str, ...] = ()
+
+    @property
+    def key(self) -> str:
+        return f"{self.feed or self.source}/{self.start.strftime(_TIME_FORMAT)}-{self.end.strftime(_TIME_FORMAT)}"
+
+
+class ShardResult(NamedTuple):
+    """Counters of one replayed shard."""
+    key: str
+    snapshots: int
+    byte_count: int
+    rows: Dict[str, int]
+    seconds: float
+
+
+def _floor(moment: datetime.datetime, hours: int) -> datetime.datetime:
+    """Rounds a time down to a multiple of `hours` since midnight."""
+    return moment.replace(hour=moment.hour - moment.hour % hours, minute=0, second=0, microsecond=0)
+
+
+def plan_archive_shards(
+        archive: FeedArchive,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        feeds: Optional[Sequence[str]] = None,
+        shard_hours: int = replay_shard_hours
+    ) -> List[ReplayShard]:
+    """
+    Groups the archive's hourly segments into shards of `shard_hours` per feed.
+
+    Args:
+        archive (FeedArchive): The raw feed archive.
+        start (datetime.datetime): Start of the range (UTC, inclusive).
+        end (datetime.datetime): End of the range (UTC, exclusive).
+        feeds (Optional[Sequence[str]]): Feed slugs to replay, all by default.
+        shard_hours (int): Hours of one feed per shard, a divisor of 24.
+
+    Returns:
+        List[ReplayShard]: The shards, in time order.
+    """
+
+    grouped: Dict[Tuple[str, datetime.datetime], List[str]] = {}
+    for feed in feeds or [None]:
+        for segment in archive.segments(feed):
+            try:
+                hour = datetime.datetime.strptime(os.path.basename(segment)[:-len(SEGMENT_SUFFIX)], _TIME_FORMAT)
+            except ValueError:
+                continue
+            if start - datetime.timedelta(hours=1) < hour < end:
+                grouped.setdefault((os.path.dirname(segment), _floor(hour, shard_hours)), []).append(segment)
+
+    width = datetime.timedelta(hours=shard_hours)
+    shards = [
+        ReplayShard('archive', feed, max(shard_start, start), min(shard_start + width, end), tuple(sorted(segments)))
+        for (feed, shard_start), segments in grouped.items()
+    ]
+    return sorted(shards, key=lambda shard: (shard.start, shard.feed))
+
+
+def plan_database_shards(
+        conn: psycopg2.extensions.connection,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        shard_hours: int = replay_shard_hours
+    ) -> List[ReplayShard]:
+    """
+    Splits the stored realtime_binary_data rows into shards of `shard_hours`.
+
+    Args:
+        conn (psycopg2.extensions.connection): A database connection object.
+        start (datetime.datetime): Start of the range (UTC, inclusive), compared with the stored timestamps.
+        end (datetime.datetime): End of the range (UTC, exclusive).
+        shard_hours (int): Hours per shard, a divisor of 24.
+
+    Returns:
+        List[ReplayShard]: The non-empty shards, in time order.
+    """
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT DISTINCT date_trunc('hour', timestamp) FROM realtime_binary_data "
+            "WHERE timestamp >= %s AND timestamp < %s",
+            (start, end)
+        )
+        hours = {_floor(hour, shard_hours) for (hour,) in cur.fetchall()}
+    conn.rollback()
+    width = datetime.timedelta(hours=shard_hours)
+    return [ReplayShard('database', None, max(hour, start), min(hour + width, end)) for hour in sorted(hours)]
+
+
+def _archive_snapshots(shard: ReplayShard, root: str) -> Iterator[Tuple[datetime.datetime, bytes]]:
+    """Yields (fetch time, raw feed) for the archived snapshots of a shard, in time order."""
+    archive = FeedArchive(root)
+    start = shard.start.replace(tzinfo=datetime.timezone.utc).timestamp()
+    end = shard.end.replace(tzinfo=datetime.timezone.utc).timestamp()
+    for segment in shard.segments:
+        for entry, binary_data in archive.iter_segment(segment):
+            if start <= entry.fetched_at < end:
+                # Naive UTC, like the defaults of the live tables
+                yield datetime.datetime.utcfromtimestamp(entry.fetched_at), binary_data
+
+
+def _previous_snapshot(shard: ReplayShard, root: str, lookback: float) -> Optional[Tuple[float, bytes]]:
+    """
+    Finds the last archived snapshot of the shard's feed before the shard starts.
+
+    Args:
+        shard (ReplayShard): An archive shard.
+        root (str): The archive directory.
+        lookback (float): Seconds before the shard's start to search, e.g. the differ's TTL.
+
+    Returns:
+        Optional[Tuple[float, bytes]]: The snapshot's epoch fetch time and raw feed, or None.
+    """
+    archive = FeedArchive(root)
+    start = shard.start.replace(tzinfo=datetime.timezone.utc).timestamp()
+    earliest = shard.start - datetime.timedelta(seconds=lookback + 3600)
+    for segment in reversed(archive.segments(shard.feed)):
+        try:
+            hour = datetime.datetime.strptime(os.path.basename(segment)[:-len(SEGMENT_SUFFIX)], _TIME_FORMAT)
+        except ValueError:
+            continue
+        if hour > shard.start:
+            continue
+        if hour < earliest:
+            return None
+        previous = None
+        for entry, binary_data in archive.iter_segment(segment):
+            if start - lookback <= entry.fetched_at < start:
+                previous = entry.fetched_at, binary_data
+        if previous is not None:
+            return previous
+    return None
+
+
+def _database_snapshots(shard: ReplayShard, conn) -> Iterator[Tuple[datetime.datetime, bytes]]:
+    """Yields (stored time, raw feed) for the realtime_binary_data rows of a shard, in time order."""
+    # A named cursor streams the rows instead of loading the whole range into memory
+    with conn.cursor(name=f"replay_{os.getpid()}") as cur:
+        cur.itersize = 100
+        cur.execute(
+            "SELECT timestamp, binary_data FROM realtime_binary_data "
+            "WHERE timestamp >= %s AND timestamp < %s ORDER BY timestamp",
+            (shard.start, shard.end)
+        )
+        for timestamp, binary_data in cur:
+            yield timestamp, bytes(binary_data)
+
+
+def _stamped(rows, columns: Sequence[str], stamp: datetime.datetime) -> List[tuple]:
+    """Converts rows to tuples ordered like `columns` with `stamp` appended as last_updated."""
+    return [row + (stamp,) for row in _as_tuples(rows, columns)]
+
+
+def replay_shard(shard: ReplayShard, run_name: str, table_suffix: str = '', diff: bool = True,
+                 root: str = archive_path, batch_rows: int = replay_batch_rows) -> Optional[ShardResult]:
+    """
+    Decodes, transforms and loads every snapshot of a shard. Runs in a worker process.
+
+    The whole shard is loaded in one transaction together with its checkpoint row, so a shard
+    is either fully loaded and checkpointed or not at all, and an interrupted replay can be
+    rerun with the same run name without duplicating rows.
+
+    When diffing, the differ is first fed the feed's last archived snapshot before the shard, so
+    the shard's first snapshot is diffed against it and trips that disappear at the shard
+    boundary get their event, as in the live ingest.
+
+    Args:
+        shard (ReplayShard): The shard to replay.
+        run_name (str): Identifies the replay run in the checkpoint table.
+        table_suffix (str): Appended to the destination table names, e.g. _v2.
+        diff (bool): Load only rows that changed between snapshots, like the live ingest. The
+            database source stores no feed identity, so its snapshots are always loaded in full.
+        root (str): The archive directory.
+        batch_rows (int): Rows buffered per table before they are copied.
+
+    Returns:
+        Optional[ShardResult]: The shard's counters, or None if it was already checkpointed.
+    """
+
+    start_time = time.time()
+    conn = psycopg2.connect(**db_params)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT 1 FROM {CHECKPOINT_TABLE} WHERE run_name = %s AND shard = %s", (run_name, shard.key))
+            if cur.fetchone():
+                conn.rollback()
+                return None
+
+        differ = TripStateDiffer() if diff and shard.source == 'archive' else None
+        static_index = get_static_index(gtfs_path) if static_enrichment else None
+        previous = _previous_snapshot(shard, root, differ.ttl) if differ is not None else None
+        if previous is not None:
+            fetched_at, binary_data = previous
+            try:
+                trip_updates, vehicle_positions, _ = process_feed(
+                    binary_data, None, columnar=columnar_transform, selective=selective_decode,
+                    static_index=static_index
+                )
+                differ.diff(shard.feed, trip_updates, vehicle_positions, now=fetched_at)
+            except Exception as e:
+                logging.warning(f"Could not seed the diff state of {shard.key}, "
+                                f"its first snapshot is loaded in full: {e}")
+        snapshots = _archive_snapshots(shard, root) if shard.source == 'archive' else _database_snapshots(shard, conn)
+        buffers: Dict[str, List[tuple]] = {table: [] for table in REPLAY_TABLES}
+        loaded = {table: 0 for table in REPLAY_TABLES}
+        snapshot_count = byte_count = 0
+
+        with conn.cursor() as cur:
+            def flush(table: str) -> None:
+                loaded[table] += copy_rows(cur, f"{table}{table_suffix}",
+                                           tuple(REPLAY_TABLES[table]) + ('last_updated',), buffers[table])
+                buffers[table] = []
+
+            for stamp, binary_data in snapshots:
+                snapshot_count += 1
+                byte_count += len(binary_data)
+                try:
+                    trip_updates, vehicle_positions, alerts = process_feed(
+                        binary_data, None, columnar=columnar_transform, selective=selective_decode,
+                        static_index=static_index
+                    )
+                except Exception as e:
+                    logging.warning(f"Skipping undecodable snapshot of {shard.key} at {stamp}: {e}")
+                    continue
+                trip_events = []
+                if differ is not None:
+                    trip_updates, vehicle_positions, trip_events = differ.diff(
+                        shard.feed, trip_updates, vehicle_positions, now=stamp.replace(tzinfo=datetime.timezone.utc).timestamp()
+                    )
+                for table, rows in (('realtime_trip_updates', trip_updates),
+                                    ('realtime_vehicle_positions', vehicle_positions),
+                                    ('realtime_alerts', alerts),
+                                    ('realtime_trip_events', trip_events)):
+                    buffers[table].extend(_stamped(rows, REPLAY_TABLES[table], stamp))
+                    if len(buffers[table]) >= batch_rows:
+                        flush(table)
+
+            for table in REPLAY_TABLES:
+                flush(table)
+            seconds = time.time() - start_time
+            cur.execute(
+                f"INSERT INTO {CHECKPOINT_TABLE} (run_name, shard, snapshots, bytes, rows, seconds) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                (run_name, shard.key, snapshot_count, byte_count, sum(loaded.values()), seconds)
+            )
+        conn.commit()
+        return ShardResult(shard.key, snapshot_count, byte_count, loaded, seconds)
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def ensure_replay_tables(conn: psycopg2.extensions.connection, table_suffix: str) -> None:
+    """
+    Creates the checkpoint table and the versioned destination tables.
+
+    Versioned tables copy the columns, defaults and indexes of the live tables but are not
+    partitioned, so they can be compared with the live data and dropped afterwards.
+
+    Args:
+        conn (psycopg2.extensions.connection): A database connection object.
+        table_suffix (str): Suffix of the destination tables.
+    """
+
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+                run_name VARCHAR(255) NOT NULL,
+                shard VARCHAR(255) NOT NULL,
+                snapshots INTEGER NOT NULL,
+                bytes BIGINT NOT NULL,
+                rows BIGINT NOT NULL,
+                seconds DOUBLE PRECISION NOT NULL,
+                completed_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
+                PRIMARY KEY (run_name, shard)
+            )
+            """
+        )
+        cur.execute(f"ALTER TABLE {CHECKPOINT_TABLE} ALTER COLUMN completed_at SET DEFAULT (NOW() AT TIME ZONE 'UTC')")
+        for table in REPLAY_TABLES:
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {table}{table_suffix} "
+                        f"(LIKE {table} INCLUDING DEFAULTS INCLUDING INDEXES)")
+    conn.commit()
+
+
+def replay(
+        source: str,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        run_name: str,
+        feeds: Optional[Sequence[str]] = None,
+        table_suffix: str = '',
+        diff: bool = True,
+        workers: int = replay_workers,
+        shard_hours: int = replay_shard_hours
+    ) -> Dict[str, float]:
+    """
+    Replays stored raw feeds through process_feed and bulk loads the rows, in parallel by shard.
+
+    Shards already checkpointed under `run_name` are skipped, so rerunning an interrupted
+    replay resumes it. Rows are loaded into versioned tables, never the live ones: the live
+    tables already hold the ingested rows of the range, and have no feed column by which the
+    replayed range could be replaced.
+
+    Args:
+        source (str): 'archive' for the on-disk segments, 'database' for realtime_binary_data.
+        start (datetime.datetime): Start of the range (UTC, inclusive).
+        end (datetime.datetime): End of the range (UTC, exclusive).
+        run_name (str): Identifies the run in the checkpoint table.
+        feeds (Optional[Sequence[str]]): Feed slugs to replay, archive source only.
+        table_suffix (str): Load into `<table><suffix>`, e.g. _v2; required.
+        diff (bool): Load only changed rows, like the live ingest.
+        workers (int): Worker processes.
+        shard_hours (int): Hours per shard, a divisor of 24.
+
+    Returns:
+        Dict[str, float]: The throughput report.
+    """
+
+    if 24 % shard_hours:
+        raise ValueError(f"shard_hours must divide 24, got {shard_hours}")
+    if not re.fullmatch(r'\w+', table_suffix or ''):
+        raise ValueError(f"A table suffix of letters, digits and underscores is required, got {table_suffix!r}; "
+                         f"replaying into the live tables would duplicate their rows")
+    conn = psycopg2.connect(**db_params)
+    try:
+        ensure_replay_tables(conn, table_suffix)
+        if source == 'archive':
+            shards = plan_archive_shards(FeedArchive(archive_path), start, end, feeds, shard_hours)
+        elif source == 'database':
+            shards = plan_database_shards(conn, start, end, shard_hours)
+        else:
+            raise ValueError(f"Unknown replay source {source!r}, expected 'archive' or 'database'")
+    finally:
+        conn.close()
+
+    logging.info(f"Replaying {len(shards)} shards from {source} with {workers} workers as run {run_name!r}")
+    start_time = time.time()
+    report = {'shards': len(shards), 'shards_done': 0, 'shards_skipped': 0, 'shards_failed': 0,
+              'snapshots': 0, 'bytes': 0, 'rows': 0}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(replay_shard, shard, run_name, table_suffix, diff, archive_path): shard
+            for shard in shards
+        }
+        for future in as_completed(futures):
+            shard = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                report['shards_failed'] += 1
+                logging.error(f"Shard {shard.key} failed, rerun to retry it: {e}")
+                continue
+            if result is None:
+                report['shards_skipped'] += 1
+                continue
+            report['shards_done'] += 1
+            report['snapshots'] += result.snapshots
+            report['bytes'] += result.byte_count
+            report['rows'] += sum(result.rows.values())
+            logging.info(f"Shard {result.key}: {result.snapshots} snapshots, {sum(result.rows.values())} rows "
+                         f"in {result.seconds:.1f}s ({report['shards_done'] + report['shards_skipped']}"
+                         f"/{len(shards)} shards)")
+
+    elapsed = time.time() - start_time
+    report['seconds'] = round(elapsed, 3)
+    report['snapshots_per_second'] = round(report['snapshots'] / elapsed, 1) if elapsed else 0.0
+    report['rows_per_second'] = round(report['rows'] / elapsed, 1) if elapsed else 0.0
+    report['mib_per_second'] = round(report['bytes'] / elapsed / 2 ** 20, 2) if elapsed else 0.0
+    logging.info(f"Replay report: {report}")
+    return report
+
+
+def _parse_time(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Replay stored raw feeds into versioned copies of the realtime tables.")
+    parser.add_argument('--source', choices=('archive', 'database'), default='archive')
+    parser.add_argument('--start', type=_parse_time, required=True,
+                        help="ISO time, UTC (inclusive)")
+    parser.add_argument('--end', type=_parse_time, required=True, help="ISO time, UTC (exclusive)")
+    parser.add_argument('--run-name', required=True, help="Rerun with the same name to resume")
+    parser.add_argument('--feed', action='append', dest='feeds', help="Feed slug, e.g. nyct-gtfs-ace; repeatable")
+    parser.add_argument('--table-suffix', required=True, help="Load into versioned tables, e.g. _v2")
+    parser.add_argument('--no-diff', dest='diff', action='store_false', help="Load every row of every snapshot")
+    parser.add_argument('--workers', type=int, default=replay_workers)
+    parser.add_argument('--shard-hours', type=int, default=replay_shard_hours)
+    args = parser.parse_args(argv)
+    replay(args.source, args.start, args.end, args.run_name, args.feeds, args.table_suffix,
+           args.diff, args.workers, args.shard_hours)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,57 +1,501 @@
 import logging
-import schedule
+import signal
+import threading
+import datetime
 import time
-from src.data_extraction.extractor import fetch_binary_data
+from typing import List, NamedTuple, Optional
+from src.automation.pipeline import Pipeline
+from src.automation.polling import AdaptivePoller
+from src.automation.sharding import FeedLeaseManager, ensure_lease_tables
+from src.data_extraction.extractor import fetch_all_feeds
+from src.data_extraction.change_detector import FeedChangeDetector
 from src.data_transformation.transformer import process_feed
-from src.data_loading.loader import store_binary_data, ensure_table_exists
-from src.data_loading.tf_loader import load_trip_updates, load_vehicle_positions, load_alerts
-from config import api_key, api_endpoint_urls
+from src.data_transformation.binary_decoder import protobuf_backend, read_header_timestamp
+from src.data_transformation.state_diff import TripStateDiffer
+from src.data_transformation.headways import HeadwayAggregator
+from src.data_transformation.alert_state import AlertChanges, AlertStateDiffer, extract_alert_records
+from src.data_transformation.static_index import get_static_index
+from src.data_loading.loader import (store_binary_data, store_archive_index, insert_binary_data,
+                                     insert_archive_index, ensure_table_exists)
+from src.data_loading.feed_archive import FeedArchive, RAW_FEED_STORAGE_MODES
+from src.data_loading.tf_loader import load_all_data, copy_all
+from src.data_loading.rollup_store import ensure_rollup_tables, flush_rollups
+from src.data_loading.alert_store import write_alert_changes, prune_alert_history
+from src.data_loading.current_state import expire_current_state
+from src.data_loading.spool import (FeedSpools, SpoolFull, ensure_spool_tables, prune_loaded_batches, claim_batch,
+                                    run_drainer)
+from src.data_loading.db_pool import ConnectionPool
+from src.data_loading.partitions import maintain_partitions
+from src.monitoring.metrics import (REGISTRY, Gauge, STAGE_SECONDS, ERRORS, ROWS_LOADED, feed_context,
+                                    record_header_timestamp, start_metrics_server)
+from config import (api_key, api_endpoint_urls, columnar_transform, selective_decode,
+                    poll_interval, pipeline_queue_size, pipeline_drop_policy, pipeline_load_drop_policy,
+                    db_pool_max_size, partition_maintenance_interval, static_enrichment, gtfs_path, raw_feed_storage,
+                    retention_days, metrics_port, metrics_host, ingest_sharding, spool_enabled,
+                    alert_state_store, adaptive_polling,
+                    headway_rollups, headway_flush_interval, current_state_tables, current_state_max_age)
 
-def job(conn) -> None:
-    """Main job function to orchestrate data fetching, processing, and loading.
+# Tracks the last snapshot of each endpoint across job runs
+change_detector = FeedChangeDetector()
+
+# Last-known trip state, so only new or changed rows are loaded
+state_differ = TripStateDiffer()
+
+# Last-known alerts, so alerts are only written when they appear, change or are cleared
+alert_differ = AlertStateDiffer() if alert_state_store else None
+
+# Per-stop headway, delay and dwell statistics, flushed to the rollup table by setup_schedule
+headway_aggregator = HeadwayAggregator() if headway_rollups else None
+
+# Compressed on-disk segments holding the raw feeds, unless they are stored in the database
+if raw_feed_storage not in RAW_FEED_STORAGE_MODES:
+    raise ValueError(f"Unknown raw feed storage {raw_feed_storage!r}, expected one of {RAW_FEED_STORAGE_MODES}")
+feed_archive = FeedArchive() if raw_feed_storage == "archive" else None
+
+# Plans each feed's fetches around its publish cadence, instead of polling all of them every poll_interval
+poller = AdaptivePoller(api_endpoint_urls) if adaptive_polling else None
+
+# Claims a share of the endpoints when several ingest instances run, otherwise all are ingested
+lease_manager = FeedLeaseManager(api_endpoint_urls) if ingest_sharding else None
+
+# Durable buffer between transform and load, one per feed, so ingest continues while the database
+# is down. Opened by setup_schedule rather than on import, since it creates and scans the spool directory.
+spool: Optional[FeedSpools] = None
+
+
+class FetchedFeed(NamedTuple):
+    """A new feed snapshot waiting to be transformed."""
+    url: str
+    binary_data: bytes
+    fetched_at: float
+
+
+class TransformedFeed(NamedTuple):
+    """A transformed feed snapshot waiting to be loaded."""
+    url: str
+    binary_data: bytes
+    fetched_at: float
+    trip_updates: object
+    vehicle_positions: object
+    alerts: object
+    trip_events: list
+    alert_changes: Optional[AlertChanges] = None
+    # (trip_id, route_id) of every trip of the snapshot, for the current-state tables
+    seen_trips: Optional[list] = None
+
+
+def fetch_changed_feeds() -> List[FetchedFeed]:
+    """
+    Fetches the endpoints this instance owns concurrently and keeps the feeds that changed since the last poll.
+
+    With adaptive polling only the endpoints that are due are fetched, and the outcome of each
+    fetch plans its next one.
+
+    Returns:
+        List[FetchedFeed]: The new feed snapshots.
+    """
+
+    fetched_at = time.time()
+    feeds = []
+    urls = lease_manager.owned_feeds() if lease_manager is not None else api_endpoint_urls
+    if poller is not None:
+        urls = poller.due(urls, fetched_at)
+    for result in fetch_all_feeds(urls, api_key):
+        header_timestamp = read_header_timestamp(result.data) if result.data else None
+        changed = bool(result.data) and change_detector.has_changed(result.url, result.data, header_timestamp)
+        if poller is not None:
+            # A 304 is an unchanged feed, any other fetch without data failed
+            poller.record(result.url, changed, header_timestamp, failed=not result.data and result.status != 304,
+                          fetched_at=time.time())
+        if changed:
+            record_header_timestamp(result.url, header_timestamp)
+            feeds.append(FetchedFeed(result.url, result.data, fetched_at))
+    change_detector.log_stats()
+    return feeds
+
+
+def transform_feed(feed: FetchedFeed) -> TransformedFeed:
+    """
+    Decodes a feed and keeps only the rows that changed since the last snapshot of its endpoint.
+
+    Args:
+        feed (FetchedFeed): The fetched feed.
+
+    Returns:
+        TransformedFeed: The rows to load.
+    """
+
+    with feed_context(feed.url):
+        try:
+            trip_updates, vehicle_positions, alerts = process_feed(
+                feed.binary_data, None, columnar=columnar_transform, selective=selective_decode,
+                static_index=get_static_index(gtfs_path) if static_enrichment else None
+            )
+        except Exception:
+            ERRORS.inc('transform', feed.url)
+            # The differs have not seen the snapshot yet, only the change detector has
+            change_detector.reset(feed.url)
+            raise
+        if headway_aggregator is not None:
+            # Needs every prediction of the snapshot, so it runs before the diff drops unchanged ones
+            with STAGE_SECONDS.time('aggregate', feed.url):
+                headway_aggregator.observe(feed.url, trip_updates, vehicle_positions, feed.fetched_at)
+        with STAGE_SECONDS.time('diff', feed.url):
+            try:
+                trip_updates, vehicle_positions, trip_events = state_differ.diff(feed.url, trip_updates,
+                                                                                 vehicle_positions)
+                seen_trips = state_differ.trips(feed.url) if current_state_tables else None
+                alert_changes = None
+                if alert_differ is not None:
+                    # Replaces the per-poll realtime_alerts rows
+                    alert_changes = alert_differ.diff(feed.url, extract_alert_records(feed.binary_data),
+                                                      feed.fetched_at)
+                    alerts = []
+            except Exception:
+                ERRORS.inc('transform', feed.url)
+                reset_feed_state(feed.url)
+                raise
+    return TransformedFeed(
+        feed.url, feed.binary_data, feed.fetched_at, trip_updates, vehicle_positions, alerts, trip_events,
+        alert_changes, seen_trips
+    )
+
+
+def reset_feed_state(url: str) -> None:
+    """
+    Forgets the diff state of a feed whose changes were not loaded or spooled.
+
+    The differs advance their state when a snapshot is transformed, so the changes of a lost
+    snapshot would otherwise never be emitted again. After a reset the next snapshot of the
+    feed is loaded in full, which rewrites the current state and lists every active alert,
+    even if it is the same snapshot fetched again.
+
+    Args:
+        url (str): The feed's endpoint url.
+    """
+    change_detector.reset(url)
+    state_differ.reset(url)
+    if alert_differ is not None:
+        alert_differ.reset(url)
+
+
+def archive_raw_feed(feed: TransformedFeed):
+    """Appends the raw feed to the on-disk archive and returns its ArchiveEntry."""
+    with STAGE_SECONDS.time('archive', feed.url):
+        return feed_archive.append(feed.url, feed.binary_data, read_header_timestamp(feed.binary_data),
+                                   feed.fetched_at)
+
+
+def store_raw_feed(feed: TransformedFeed, conn) -> None:
+    """
+    Stores the raw feed according to `raw_feed_storage`.
+
+    In archive mode the bytes are appended to the on-disk archive and only their location is
+    written to realtime_feed_archive; in database mode they are inserted as a BYTEA row.
+
+    Args:
+        feed (TransformedFeed): The transformed feed.
+        conn (psycopg2.extensions.connection): A database connection object.
+    """
+
+    if feed_archive is None:
+        store_binary_data([feed.binary_data], conn)
+        return
+    store_archive_index([archive_raw_feed(feed)], conn)
+
+
+def load_feed(feed: TransformedFeed, pool: ConnectionPool) -> None:
+    """
+    Stores the raw feed and loads its rows, on a connection borrowed from the pool.
 
     Args:
-        conn: The database connection object.
+        feed (TransformedFeed): The transformed feed.
+        pool (ConnectionPool): The database connection pool.
     """
-    
+
+    if lease_manager is not None and not lease_manager.owns(feed.url):
+        logging.warning(f"Lease on {feed.url} was lost, dropping its fetched snapshot")
+        reset_feed_state(feed.url)
+        return
+    loaded = False
+    try:
+        with feed_context(feed.url), pool.connection() as conn:
+            store_raw_feed(feed, conn)
+            # Another instance may have claimed the feed since the check above and loaded newer snapshots
+            loaded = load_all_data(feed.trip_updates, feed.vehicle_positions, feed.alerts, conn, feed.trip_events,
+                                   feed.alert_changes, feed.seen_trips,
+                                   may_commit=(lambda cur: lease_manager.holds(cur, feed.url))
+                                   if lease_manager is not None else None)
+    finally:
+        if not loaded:
+            reset_feed_state(feed.url)
+
+
+def spool_feed(feed: TransformedFeed) -> None:
+    """
+    Archives the raw feed locally and writes the batch to the spool, from where the drainers load it.
+
+    Args:
+        feed (TransformedFeed): The transformed feed.
+    """
+
+    if lease_manager is not None and not lease_manager.owns(feed.url):
+        logging.warning(f"Lease on {feed.url} was lost, dropping its fetched snapshot")
+        reset_feed_state(feed.url)
+        return
+    try:
+        raw = ('archive', archive_raw_feed(feed)) if feed_archive is not None else ('database', feed.binary_data)
+        with STAGE_SECONDS.time('spool', feed.url):
+            spool.append({
+                'url': feed.url,
+                'fetched_at': feed.fetched_at,
+                'raw': raw,
+                'trip_updates': feed.trip_updates,
+                'vehicle_positions': feed.vehicle_positions,
+                'alerts': feed.alerts,
+                'trip_events': feed.trip_events,
+                'alert_changes': feed.alert_changes,
+                'seen_trips': feed.seen_trips,
+            })
+    except SpoolFull as e:
+        ERRORS.inc('spool', feed.url)
+        logging.error(f"Dropping snapshot of {feed.url}: {e}")
+        reset_feed_state(feed.url)
+    except Exception:
+        reset_feed_state(feed.url)
+        raise
+
+
+def load_spooled_batch(batch: dict, conn) -> None:
+    """
+    Loads one spooled batch in a single transaction, skipping it if it was loaded before or
+    if this instance no longer holds the lease of its feed.
+
+    Rows are stamped with the fetch time in UTC, so batches loaded after an outage keep their real time.
+
+    Args:
+        batch (dict): A batch written by spool_feed.
+        conn (psycopg2.extensions.connection): A database connection object.
+
+    Raises:
+        Exception: If the batch was not loaded, so the drainer retries or quarantines it.
+    """
+
+    fetched = datetime.datetime.utcfromtimestamp(batch['fetched_at'])
+    with feed_context(batch['url']):
+        try:
+            with STAGE_SECONDS.time('load', batch['url']), conn.cursor() as cur:
+                if not claim_batch(cur, batch['batch_id']):
+                    conn.rollback()
+                    logging.info(f"Spooled batch {batch['batch_id']} was already loaded, skipping it")
+                    return
+                kind, raw = batch['raw']
+                if kind == 'archive':
+                    insert_archive_index(cur, [raw])
+                else:
+                    insert_binary_data(cur, raw, fetched)
+                loaded = copy_all(cur, batch['trip_updates'], batch['vehicle_positions'], batch['alerts'],
+                                  batch['trip_events'], last_updated=fetched, seen_trips=batch.get('seen_trips'))
+                if batch.get('alert_changes') is not None:
+                    loaded['realtime_alert_versions'] = write_alert_changes(cur, batch['alert_changes'])
+                if lease_manager is not None and not lease_manager.holds(cur, batch['url']):
+                    # The new owner loads the feed from its own snapshots
+                    conn.rollback()
+                    logging.warning(f"Lease on {batch['url']} was lost, dropping spooled batch {batch['batch_id']}")
+                    reset_feed_state(batch['url'])
+                    return
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            ERRORS.inc('load', batch['url'])
+            raise
+    for table, count in loaded.items():
+        ROWS_LOADED.inc(batch['url'], table, amount=count)
+    logging.info(f"Loaded spooled batch of {batch['url']}: {loaded['realtime_trip_updates']} trip updates, "
+                 f"{loaded['realtime_vehicle_positions']} vehicle positions and {loaded['realtime_alerts']} alerts")
+
+
+def run_partition_maintenance(pool: ConnectionPool, stop_event: threading.Event) -> None:
+    """
+    Pre-creates partitions and drops expired partitions and archive segments every
+    `partition_maintenance_interval` seconds.
+
+    Args:
+        pool (ConnectionPool): The database connection pool.
+        stop_event (threading.Event): Set to stop the loop.
+    """
+
+    while not stop_event.wait(partition_maintenance_interval):
+        try:
+            with pool.connection() as conn:
+                maintain_partitions(conn)
+                if spool is not None:
+                    prune_loaded_batches(conn)
+                if alert_differ is not None:
+                    prune_alert_history(conn, retention_days)
+                if current_state_tables:
+                    expire_current_state(conn, current_state_max_age)
+            if feed_archive is not None:
+                feed_archive.drop_expired(retention_days)
+        except Exception as e:
+            logging.error(f"Partition maintenance failed: {e}")
+
+
+def run_rollup_flush(pool: ConnectionPool, stop_event: threading.Event) -> None:
+    """
+    Writes the headway rollups every `headway_flush_interval` seconds, and once more when stopped.
+
+    Args:
+        pool (ConnectionPool): The database connection pool.
+        stop_event (threading.Event): Set to stop the loop.
+    """
+
+    while True:
+        stopping = stop_event.wait(headway_flush_interval)
+        try:
+            with pool.connection() as conn, STAGE_SECONDS.time('rollup', ''):
+                flush_rollups(headway_aggregator, conn)
+        except Exception as e:
+            logging.error(f"Headway rollup flush failed: {e}")
+        if stopping:
+            return
+
+
+def job(pool: ConnectionPool) -> None:
+    """Runs one fetch, transform and load cycle synchronously.
+
+    Args:
+        pool (ConnectionPool): The database connection pool.
+    """
+
     logging.info("Starting job...")
     try:
-        ensure_table_exists(conn)
-        
-        # Loop through endpoint urls to fetch from each endpoint
-        for url in api_endpoint_urls:
-            binary_data = fetch_binary_data(url, api_key)
-            if binary_data:
-                # Store binary data
-                store_binary_data([binary_data], conn)
-
-                # Process binary data
-                trip_updates, vehicle_positions, alerts = process_feed(binary_data, conn)
-                
-                # Load transformed data into the database
-                if trip_updates:
-                    load_trip_updates(trip_updates, conn)
-                if vehicle_positions:
-                    load_vehicle_positions(vehicle_positions, conn)
-                if alerts:
-                    load_alerts(alerts, conn)
-            
+        with pool.connection() as conn:
+            ensure_table_exists(conn)
+        for feed in fetch_changed_feeds():
+            load_feed(transform_feed(feed), pool)
     except Exception as e:
         logging.error(f"Error: {e}")
 
-def setup_schedule(conn) -> None:
-    """Schedules tasks to run at specified intervals.
+def setup_schedule(pool: ConnectionPool) -> None:
+    """Creates the schema, then runs the ingest pipeline until interrupted.
 
-    This function sets up a schedule for the main job function, to run at a regular interval
-    (e.g., every 30 seconds).
+    Each feed is fetched when the adaptive poller expects a new snapshot (or on a fixed-rate
+    clock every `poll_interval` seconds without it), while transforming and loading run in
+    their own threads behind bounded queues, so a slow database write does not delay the next
+    fetch. Feeds are loaded concurrently, one load thread per pooled connection with each feed
+    pinned to one of them, or with the spool one drainer per feed. Either way a feed's snapshots
+    are loaded in order.
+    SIGINT or SIGTERM stops fetching and drains the queued work.
 
     Args:
-        conn: The database connection object.
+        pool (ConnectionPool): The database connection pool.
     """
-    
+
+    global spool
     logging.info("Setting up schedule...")
-    schedule.every(30).seconds.do(job, conn)  # Adjust this to every minute or as needed
+    if spool_enabled and spool is None:
+        spool = FeedSpools(api_endpoint_urls)
+    logging.info(f"Protobuf backend: {protobuf_backend()}, selective decoding: {selective_decode}")
+    with pool.connection() as conn:
+        ensure_table_exists(conn)
+        if spool is not None:
+            ensure_spool_tables(conn)
+        if headway_aggregator is not None:
+            ensure_rollup_tables(conn)
+        if lease_manager is not None:
+            ensure_lease_tables(conn)
+            lease_manager.refresh(conn)
+            logging.info(f"Ingest instance {lease_manager.instance_id} owns {lease_manager.owned_feeds()}")
 
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    pipeline = Pipeline(
+        fetch=fetch_changed_feeds,
+        transform=transform_feed,
+        load=spool_feed if spool is not None else lambda feed: load_feed(feed, pool),
+        interval=poll_interval,
+        queue_size=pipeline_queue_size,
+        drop_policy=pipeline_drop_policy,
+        on_drop=lambda feed: change_detector.reset(feed.url),
+        # Transformed feeds are diffed already, so a dropped one must reset its feed's diff state
+        load_drop_policy=pipeline_load_drop_policy,
+        on_load_drop=lambda feed: reset_feed_state(feed.url),
+        # With the spool, loading to the database happens in the drainers instead
+        load_workers=1 if spool is not None else db_pool_max_size,
+        # A feed's snapshots are diffs against each other, so each feed is pinned to one load thread
+        load_key=lambda feed: feed.url,
+        next_delay=(lambda: poller.next_delay(lease_manager.owned_feeds() if lease_manager is not None else None))
+        if poller is not None else None,
+    )
+    REGISTRY.register(Gauge('transit_pipeline', 'Pipeline tick, drop and queue depth counters.', ('stat',),
+                             function=pipeline.stats))
+    REGISTRY.register(Gauge('transit_db_pool', 'Database connection pool counters.', ('stat',),
+                            function=pool.stats))
+    REGISTRY.register(Gauge('transit_diff_tracked_trips', 'Trips held in memory by the state differ.',
+                            function=state_differ.tracked_trips))
+    if alert_differ is not None:
+        REGISTRY.register(Gauge('transit_diff_tracked_alerts', 'Active alerts held in memory by the alert differ.',
+                                function=alert_differ.tracked_alerts))
+    if headway_aggregator is not None:
+        REGISTRY.register(Gauge('transit_headway_tracked_trips', 'Trips whose predictions the headway aggregator holds.',
+                                function=headway_aggregator.tracked_trips))
+    if poller is not None:
+        REGISTRY.register(Gauge('transit_feed_publish_interval_seconds', 'Learned publish interval per feed.',
+                                ('feed',), function=poller.intervals))
+        REGISTRY.register(Gauge('transit_poller', 'Adaptive poller fetch, backoff and deferral counters.',
+                                ('stat',), function=poller.stats))
+    if spool is not None:
+        REGISTRY.register(Gauge('transit_spool', 'Spool backlog and counters.', ('stat',), function=spool.stats))
+    if lease_manager is not None:
+        REGISTRY.register(Gauge('transit_feed_owned', 'Whether this instance holds the lease of a feed.', ('feed',),
+                                function=lambda: {url: int(lease_manager.owns(url)) for url in api_endpoint_urls}))
+    if metrics_port:
+        start_metrics_server(metrics_port, metrics_host)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: pipeline.stop())
+
+    maintenance_stop = threading.Event()
+    threading.Thread(
+        target=run_partition_maintenance, args=(pool, maintenance_stop), name="partition-maintenance", daemon=True
+    ).start()
+    if lease_manager is not None:
+        threading.Thread(
+            target=lease_manager.run, args=(pool, maintenance_stop), name="lease-heartbeat", daemon=True
+        ).start()
+    rollup_flush = None
+    if headway_aggregator is not None:
+        rollup_flush = threading.Thread(
+            target=run_rollup_flush, args=(pool, maintenance_stop), name="rollup-flush", daemon=True
+        )
+        rollup_flush.start()
+    drain_stop = threading.Event()
+    # One drainer per feed, as a feed's batches must be committed in order
+    drainers = [
+        threading.Thread(target=run_drainer, args=(feed_spool, pool, load_spooled_batch, drain_stop),
+                         # The next batches of the feed are diffs against the quarantined one
+                         kwargs={'on_quarantine': lambda batch: reset_feed_state(batch['url'])},
+                         name=f"spool-drainer-{slug}", daemon=True)
+        for slug, feed_spool in (spool.spools.items() if spool is not None else ())
+    ]
+    for drainer in drainers:
+        drainer.start()
+    try:
+        pipeline.run()
+    finally:
+        maintenance_stop.set()
+        if rollup_flush is not None:
+            # Writes what was aggregated since the last flush
+            rollup_flush.join()
+        # Batches not loaded yet stay in the spool and are loaded after the next start
+        drain_stop.set()
+        for drainer in drainers:
+            drainer.join()
+        if spool is not None:
+            logging.info(f"Spool: {spool.stats()}")
+            spool.close()
+        if lease_manager is not None:
+            with pool.connection() as conn:
+                lease_manager.release_all(conn)
+        if feed_archive is not None:
+            feed_archive.close()
+    logging.info(f"Pipeline stopped: {pipeline.stats()}")
+    logging.info(f"Connection pool: {pool.stats()}")
@@ -0,0 +1,242 @@
+import logging
+import math
+import os
+import socket
+import threading
+import uuid
+import zlib
+from typing import List, Optional, Sequence, Set
+
+import psycopg2
+
+from src.data_loading.db_pool import ConnectionPool
+from config import lease_ttl, lease_heartbeat_interval
+
+LEASE_TABLE = 'realtime_feed_leases'
+INSTANCE_TABLE = 'realtime_ingest_instances'
+
+
+def ensure_lease_tables(conn: psycopg2.extensions.connection) -> None:
+    """
+    Creates the feed lease table and the instance status table.
+
+    Args:
+        conn (psycopg2.extensions.connection): A database connection object.
+    """
+
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {LEASE_TABLE} (
+                feed TEXT PRIMARY KEY,
+                instance_id VARCHAR(255) NOT NULL,
+                acquired_at TIMESTAMP NOT NULL,
+                heartbeat_at TIMESTAMP NOT NULL
+            )
+            """
+        )
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {INSTANCE_TABLE} (
+                instance_id VARCHAR(255) PRIMARY KEY,
+                host VARCHAR(255),
+                pid INTEGER,
+                started_at TIMESTAMP NOT NULL,
+                heartbeat_at TIMESTAMP NOT NULL,
+                feeds TEXT[] NOT NULL DEFAULT '{{}}'
+            )
+            """
+        )
+    conn.commit()
+
+
+class FeedLeaseManager:
+    """
+    Splits the feed endpoints between ingest instances through leases in Postgres.
+
+    Every `heartbeat_interval` seconds each instance renews its leases and claims feeds whose
+    lease is missing or has not been renewed for `ttl` seconds, up to its fair share of
+    ceil(feeds / live instances). An instance holding more than its share, e.g. after another
+    one started, releases the extra feeds. Claims are single-row upserts that only succeed on
+    an expired lease, so a feed is never owned by two instances. All times come from the
+    database clock.
+
+    A lease table is used rather than session advisory locks because pooled connections are
+    not tied to one session; with the default ttl and heartbeat a dead instance's feeds are
+    taken over within one poll interval.
+
+    Args:
+        feeds (Sequence[str]): All feed endpoints.
+        instance_id (Optional[str]): This instance's id, by default host, pid and a random suffix.
+        ttl (float): Seconds without renewal after which a lease can be claimed.
+        heartbeat_interval (float): Seconds between lease refreshes.
+    """
+
+    def __init__(
+            self,
+            feeds: Sequence[str],
+            instance_id: Optional[str] = None,
+            ttl: float = lease_ttl,
+            heartbeat_interval: float = lease_heartbeat_interval
+        ):
+        if heartbeat_interval >= ttl:
+            raise ValueError(f"Lease heartbeat interval ({heartbeat_interval}s) must be shorter than the ttl ({ttl}s)")
+        self.feeds = list(feeds)
+        self.instance_id = instance_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self._owned: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def owned_feeds(self) -> List[str]:
+        """Returns the feeds this instance holds a lease on, in configuration order."""
+        with self._lock:
+            return [feed for feed in self.feeds if feed in self._owned]
+
+    def owns(self, feed: str) -> bool:
+        """Checks whether this instance still holds the lease of a feed."""
+        with self._lock:
+            return feed in self._owned
+
+    def holds(self, cur, feed: str) -> bool:
+        """
+        Checks inside the caller's transaction, just before it commits, that this instance
+        still holds the lease of a feed.
+
+        The lease row is locked until the transaction ends, so another instance cannot claim
+        the feed and commit newer rows before the caller's commit.
+
+        Args:
+            cur (psycopg2.extensions.cursor): The cursor of the open transaction.
+            feed (str): The feed endpoint.
+
+        Returns:
+            bool: False if the lease was lost or has expired, in which case the caller should roll back.
+        """
+        if not self.owns(feed):
+            return False
+        cur.execute(f"SELECT 1 FROM {LEASE_TABLE} WHERE feed = %s AND instance_id = %s "
+                    "AND heartbeat_at > NOW() - make_interval(secs => %s) FOR SHARE",
+                    (feed, self.instance_id, self.ttl))
+        return cur.fetchone() is not None
+
+    def _claim_order(self) -> List[str]:
+        """Orders feeds differently per instance, so instances starting together claim different feeds."""
+        return sorted(self.feeds, key=lambda feed: zlib.crc32(f"{self.instance_id}/{feed}".encode()))
+
+    def refresh(self, conn: psycopg2.extensions.connection) -> List[str]:
+        """
+        Renews, rebalances and claims leases in one transaction.
+
+        Args:
+            conn (psycopg2.extensions.connection): A database connection object.
+
+        Returns:
+            List[str]: The feeds owned after the refresh.
+        """
+
+        ttl = self.ttl
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"INSERT INTO {INSTANCE_TABLE} (instance_id, host, pid, started_at, heartbeat_at) "
+                    "VALUES (%s, %s, %s, NOW(), NOW()) "
+                    "ON CONFLICT (instance_id) DO UPDATE SET heartbeat_at = NOW()",
+                    (self.instance_id, socket.gethostname(), os.getpid())
+                )
+                cur.execute(f"SELECT count(*) FROM {INSTANCE_TABLE} "
+                            "WHERE heartbeat_at > NOW() - make_interval(secs => %s)", (ttl,))
+                live_instances = max(cur.fetchone()[0], 1)
+                share = math.ceil(len(self.feeds) / live_instances)
+
+                cur.execute(f"UPDATE {LEASE_TABLE} SET heartbeat_at = NOW() WHERE instance_id = %s RETURNING feed",
+                            (self.instance_id,))
+                owned = [feed for (feed,) in cur.fetchall()]
+
+                # Give back feeds that were removed from the configuration or exceed the fair share
+                keep = [feed for feed in self._claim_order() if feed in owned][:share]
+                release = [feed for feed in owned if feed not in keep]
+                if release:
+                    cur.execute(f"DELETE FROM {LEASE_TABLE} WHERE instance_id = %s AND feed = ANY(%s)",
+                                (self.instance_id, release))
+                    logging.info(f"Released {len(release)} feed(s) for rebalancing: {', '.join(release)}")
+
+                claimed = []
+                for feed in self._claim_order():
+                    if len(keep) + len(claimed) >= share:
+                        break
+                    if feed in keep:
+                        continue
+                    cur.execute(
+                        f"""
+                        INSERT INTO {LEASE_TABLE} (feed, instance_id, acquired_at, heartbeat_at)
+                        VALUES (%s, %s, NOW(), NOW())
+                        ON CONFLICT (feed) DO UPDATE
+                        SET instance_id = EXCLUDED.instance_id, acquired_at = NOW(), heartbeat_at = NOW()
+                        WHERE {LEASE_TABLE}.heartbeat_at < NOW() - make_interval(secs => %s)
+                        RETURNING feed
+                        """,
+                        (feed, self.instance_id, ttl)
+                    )
+                    if cur.fetchone():
+                        claimed.append(feed)
+                if claimed:
+                    logging.info(f"Claimed {len(claimed)} feed(s): {', '.join(claimed)}")
+
+                owned = keep + claimed
+                cur.execute(f"UPDATE {INSTANCE_TABLE} SET feeds = %s WHERE instance_id = %s",
+                            (owned, self.instance_id))
+                # Forget instances that have been gone for a day
+                cur.execute(f"DELETE FROM {INSTANCE_TABLE} WHERE heartbeat_at < NOW() - INTERVAL '1 day'")
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            # Leases that were not renewed may be claimed by others, stop ingesting all of them
+            with self._lock:
+                self._owned.clear()
+            logging.error(f"Lease refresh failed, pausing ingest until the next heartbeat: {e}")
+            return []
+
+        with self._lock:
+            self._owned = set(owned)
+        return self.owned_feeds()
+
+    def release_all(self, conn: psycopg2.extensions.connection) -> None:
+        """
+        Gives up every lease and the instance row, so other instances take over at once.
+
+        Args:
+            conn (psycopg2.extensions.connection): A database connection object.
+        """
+
+        with self._lock:
+            self._owned.clear()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"DELETE FROM {LEASE_TABLE} WHERE instance_id = %s", (self.instance_id,))
+                cur.execute(f"DELETE FROM {INSTANCE_TABLE} WHERE instance_id = %s", (self.instance_id,))
+            conn.commit()
+            logging.info(f"Released all feed leases of {self.instance_id}")
+        except psycopg2.Error as e:
+            conn.rollback()
+            logging.error(f"Could not release feed leases: {e}")
+
+    def run(self, pool: ConnectionPool, stop_event: threading.Event) -> None:
+        """
+        Refreshes the leases every `heartbeat_interval` seconds until `stop_event` is set.
+
+        Args:
+            pool (ConnectionPool): The database connection pool.
+            stop_event (threading.Event): Set to stop the loop.
+        """
+
+        while True:
+            try:
+                with pool.connection() as conn:
+                    self.refresh(conn)
+            except Exception as e:
+                with self._lock:
+                    self._owned.clear()
+                logging.error(f"Lease heartbeat failed: {e}")
+            if stop_event.wait(self.heartbeat_interval):
+                return
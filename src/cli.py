@@ -0,0 +1,111 @@
+"""
+Command line entry point of the pipeline.
+
+    python main.py ingest            run the ingest pipeline (also the default without a command)
+    python main.py load-static       load the static GTFS tables
+    python main.py replay ...        replay stored raw feeds, see `replay --help`
+    python main.py export ...        export the realtime history to Parquet, see `export --help`
+    python main.py bench NAME ...    run a benchmark: pipeline, decode, transform, static-index or startup
+    python main.py status            show the ingest process, local storage and database state
+
+Each command imports what it needs when it runs, so `--help` and `status` start without
+loading protobuf, numpy, pyarrow or the database loaders.
+"""
+import argparse
+import importlib
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+BENCHMARKS = {
+    'pipeline': 'benchmarks.bench_pipeline',
+    'decode': 'benchmarks.bench_decode',
+    'transform': 'benchmarks.bench_transform',
+    'static-index': 'benchmarks.bench_static_index',
+    'startup': 'benchmarks.bench_startup',
+}
+
+
+def ingest(argv: List[str]) -> None:
+    """Runs the ingest pipeline until interrupted."""
+    argparse.ArgumentParser(prog='main.py ingest', description=ingest.__doc__).parse_args(argv)
+
+    from config import db_params
+    from src.automation.scheduler import setup_schedule
+    from src.data_loading.db_pool import ConnectionPool
+
+    # DB connection pool, reconnects automatically if the database goes away
+    pool = ConnectionPool(db_params)
+    try:
+        setup_schedule(pool)
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+    finally:
+        logging.info("Closing database connections...")
+        pool.closeall()
+
+
+def load_static(argv: List[str]) -> None:
+    """Loads the static GTFS files into their tables."""
+    from config import db_params, gtfs_path
+
+    parser = argparse.ArgumentParser(prog='main.py load-static', description=load_static.__doc__)
+    parser.add_argument('--path', default=gtfs_path, help="Directory holding the GTFS .txt files")
+    args = parser.parse_args(argv)
+
+    from src.data_loading.load_static_gtfs import load_data_to_db
+    load_data_to_db(db_params, args.path)
+
+
+def replay(argv: List[str]) -> None:
+    """Replays stored raw feeds into the realtime tables."""
+    from src.automation import replay as replay_module
+    replay_module.main(argv)
+
+
+def export(argv: List[str]) -> None:
+    """Exports the realtime history to partitioned Parquet files."""
+    from src.automation import export as export_module
+    export_module.main(argv)
+
+
+def bench(argv: List[str]) -> None:
+    """Runs one of the benchmarks, passing it the remaining arguments."""
+    if not argv or argv[0] not in BENCHMARKS:
+        argparse.ArgumentParser(prog='main.py bench', description=bench.__doc__).error(
+            f"choose a benchmark: {', '.join(BENCHMARKS)}")
+    importlib.import_module(BENCHMARKS[argv[0]]).main(argv[1:])
+
+
+def status(argv: List[str]) -> None:
+    """Shows the running ingest process, local storage and database state."""
+    argparse.ArgumentParser(prog='main.py status', description=status.__doc__).parse_args(argv)
+
+    from src.monitoring.status import print_status
+    print_status()
+
+
+# command -> (function, modules it imports); the modules are what the startup benchmark measures
+COMMANDS: Dict[str, Tuple[Callable[[List[str]], None], Tuple[str, ...]]] = {
+    'ingest': (ingest, ('src.automation.scheduler', 'src.data_loading.db_pool')),
+    'load-static': (load_static, ('src.data_loading.load_static_gtfs',)),
+    'replay': (replay, ('src.automation.replay',)),
+    'export': (export, ('src.automation.export',)),
+    'bench': (bench, ()),
+    'status': (status, ('src.monitoring.status',)),
+}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog='main.py', description=__doc__.splitlines()[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog='\n'.join(__doc__.splitlines()[3:9]))
+    parser.add_argument('--log-level', default='INFO', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    for name, (function, _) in COMMANDS.items():
+        # Each command parses its own arguments, including --help
+        commands.add_parser(name, help=function.__doc__, add_help=False)
+    args, rest = parser.parse_known_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+    function, _ = COMMANDS[args.command or 'ingest']
+    function(rest)
@@ -0,0 +1,93 @@
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from src.data_transformation.binary_decoder import read_header_timestamp
+
+# Default of has_changed's header_timestamp, as None is a valid parsed timestamp
+_UNPARSED = object()
+
+
+class FeedChangeDetector:
+    """
+    Remembers the last FeedHeader timestamp and payload digest of each endpoint so that
+    unchanged snapshots can be skipped before they are stored, decoded and loaded.
+
+    A snapshot is remembered as soon as it is seen, so a caller that fails to load it must
+    call reset(), or the same bytes fetched again would be skipped and never loaded.
+    """
+
+    def __init__(self):
+        self._last_timestamp: Dict[str, int] = {}
+        self._last_digest: Dict[str, bytes] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def has_changed(self, url: str, binary_data: bytes, header_timestamp: Any = _UNPARSED) -> bool:
+        """
+        Checks whether a freshly fetched feed differs from the last one seen for its endpoint.
+
+        A feed is considered unchanged when its payload digest matches the previous one, or
+        when its header timestamp is set and equal to the previous one (no new snapshot published).
+
+        Args:
+            url (str): The endpoint the feed was fetched from.
+            binary_data (bytes): The fetched feed.
+            header_timestamp (Optional[int]): The feed's header timestamp if the caller parsed it
+                already, read from `binary_data` otherwise.
+
+        Returns:
+            bool: True if the feed should be processed, False if it can be skipped.
+        """
+
+        digest = hashlib.blake2b(binary_data, digest_size=16).digest()
+        timestamp = read_header_timestamp(binary_data) if header_timestamp is _UNPARSED else header_timestamp
+
+        with self._lock:
+            counts = self._counts.setdefault(url, {"processed": 0, "skipped_digest": 0, "skipped_timestamp": 0})
+            if self._last_digest.get(url) == digest:
+                counts["skipped_digest"] += 1
+                return False
+            if timestamp and self._last_timestamp.get(url) == timestamp:
+                counts["skipped_timestamp"] += 1
+                return False
+
+            self._last_digest[url] = digest
+            if timestamp:
+                self._last_timestamp[url] = timestamp
+            counts["processed"] += 1
+            return True
+
+    def reset(self, url: str) -> None:
+        """
+        Forgets the last snapshot of an endpoint, so that the next one is processed even if it is the same.
+
+        Args:
+            url (str): The endpoint url.
+        """
+        with self._lock:
+            self._last_digest.pop(url, None)
+            self._last_timestamp.pop(url, None)
+
+    def last_timestamp(self, url: str) -> Optional[int]:
+        """Returns the header timestamp of the last processed feed for an endpoint."""
+        with self._lock:
+            return self._last_timestamp.get(url)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns the processed / skipped counts for each endpoint.
+
+        Returns:
+            Dict[str, Dict[str, int]]: A copy of the counters keyed by endpoint url.
+        """
+        with self._lock:
+            return {url: dict(counts) for url, counts in self._counts.items()}
+
+    def log_stats(self) -> None:
+        """Logs how many feeds have been skipped so far across all endpoints."""
+        stats = self.stats()
+        processed = sum(counts["processed"] for counts in stats.values())
+        skipped = sum(counts["skipped_digest"] + counts["skipped_timestamp"] for counts in stats.values())
+        logging.info(f"Change detector: {processed} feeds processed, {skipped} unchanged feeds skipped")
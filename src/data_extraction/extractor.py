@@ -1,24 +1,144 @@
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+
 import requests
-from typing import Optional
+from requests.adapters import HTTPAdapter
 
-def fetch_binary_data(api_endpoint: str, api_key: str) -> Optional[bytes]:
+from config import fetch_timeout, fetch_max_workers
+from src.monitoring.metrics import STAGE_SECONDS, FETCH_BYTES, FETCH_RESPONSES, ERRORS
+
+# Shared HTTP session so connections to the MTA endpoints are kept alive between polls
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# Last ETag / Last-Modified seen per endpoint, used for conditional requests
+_validators: Dict[str, Dict[str, str]] = {}
+_validators_lock = threading.Lock()
+
+
+class FetchResult(NamedTuple):
+    """Outcome of fetching a single feed endpoint."""
+    url: str
+    data: Optional[bytes]
+    status: Optional[int]
+    latency: float
+
+
+def get_session() -> requests.Session:
     """
-    Fetches binary data from the specified API endpoint using the provided API key.
+    Returns the shared, connection-pooled HTTP session, creating it on first use.
+
+    Returns:
+        requests.Session: The shared session.
+    """
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=fetch_max_workers, pool_maxsize=fetch_max_workers)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def _conditional_headers(api_endpoint: str) -> Dict[str, str]:
+    """Builds If-None-Match / If-Modified-Since headers from the last response of an endpoint."""
+    with _validators_lock:
+        validators = _validators.get(api_endpoint, {})
+    headers = {}
+    if "etag" in validators:
+        headers['If-None-Match'] = validators["etag"]
+    if "last_modified" in validators:
+        headers['If-Modified-Since'] = validators["last_modified"]
+    return headers
+
+
+def _remember_validators(api_endpoint: str, response: requests.Response) -> None:
+    """Stores the ETag / Last-Modified headers of a successful response."""
+    validators = {}
+    if response.headers.get('ETag'):
+        validators["etag"] = response.headers['ETag']
+    if response.headers.get('Last-Modified'):
+        validators["last_modified"] = response.headers['Last-Modified']
+    with _validators_lock:
+        _validators[api_endpoint] = validators
+
+
+def fetch_feed(api_endpoint: str, api_key: str) -> FetchResult:
+    """
+    Fetches a single feed using the shared session, a request timeout and conditional headers.
 
     Args:
         api_endpoint (str): The URL of the API endpoint to fetch data from.
         api_key (str): The API key to use for authentication.
 
     Returns:
-        Optional[bytes]: The binary data fetched from the API, or None if an error occurs.
+        FetchResult: The fetched data (None when unchanged or on error), HTTP status and latency in seconds.
     """
-    
+
+    start_time = time.perf_counter()
+    headers = {'x-api-key': api_key}
+    headers.update(_conditional_headers(api_endpoint))
     try:
-        headers = {'x-api-key': api_key}
-        response = requests.get(api_endpoint, headers=headers)
+        response = get_session().get(api_endpoint, headers=headers, timeout=fetch_timeout)
+        latency = time.perf_counter() - start_time
+        STAGE_SECONDS.observe(latency, 'fetch', api_endpoint)
+        FETCH_RESPONSES.inc(api_endpoint, response.status_code)
+        if response.status_code == 304:
+            logging.info(f"Feed not modified: {api_endpoint} ({latency:.3f}s)")
+            return FetchResult(api_endpoint, None, 304, latency)
         response.raise_for_status()  # check for HTTP request errors
-        return response.content
+        _remember_validators(api_endpoint, response)
+        FETCH_BYTES.inc(api_endpoint, amount=len(response.content))
+        logging.info(f"Fetched {len(response.content)} bytes from {api_endpoint} in {latency:.3f}s")
+        return FetchResult(api_endpoint, response.content, response.status_code, latency)
     except requests.RequestException as e:
-        logging.exception(f"An error occurred while making a request:")
-        return None
\ No newline at end of file
+        latency = time.perf_counter() - start_time
+        logging.exception(f"An error occurred while making a request to {api_endpoint}:")
+        status = e.response.status_code if e.response is not None else None
+        if status is None:
+            STAGE_SECONDS.observe(latency, 'fetch', api_endpoint)
+            FETCH_RESPONSES.inc(api_endpoint, 'error')
+        ERRORS.inc('fetch', api_endpoint)
+        return FetchResult(api_endpoint, None, status, latency)
+
+
+def fetch_binary_data(api_endpoint: str, api_key: str) -> Optional[bytes]:
+    """
+    Fetches binary data from the specified API endpoint using the provided API key.
+
+    Args:
+        api_endpoint (str): The URL of the API endpoint to fetch data from.
+        api_key (str): The API key to use for authentication.
+
+    Returns:
+        Optional[bytes]: The binary data fetched from the API, or None if the feed is unchanged or an error occurs.
+    """
+
+    return fetch_feed(api_endpoint, api_key).data
+
+
+def fetch_all_feeds(api_endpoints: List[str], api_key: str) -> List[FetchResult]:
+    """
+    Fetches every endpoint concurrently on a thread pool.
+
+    Args:
+        api_endpoints (List[str]): The URLs of the API endpoints to fetch.
+        api_key (str): The API key to use for authentication.
+
+    Returns:
+        List[FetchResult]: One result per endpoint, in the same order as `api_endpoints`.
+    """
+
+    if not api_endpoints:
+        return []
+    with ThreadPoolExecutor(max_workers=min(fetch_max_workers, len(api_endpoints))) as executor:
+        results = list(executor.map(lambda url: fetch_feed(url, api_key), api_endpoints))
+    for result in results:
+        logging.debug(f"Fetch latency for {result.url}: {result.latency:.3f}s (status {result.status})")
+    return results
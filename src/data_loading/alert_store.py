@@ -0,0 +1,172 @@
+import datetime
+import hashlib
+import logging
+from typing import Dict, Optional
+
+import psycopg2
+import psycopg2.extras
+
+from src.data_transformation.alert_state import AlertChanges
+
+VERSIONS_TABLE = 'realtime_alert_versions'
+
+
+def _timestamp(epoch: Optional[float]) -> Optional[datetime.datetime]:
+    """Converts epoch seconds to a naive UTC datetime, like every time the pipeline stores."""
+    return datetime.datetime.utcfromtimestamp(epoch) if epoch else None
+
+
+def text_hash(text: str) -> str:
+    """Returns the key under which a text is interned in realtime_alert_texts."""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def write_alert_changes(cur, changes: AlertChanges) -> int:
+    """
+    Applies the alert changes of one snapshot inside the caller's transaction.
+
+    Every distinct content of an alert is one row in realtime_alert_versions, open
+    (cleared_at NULL) while the alert is in the feed. A changed alert closes its open version
+    and opens a new one with its informed entities, active periods and translations; texts are
+    stored once in realtime_alert_texts and referenced by hash. Changes older than the stored
+    version of an alert, e.g. from a spooled batch loaded out of order, are ignored.
+
+    Args:
+        cur (psycopg2.extensions.cursor): The cursor of the open transaction.
+        changes (AlertChanges): The changes computed by AlertStateDiffer.
+
+    Returns:
+        int: The number of alert versions opened.
+    """
+
+    if not changes:
+        return 0
+    seen_at = _timestamp(changes.seen_at)
+
+    # Latest version of every open alert and of every alert in the snapshot
+    cur.execute(
+        f"""
+        SELECT DISTINCT ON (alert_id) alert_id, id, content_hash, first_seen, cleared_at
+        FROM {VERSIONS_TABLE}
+        WHERE feed = %s AND (cleared_at IS NULL OR alert_id = ANY(%s))
+        ORDER BY alert_id, first_seen DESC
+        """,
+        (changes.feed, [record.alert_id for record in changes.changed])
+    )
+    latest = {row[0]: row[1:] for row in cur.fetchall()}
+
+    def current(alert_id: str) -> Optional[tuple]:
+        """Returns (id, content_hash) of the open version, or None; raises LookupError if the change is stale."""
+        version = latest.get(alert_id)
+        if version is None:
+            return None
+        version_id, content_hash, first_seen, cleared_at = version
+        if first_seen > seen_at or (cleared_at is not None and cleared_at > seen_at):
+            raise LookupError(alert_id)
+        return (version_id, content_hash) if cleared_at is None else None
+
+    close = []
+    opened = []
+    for record in changes.changed:
+        try:
+            version = current(record.alert_id)
+        except LookupError:
+            continue
+        if version is not None:
+            if version[1] == record.content_hash:
+                continue  # unchanged, e.g. the first snapshot after a restart
+            close.append(version[0])
+        opened.append(record)
+
+    to_clear = list(changes.cleared)
+    if changes.present is not None:
+        present = set(changes.present)
+        to_clear.extend(alert_id for alert_id in latest if alert_id not in present)
+    for alert_id in to_clear:
+        try:
+            version = current(alert_id)
+        except LookupError:
+            continue
+        if version is not None:
+            close.append(version[0])
+
+    if close:
+        cur.execute(f"UPDATE {VERSIONS_TABLE} SET cleared_at = %s WHERE id = ANY(%s)", (seen_at, close))
+    if not opened:
+        return 0
+
+    texts: Dict[str, str] = {}
+    for record in opened:
+        for _, _, text in record.translations:
+            texts.setdefault(text_hash(text), text)
+    if texts:
+        psycopg2.extras.execute_values(
+            cur, "INSERT INTO realtime_alert_texts (text_hash, text) VALUES %s ON CONFLICT DO NOTHING",
+            sorted(texts.items())
+        )
+
+    rows = psycopg2.extras.execute_values(
+        cur,
+        f"INSERT INTO {VERSIONS_TABLE} (feed, alert_id, content_hash, cause, effect, first_seen) "
+        "VALUES %s RETURNING alert_id, id",
+        [(changes.feed, r.alert_id, r.content_hash, r.cause, r.effect, seen_at) for r in opened],
+        fetch=True
+    )
+    version_ids = dict(rows)
+
+    entities, periods, translations = [], [], []
+    for record in opened:
+        version_id = version_ids[record.alert_id]
+        entities.extend((version_id,) + entity for entity in record.informed_entities)
+        periods.extend((version_id, _timestamp(start), _timestamp(end)) for start, end in record.active_periods)
+        translations.extend((version_id, field, language, text_hash(text))
+                            for field, language, text in record.translations)
+    if entities:
+        psycopg2.extras.execute_values(
+            cur, "INSERT INTO realtime_alert_entities (version_id, agency_id, route_id, route_type, trip_id, stop_id) "
+                 "VALUES %s", entities
+        )
+    if periods:
+        psycopg2.extras.execute_values(
+            cur, "INSERT INTO realtime_alert_active_periods (version_id, period_start, period_end) VALUES %s", periods
+        )
+    if translations:
+        psycopg2.extras.execute_values(
+            cur, "INSERT INTO realtime_alert_translations (version_id, field, language, text_hash) VALUES %s",
+            translations
+        )
+    logging.info(f"Alerts of {changes.feed}: {len(opened)} opened, {len(close)} closed")
+    return len(opened)
+
+
+def prune_alert_history(conn: psycopg2.extensions.connection, days: float) -> None:
+    """
+    Deletes alert versions cleared more than `days` ago, and the texts no longer referenced.
+
+    The texts table is locked against writes while unreferenced texts are deleted, so a load
+    that interned a text it is about to reference either commits first or waits for the prune.
+
+    Args:
+        conn (psycopg2.extensions.connection): A database connection object.
+        days (float): Days of cleared alerts to keep.
+    """
+
+    try:
+        with conn.cursor() as cur:
+            # Entities, periods and translations go with their version (ON DELETE CASCADE)
+            cur.execute(f"DELETE FROM {VERSIONS_TABLE} "
+                        f"WHERE cleared_at < NOW() AT TIME ZONE 'UTC' - make_interval(secs => %s)", (days * 86400,))
+            versions = cur.rowcount
+            # Conflicts with the ROW EXCLUSIVE lock that interning a text takes, but not with reads
+            cur.execute("LOCK TABLE realtime_alert_texts IN SHARE ROW EXCLUSIVE MODE")
+            cur.execute(
+                "DELETE FROM realtime_alert_texts t WHERE NOT EXISTS "
+                "(SELECT 1 FROM realtime_alert_translations r WHERE r.text_hash = t.text_hash)"
+            )
+            texts = cur.rowcount
+        conn.commit()
+        if versions or texts:
+            logging.info(f"Pruned {versions} cleared alert versions and {texts} unused alert texts")
+    except psycopg2.Error as e:
+        logging.error(f"Could not prune alert history: {e}")
+        conn.rollback()
@@ -0,0 +1,149 @@
+import datetime
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import psycopg2
+import psycopg2.extras
+
+CURRENT_TRIP_UPDATES_TABLE = 'realtime_current_trip_updates'
+CURRENT_VEHICLE_POSITIONS_TABLE = 'realtime_current_vehicle_positions'
+CURRENT_TRIPS_TABLE = 'realtime_current_trips'
+
+# Seconds by which a trip's last_seen may lag, so unchanged trips are not rewritten on every poll
+SEEN_RESOLUTION = 60
+
+
+def _upsert(cur, table: str, columns: Sequence[str], key: Sequence[str], rows: List[tuple],
+            last_updated: Optional[datetime.datetime]) -> int:
+    """
+    Inserts or replaces the rows of a current-state table, keeping whichever version is newer.
+
+    Rows are deduplicated on `key` first, the last one winning, since one statement cannot
+    update the same row twice.
+    """
+    key_positions = [columns.index(column) for column in key]
+    latest = {tuple(row[i] for i in key_positions): row for row in rows}
+    if not latest:
+        return 0
+    psycopg2.extras.execute_values(
+        cur,
+        f"INSERT INTO {table} ({', '.join(columns)}, last_updated) VALUES %s "
+        f"ON CONFLICT ({', '.join(key)}) DO UPDATE SET "
+        + ', '.join(f"{column} = EXCLUDED.{column}" for column in columns if column not in key)
+        + ", last_updated = EXCLUDED.last_updated "
+        # A spooled batch loaded late must not overwrite a newer state
+        f"WHERE {table}.last_updated <= EXCLUDED.last_updated",
+        [row + (last_updated,) for row in latest.values()],
+        template=f"({', '.join(['%s'] * len(columns))}, COALESCE(%s::timestamp, NOW() AT TIME ZONE 'UTC'))",
+        page_size=1000
+    )
+    return len(latest)
+
+
+def _touch_trips(cur, seen_trips: List[Tuple[str, str]], last_seen: Optional[datetime.datetime]) -> None:
+    """Records the trips of a snapshot as seen, skipping the ones seen within SEEN_RESOLUTION seconds."""
+    latest = dict(seen_trips)
+    if not latest:
+        return
+    psycopg2.extras.execute_values(
+        cur,
+        f"INSERT INTO {CURRENT_TRIPS_TABLE} (trip_id, route_id, last_seen) VALUES %s "
+        f"ON CONFLICT (trip_id) DO UPDATE SET route_id = EXCLUDED.route_id, last_seen = EXCLUDED.last_seen "
+        f"WHERE {CURRENT_TRIPS_TABLE}.last_seen < EXCLUDED.last_seen - make_interval(secs => {SEEN_RESOLUTION})",
+        [(trip_id, route_id, last_seen) for trip_id, route_id in latest.items()],
+        template="(%s, %s, COALESCE(%s::timestamp, NOW() AT TIME ZONE 'UTC'))",
+        page_size=1000
+    )
+
+
+def write_current_state(
+        cur,
+        trip_updates: List[tuple],
+        trip_update_columns: Sequence[str],
+        vehicle_positions: List[tuple],
+        vehicle_position_columns: Sequence[str],
+        trip_events: Optional[List[Dict]] = None,
+        last_updated: Optional[datetime.datetime] = None,
+        seen_trips: Optional[List[Tuple[str, str]]] = None
+    ) -> Dict[str, int]:
+    """
+    Applies one feed's new or changed rows to the current-state tables inside the caller's transaction.
+
+    realtime_current_trip_updates holds the latest prediction per (trip_id, stop_id) and
+    realtime_current_vehicle_positions the latest position per trip_id, so point lookups do not
+    have to search the history for the newest row. Unchanged rows are dropped by the state
+    differ before loading and keep their stored version. Trips that disappeared from the feed
+    are deleted from both tables. Every trip of the snapshot, changed or not, is recorded in
+    realtime_current_trips, which expire_current_state goes by.
+
+    Args:
+        cur (psycopg2.extensions.cursor): The cursor of the open transaction.
+        trip_updates (List[tuple]): Trip update rows ordered like `trip_update_columns`.
+        trip_update_columns (Sequence[str]): The columns of the trip update rows.
+        vehicle_positions (List[tuple]): Vehicle position rows ordered like `vehicle_position_columns`.
+        vehicle_position_columns (Sequence[str]): The columns of the vehicle position rows.
+        trip_events (list, optional): Trip event dictionaries; 'disappeared' trips are expired.
+        last_updated (datetime.datetime, optional): The time of the rows in UTC, defaults to the insert time.
+        seen_trips (list, optional): (trip_id, route_id) of every trip of the snapshot, see
+            TripStateDiffer.trips. Defaults to the trips of the given rows.
+
+    Returns:
+        Dict[str, int]: The number of rows written per current-state table.
+    """
+
+    trip_id, stop_id = trip_update_columns.index('trip_id'), trip_update_columns.index('stop_id')
+    written = {
+        CURRENT_TRIP_UPDATES_TABLE: _upsert(
+            cur, CURRENT_TRIP_UPDATES_TABLE, trip_update_columns, ('trip_id', 'stop_id'),
+            [row for row in trip_updates if row[trip_id] and row[stop_id]], last_updated),
+        CURRENT_VEHICLE_POSITIONS_TABLE: _upsert(
+            cur, CURRENT_VEHICLE_POSITIONS_TABLE, vehicle_position_columns, ('trip_id',),
+            [row for row in vehicle_positions if row[vehicle_position_columns.index('trip_id')]], last_updated),
+    }
+
+    if seen_trips is None:
+        route_id = trip_update_columns.index('route_id')
+        seen_trips = [(row[trip_id], row[route_id]) for row in trip_updates if row[trip_id]]
+        trip_id, route_id = vehicle_position_columns.index('trip_id'), vehicle_position_columns.index('route_id')
+        seen_trips += [(row[trip_id], row[route_id]) for row in vehicle_positions if row[trip_id]]
+    _touch_trips(cur, seen_trips, last_updated)
+
+    gone = [event['trip_id'] for event in trip_events or () if event['event'] == 'disappeared']
+    if gone:
+        cur.execute(f"DELETE FROM {CURRENT_TRIPS_TABLE} WHERE trip_id = ANY(%s) "
+                    f"AND last_seen <= COALESCE(%s::timestamp, NOW() AT TIME ZONE 'UTC')", (gone, last_updated))
+        for table in (CURRENT_TRIP_UPDATES_TABLE, CURRENT_VEHICLE_POSITIONS_TABLE):
+            cur.execute(f"DELETE FROM {table} WHERE trip_id = ANY(%s) "
+                        f"AND last_updated <= COALESCE(%s::timestamp, NOW() AT TIME ZONE 'UTC')",
+                        (gone, last_updated))
+    return written
+
+
+def expire_current_state(conn: psycopg2.extensions.connection, max_age: float) -> None:
+    """
+    Deletes the trips of the current-state tables not seen in their feed for `max_age` seconds.
+
+    Catches trips whose disappearance was never observed, e.g. while the ingest was stopped.
+    Trips go by their last_seen in realtime_current_trips rather than by their rows'
+    last_updated, since trips that are still in the feed but unchanged are not rewritten.
+
+    Args:
+        conn (psycopg2.extensions.connection): A database connection object.
+        max_age (float): Age in seconds after which a row is stale.
+    """
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DELETE FROM {CURRENT_TRIPS_TABLE} "
+                        f"WHERE last_seen < NOW() AT TIME ZONE 'UTC' - make_interval(secs => %s)", (max_age,))
+            expired = 0
+            for table in (CURRENT_TRIP_UPDATES_TABLE, CURRENT_VEHICLE_POSITIONS_TABLE):
+                cur.execute(f"DELETE FROM {table} WHERE NOT EXISTS ("
+                            f"SELECT 1 FROM {CURRENT_TRIPS_TABLE} WHERE trip_id = {table}.trip_id)")
+                expired += cur.rowcount
+        conn.commit()
+        if expired:
+            logging.info(f"Expired {expired} stale current-state rows")
+    except psycopg2.Error as e:
+        logging.error(f"Could not expire current-state rows: {e}")
+        conn.rollback()
@@ -0,0 +1,210 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+from config import db_pool_max_size, db_health_check_interval, db_reconnect_max_backoff
+
+
+class ConnectionPool:
+    """
+    A blocking, thread-safe pool of psycopg2 connections.
+
+    Connections are opened lazily up to `max_size`. A connection that has been idle for longer
+    than `health_check_interval` seconds is checked with `SELECT 1` before it is handed out, and
+    broken connections are discarded and replaced. Opening a connection retries with exponential
+    backoff, so the ingest process survives a database restart.
+
+    Args:
+        db_params (dict): Keyword arguments for psycopg2.connect.
+        max_size (int): Maximum number of open connections.
+        health_check_interval (float): Idle seconds after which a connection is checked before use.
+        max_backoff (float): Upper bound in seconds on the delay between reconnect attempts.
+    """
+
+    def __init__(
+            self,
+            db_params: dict,
+            max_size: int = db_pool_max_size,
+            health_check_interval: float = db_health_check_interval,
+            max_backoff: float = db_reconnect_max_backoff
+        ):
+        self.db_params = db_params
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self.max_backoff = max_backoff
+        self._idle: List[Tuple[psycopg2.extensions.connection, float]] = []
+        self._in_use = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._metrics = {
+            "acquired": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "connects": 0,
+            "reconnect_attempts": 0,
+            "discarded": 0,
+        }
+
+    def _connect(self) -> psycopg2.extensions.connection:
+        """Opens a new connection, retrying with exponential backoff until it succeeds or the pool closes."""
+        delay = 0.5
+        while True:
+            try:
+                conn = psycopg2.connect(**self.db_params)
+                with self._condition:
+                    self._metrics["connects"] += 1
+                return conn
+            except psycopg2.OperationalError as e:
+                with self._condition:
+                    if self._closed:
+                        raise
+                    self._metrics["reconnect_attempts"] += 1
+                logging.warning(f"Could not connect to the database, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+
+    def _healthy(self, conn: psycopg2.extensions.connection, idle_since: float) -> bool:
+        """Checks a connection that is about to be handed out."""
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn: psycopg2.extensions.connection) -> None:
+        with self._condition:
+            self._metrics["discarded"] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self, timeout: Optional[float] = None) -> psycopg2.extensions.connection:
+        """
+        Takes a healthy connection from the pool, waiting if all connections are in use.
+
+        Args:
+            timeout (Optional[float]): Seconds to wait for a free connection, or None to wait forever.
+
+        Returns:
+            psycopg2.extensions.connection: A connection that must be returned with putconn.
+        """
+
+        start = time.monotonic()
+        with self._condition:
+            waited = False
+            while not self._idle and self._in_use >= self.max_size:
+                if self._closed:
+                    raise psycopg2.pool.PoolError("connection pool is closed")
+                waited = True
+                remaining = None if timeout is None else timeout - (time.monotonic() - start)
+                if remaining is not None and remaining <= 0:
+                    raise psycopg2.pool.PoolError("timed out waiting for a database connection")
+                self._condition.wait(remaining)
+            if self._closed:
+                raise psycopg2.pool.PoolError("connection pool is closed")
+            entry = self._idle.pop() if self._idle else None
+            self._in_use += 1
+
+            wait_time = time.monotonic() - start
+            self._metrics["acquired"] += 1
+            if waited:
+                self._metrics["waits"] += 1
+            self._metrics["wait_time_total"] += wait_time
+            self._metrics["wait_time_max"] = max(self._metrics["wait_time_max"], wait_time)
+
+        try:
+            if entry is not None:
+                conn, idle_since = entry
+                if self._healthy(conn, idle_since):
+                    return conn
+                logging.warning("Discarding broken database connection")
+                self._discard(conn)
+            return self._connect()
+        except BaseException:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+    def putconn(self, conn: psycopg2.extensions.connection) -> None:
+        """
+        Returns a connection to the pool. Broken connections are closed instead of reused.
+
+        Args:
+            conn (psycopg2.extensions.connection): A connection obtained from getconn.
+        """
+
+        reusable = not conn.closed
+        if reusable and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                reusable = False
+        if not reusable:
+            self._discard(conn)
+
+        with self._condition:
+            self._in_use -= 1
+            if reusable and not self._closed:
+                self._idle.append((conn, time.monotonic()))
+            elif reusable:
+                conn.close()
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[psycopg2.extensions.connection]:
+        """
+        Borrows a connection for the duration of a `with` block.
+
+        Args:
+            timeout (Optional[float]): Seconds to wait for a free connection, or None to wait forever.
+
+        Yields:
+            psycopg2.extensions.connection: A healthy connection.
+        """
+
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns pool utilization and wait time metrics.
+
+        Returns:
+            Dict[str, float]: Connection counts, utilization (in use / max size) and wait statistics.
+        """
+
+        with self._condition:
+            metrics = dict(self._metrics)
+            metrics["max_size"] = self.max_size
+            metrics["in_use"] = self._in_use
+            metrics["idle"] = len(self._idle)
+            metrics["utilization"] = self._in_use / self.max_size
+            metrics["wait_time_avg"] = metrics["wait_time_total"] / metrics["acquired"] if metrics["acquired"] else 0.0
+            return metrics
+
+    def closeall(self) -> None:
+        """Closes the idle connections and refuses further requests; busy connections close when returned."""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._condition.notify_all()
+        for conn, _ in idle:
+            conn.close()
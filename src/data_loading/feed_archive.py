@@ -0,0 +1,230 @@
+import datetime
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from config import archive_path, archive_compression_level
+
+# Sidecar index record: header timestamp, fetch time (ms since epoch), offset, compressed length
+_INDEX_RECORD = struct.Struct('<QQQI')
+
+RAW_FEED_STORAGE_MODES = ('archive', 'database')
+
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+
+
+class ArchiveEntry(NamedTuple):
+    """Where one raw feed payload is stored in the archive."""
+    feed: str
+    header_timestamp: int
+    fetched_at: float
+    segment: str
+    offset: int
+    length: int
+
+
+def feed_slug(url: str) -> str:
+    """
+    Turns an endpoint url into a directory name, e.g. .../nyct%2Fgtfs-ace -> nyct-gtfs-ace.
+
+    Args:
+        url (str): The feed endpoint.
+
+    Returns:
+        str: A filesystem-safe name for the feed.
+    """
+    name = url.rstrip('/').rsplit('/', 1)[-1].replace('%2F', '/').replace('%2f', '/')
+    return re.sub(r'[^A-Za-z0-9_.-]+', '-', name).strip('-') or 'feed'
+
+
+class FeedArchive:
+    """
+    Appends compressed raw feeds to hourly segment files, one directory per feed.
+
+    Each segment `<root>/<feed>/<YYYYMMDDHH>.seg` holds zlib-compressed payloads back to back, and
+    a sidecar `<YYYYMMDDHH>.idx` holds one fixed-size record per payload with its header timestamp,
+    fetch time, offset and length. Segments are read through mmap, so single payloads can be
+    fetched without reading the whole file.
+
+    Args:
+        root (str): The archive directory.
+        compression_level (int): zlib compression level.
+    """
+
+    def __init__(self, root: str = archive_path, compression_level: int = archive_compression_level):
+        self.root = root
+        self.compression_level = compression_level
+        self._lock = threading.Lock()
+        self._files: Dict[str, Tuple[str, object, object]] = {}  # feed -> (segment path, data file, index file)
+
+    def _segment_path(self, feed: str, fetched_at: float) -> str:
+        hour = datetime.datetime.fromtimestamp(fetched_at, datetime.timezone.utc).strftime('%Y%m%d%H')
+        return os.path.join(self.root, feed, hour + SEGMENT_SUFFIX)
+
+    def _open(self, feed: str, segment: str):
+        """Returns the open files for a feed's current segment, rotating to a new segment if needed."""
+        current = self._files.get(feed)
+        if current is not None and current[0] == segment:
+            return current
+        if current is not None:
+            current[1].close()
+            current[2].close()
+        os.makedirs(os.path.dirname(segment), exist_ok=True)
+        opened = (segment, open(segment, 'ab'), open(segment[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX, 'ab'))
+        self._files[feed] = opened
+        return opened
+
+    def append(self, url: str, binary_data: bytes, header_timestamp: Optional[int] = None,
+               fetched_at: Optional[float] = None) -> ArchiveEntry:
+        """
+        Compresses a raw feed and appends it to the current segment of its endpoint.
+
+        Args:
+            url (str): The endpoint the feed was fetched from.
+            binary_data (bytes): The raw feed.
+            header_timestamp (Optional[int]): FeedHeader.timestamp, 0 if unknown.
+            fetched_at (Optional[float]): Epoch seconds of the fetch, defaults to now.
+
+        Returns:
+            ArchiveEntry: The location of the stored payload.
+        """
+
+        feed = feed_slug(url)
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        header_timestamp = header_timestamp or 0
+        payload = zlib.compress(binary_data, self.compression_level)
+        with self._lock:
+            segment, data_file, index_file = self._open(feed, self._segment_path(feed, fetched_at))
+            offset = data_file.tell()
+            data_file.write(payload)
+            data_file.flush()
+            # The index record is written after the payload, so every indexed payload is complete
+            index_file.write(_INDEX_RECORD.pack(header_timestamp, int(fetched_at * 1000), offset, len(payload)))
+            index_file.flush()
+        return ArchiveEntry(feed, header_timestamp, fetched_at, os.path.relpath(segment, self.root), offset, len(payload))
+
+    def close(self) -> None:
+        """Closes the open segment files."""
+        with self._lock:
+            for _, data_file, index_file in self._files.values():
+                data_file.close()
+                index_file.close()
+            self._files.clear()
+
+    def drop_expired(self, retention_days: float) -> List[str]:
+        """
+        Deletes segments (and their indexes) whose whole hour is older than the retention window.
+
+        Args:
+            retention_days (float): Days of raw feeds to keep.
+
+        Returns:
+            List[str]: The deleted segments.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        cutoff = now - datetime.timedelta(days=retention_days)
+        dropped = []
+        for segment in self.segments():
+            try:
+                hour = datetime.datetime.strptime(os.path.basename(segment)[:-len(SEGMENT_SUFFIX)], '%Y%m%d%H')
+            except ValueError:
+                continue
+            if hour + datetime.timedelta(hours=1) > cutoff:
+                continue
+            with self._lock:
+                current = self._files.get(os.path.dirname(segment))
+                if current is not None and current[0] == os.path.join(self.root, segment):
+                    continue
+                for path in (segment, segment[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX):
+                    try:
+                        os.remove(os.path.join(self.root, path))
+                    except FileNotFoundError:
+                        pass
+            dropped.append(segment)
+        if dropped:
+            logging.info(f"Dropped {len(dropped)} expired archive segments")
+        return dropped
+
+    def read(self, segment: str, offset: int, length: int) -> bytes:
+        """
+        Reads and decompresses one payload.
+
+        Args:
+            segment (str): The segment path relative to the archive root.
+            offset (int): The payload offset.
+            length (int): The compressed payload length.
+
+        Returns:
+            bytes: The raw feed.
+        """
+        with open(os.path.join(self.root, segment), 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return zlib.decompress(data[offset:offset + length])
+
+    def segments(self, feed: Optional[str] = None) -> List[str]:
+        """
+        Lists segment paths relative to the archive root, oldest first within each feed.
+
+        Args:
+            feed (Optional[str]): Restrict to one feed slug.
+
+        Returns:
+            List[str]: The segment paths.
+        """
+        if not os.path.isdir(self.root):
+            return []
+        feeds = [feed] if feed else sorted(os.listdir(self.root))
+        return [
+            os.path.join(name, file_name)
+            for name in feeds if os.path.isdir(os.path.join(self.root, name))
+            for file_name in sorted(os.listdir(os.path.join(self.root, name)))
+            if file_name.endswith(SEGMENT_SUFFIX)
+        ]
+
+    def index(self, segment: str) -> List[ArchiveEntry]:
+        """
+        Reads the sidecar index of a segment.
+
+        Args:
+            segment (str): The segment path relative to the archive root.
+
+        Returns:
+            List[ArchiveEntry]: One entry per stored payload, in append order.
+        """
+        index_path = os.path.join(self.root, segment[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX)
+        feed = os.path.dirname(segment)
+        with open(index_path, 'rb') as f:
+            raw = f.read()
+        usable = len(raw) - len(raw) % _INDEX_RECORD.size  # ignore a torn trailing record
+        return [
+            ArchiveEntry(feed, header_timestamp, fetched_ms / 1000, segment, offset, length)
+            for header_timestamp, fetched_ms, offset, length in _INDEX_RECORD.iter_unpack(raw[:usable])
+        ]
+
+    def iter_segment(self, segment: str) -> Iterator[Tuple[ArchiveEntry, bytes]]:
+        """
+        Yields every payload of a segment with its index entry, mapping the segment once.
+
+        Args:
+            segment (str): The segment path relative to the archive root.
+
+        Yields:
+            Tuple[ArchiveEntry, bytes]: The entry and the raw feed.
+        """
+        entries = self.index(segment)
+        if not entries:
+            return
+        with open(os.path.join(self.root, segment), 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for entry in entries:
+                try:
+                    yield entry, zlib.decompress(data[entry.offset:entry.offset + entry.length])
+                except zlib.error:
+                    logging.warning(f"Corrupt payload at {segment}:{entry.offset}, skipping")
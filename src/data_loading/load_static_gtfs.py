@@ -1,56 +1,182 @@
-import psycopg2
-import pandas as pd
+import csv
+import logging
 import os
 import time
-from config import db_params, gtfs_path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import psycopg2
+
+from config import db_params, gtfs_path, static_load_workers
+from src.data_loading.db_pool import ConnectionPool
+
+# Column types for known GTFS fields, everything else is loaded as TEXT.
+# Stop times stay TEXT because GTFS allows hours past 24 (e.g. 25:10:00).
+GTFS_COLUMN_TYPES: Dict[str, str] = {
+    'route_type': 'SMALLINT',
+    'direction_id': 'SMALLINT',
+    'location_type': 'SMALLINT',
+    'wheelchair_boarding': 'SMALLINT',
+    'wheelchair_accessible': 'SMALLINT',
+    'bikes_allowed': 'SMALLINT',
+    'stop_lat': 'DOUBLE PRECISION',
+    'stop_lon': 'DOUBLE PRECISION',
+    'shape_pt_lat': 'DOUBLE PRECISION',
+    'shape_pt_lon': 'DOUBLE PRECISION',
+    'shape_pt_sequence': 'INTEGER',
+    'shape_dist_traveled': 'DOUBLE PRECISION',
+    'stop_sequence': 'INTEGER',
+    'pickup_type': 'SMALLINT',
+    'drop_off_type': 'SMALLINT',
+    'timepoint': 'SMALLINT',
+    'monday': 'SMALLINT',
+    'tuesday': 'SMALLINT',
+    'wednesday': 'SMALLINT',
+    'thursday': 'SMALLINT',
+    'friday': 'SMALLINT',
+    'saturday': 'SMALLINT',
+    'sunday': 'SMALLINT',
+    'start_date': 'DATE',
+    'end_date': 'DATE',
+    'date': 'DATE',
+    'exception_type': 'SMALLINT',
+    'transfer_type': 'SMALLINT',
+    'min_transfer_time': 'INTEGER',
+    'headway_secs': 'INTEGER',
+    'exact_times': 'SMALLINT',
+}
+
+# Columns that get an index wherever they appear
+INDEXED_COLUMNS = ('trip_id', 'stop_id', 'route_id', 'parent_station')
+
+
+def read_header(file_path: str) -> List[str]:
+    """
+    Reads only the header row of a GTFS file.
+
+    Args:
+        file_path (str): Path to the .txt file.
+
+    Returns:
+        List[str]: The column names.
+    """
+    with open(file_path, newline='', encoding='utf-8-sig') as f:
+        return [column.strip() for column in next(csv.reader(f))]
+
+
+def _staging_table(table_name: str) -> str:
+    return f"{table_name}_staging"
+
+
+def load_file_to_staging(conn: psycopg2.extensions.connection, file_path: str, table_name: str) -> Tuple[str, int]:
+    """
+    Loads one GTFS file into a freshly created, typed and indexed staging table.
+
+    Args:
+        conn (psycopg2.extensions.connection): A database connection object.
+        file_path (str): Path to the .txt file.
+        table_name (str): The final table name; the data goes to `<table_name>_staging`.
+
+    Returns:
+        Tuple[str, int]: The table name and the number of rows loaded.
+    """
+
+    staging = _staging_table(table_name)
+    columns = read_header(file_path)
+    schema = ", ".join(f"{col} {GTFS_COLUMN_TYPES.get(col, 'TEXT')}" for col in columns)
+
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {staging}")
+        cur.execute(f"CREATE TABLE {staging} ({schema})")
+        with open(file_path, 'r', encoding='utf-8-sig') as f:
+            cur.copy_expert(f"COPY {staging} ({', '.join(columns)}) FROM STDIN WITH CSV HEADER DELIMITER ','", f)
+        rows = cur.rowcount
+        for col in INDEXED_COLUMNS:
+            if col in columns:
+                cur.execute(f"CREATE INDEX {staging}_{col}_idx ON {staging} ({col})")
+        cur.execute(f"ANALYZE {staging}")
+    conn.commit()
+    return table_name, rows
+
+
+def swap_in_staging_tables(conn: psycopg2.extensions.connection, tables: Dict[str, List[str]]) -> None:
+    """
+    Replaces the live tables with their staging tables in a single transaction.
+
+    Readers see either the complete old feed or the complete new one, and reruns replace
+    the data instead of appending to it.
+
+    Args:
+        conn (psycopg2.extensions.connection): A database connection object.
+        tables (Dict[str, List[str]]): Table names mapped to their column names.
+    """
+
+    with conn.cursor() as cur:
+        for table_name, columns in tables.items():
+            staging = _staging_table(table_name)
+            cur.execute(f"DROP TABLE IF EXISTS {table_name}")
+            cur.execute(f"ALTER TABLE {staging} RENAME TO {table_name}")
+            for col in INDEXED_COLUMNS:
+                if col in columns:
+                    cur.execute(f"ALTER INDEX {staging}_{col}_idx RENAME TO {table_name}_{col}_idx")
+    conn.commit()
+
+
+def load_data_to_db(db_params: dict, gtfs_path: str, workers: int = static_load_workers) -> None:
+    """
+    Loads every .txt file of a static GTFS dataset into PostgreSQL.
+
+    Files are loaded in parallel into staging tables, each on its own connection, and are
+    swapped in together once all of them succeeded. If any file fails, the live tables are
+    left untouched.
+
+    Args:
+        db_params (dict): Keyword arguments for psycopg2.connect.
+        gtfs_path (str): Directory containing the GTFS .txt files.
+        workers (int): Number of files loaded concurrently.
+    """
+
+    files = {
+        file_name[:-len(".txt")]: os.path.join(gtfs_path, file_name)
+        for file_name in sorted(os.listdir(gtfs_path))
+        if file_name.endswith(".txt")
+    }
+    if not files:
+        logging.warning(f"No GTFS files found in {gtfs_path}")
+        return
+
+    pool = ConnectionPool(db_params, max_size=workers)
+
+    def load(item: Tuple[str, str]) -> Tuple[str, int]:
+        table_name, file_path = item
+        # Record start time for performance monitoring
+        start_time = time.time()
+        with pool.connection() as conn:
+            try:
+                result = load_file_to_staging(conn, file_path, table_name)
+            except psycopg2.Error:
+                conn.rollback()
+                raise
+        logging.info(f"Loaded {result[1]} rows from {os.path.basename(file_path)} into "
+                     f"{_staging_table(table_name)} in {time.time() - start_time:.2f} seconds.")
+        return result
 
-def load_data_to_db(db_params, gtfs_path):
     try:
-        # Connect to the PostgreSQL database using psycopg2
-        connection = psycopg2.connect(**db_params)
-        cursor = connection.cursor()
-
-        # Loop through each text file in the GTFS dataset
-        for file_name in os.listdir(gtfs_path):
-            if file_name.endswith(".txt"):
-                # Record start time for performance monitoring
-                start_time = time.time()
-
-                # Define the table name based on the file name (remove .txt extension)
-                table_name = file_name.replace(".txt", "")
-                
-                # Load the text file into a pandas DataFrame
-                file_path = os.path.join(gtfs_path, file_name)
-                df = pd.read_csv(file_path)
-
-                # Define the SQL table schema based on the DataFrame dtypes
-                schema = ", ".join([f"{col} TEXT" for col in df.columns])
-                create_table_query = f"CREATE TABLE IF NOT EXISTS {table_name} ({schema});"
-
-                # Execute the CREATE TABLE query
-                cursor.execute(create_table_query)
-
-                # Prepare COPY statement
-                copy_stmt = f"COPY {table_name} FROM STDIN WITH CSV HEADER DELIMITER as ','"
-                
-                # Use the 'copy_expert' function to load data
-                with open(file_path, 'r') as f:
-                    cursor.copy_expert(copy_stmt, f)
-
-                # Commit the transaction
-                connection.commit()
-
-                # Record end time and calculate elapsed time
-                end_time = time.time()
-                elapsed_time = end_time - start_time
-                print(f"Finished processing {file_name} and loaded data to {table_name} in {elapsed_time:.2f} seconds.")
-
-    except Exception as error:
-        print(f"Error: {error}")
-        connection.rollback()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(load, files.items()))
+        with pool.connection() as conn:
+            try:
+                swap_in_staging_tables(conn, {table: read_header(path) for table, path in files.items()})
+            except psycopg2.Error:
+                conn.rollback()
+                raise
+        logging.info(f"Swapped in {len(files)} static GTFS tables: {', '.join(files)}")
+    except (psycopg2.Error, OSError) as error:
+        logging.error(f"Error: {error}")
     finally:
-        cursor.close()
-        connection.close()
+        pool.closeall()
+
 
-# Call the function to load data to DB
-load_data_to_db(db_params, gtfs_path)
\ No newline at end of file
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    load_data_to_db(db_params, gtfs_path)
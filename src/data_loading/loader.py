@@ -1,6 +1,26 @@
+import datetime
 import psycopg2
 import logging
-from typing import List
+from typing import List, Optional
+from src.data_loading.feed_archive import ArchiveEntry
+from src.data_loading.partitions import maintain_partitions
+from src.monitoring.metrics import STAGE_SECONDS, ERRORS, current_feed
+
+def insert_binary_data(cur, binary_data: bytes, timestamp: Optional[datetime.datetime] = None) -> None:
+    """Inserts one raw feed into realtime_binary_data inside the caller's transaction, stamped now by default."""
+    if timestamp is None:
+        cur.execute("INSERT INTO Realtime_Binary_Data (binary_data) VALUES (%s::bytea);", (binary_data,))
+    else:
+        cur.execute("INSERT INTO Realtime_Binary_Data (binary_data, timestamp) VALUES (%s::bytea, %s);",
+                    (binary_data, timestamp))
+
+def insert_archive_index(cur, entries: List[ArchiveEntry]) -> None:
+    """Inserts the locations of archived raw feeds inside the caller's transaction."""
+    cur.executemany(
+        "INSERT INTO realtime_feed_archive (feed, header_timestamp, fetched_at, segment, byte_offset, length) "
+        "VALUES (%s, %s, to_timestamp(%s) AT TIME ZONE 'UTC', %s, %s, %s)",
+        [(e.feed, e.header_timestamp, e.fetched_at, e.segment, e.offset, e.length) for e in entries]
+    )
 
 def store_binary_data(binary_data_list: List[bytes], conn: psycopg2.extensions.connection) -> None:
     """
@@ -13,19 +33,45 @@ def store_binary_data(binary_data_list: List[bytes], conn: psycopg2.extensions.c
     
     for i, binary_data in enumerate(binary_data_list):
         try:
-            with conn.cursor() as cur:
-                query = "INSERT INTO Realtime_Binary_Data (binary_data) VALUES (%s::bytea);"
-                cur.execute(query, (binary_data,))
-            conn.commit()
+            with STAGE_SECONDS.time('store_raw', current_feed()):
+                with conn.cursor() as cur:
+                    insert_binary_data(cur, binary_data)
+                conn.commit()
             logging.info(f"Stored binary data entry")
         except psycopg2.Error as e:
+            ERRORS.inc('store_raw', current_feed())
             logging.exception(f"A database error occurred with binary data entry {i}")
             conn.rollback()
-            
+
+def store_archive_index(entries: List[ArchiveEntry], conn: psycopg2.extensions.connection) -> None:
+    """
+    Record where raw feeds were stored in the on-disk archive (see feed_archive.py).
+
+    Only the location is stored; the bytes stay in the segment files.
+
+    Args:
+        entries (List[ArchiveEntry]): The archived payloads.
+        conn (psycopg2.extensions.connection): A database connection object.
+    """
+
+    try:
+        with conn.cursor() as cur:
+            insert_archive_index(cur, entries)
+        conn.commit()
+    except psycopg2.Error as e:
+        ERRORS.inc('store_raw', current_feed())
+        logging.exception(f"A database error occurred while indexing archived feeds: {e}")
+        conn.rollback()
+
 def ensure_table_exists(conn: psycopg2.extensions.connection) -> None:
     """
     Create tables for storing extracted data if they don't already exist.
 
+    The realtime tables are partitioned by range on their insert time (see partitions.py), so
+    their primary keys include the partition column. All times are stored in UTC, in TIMESTAMP
+    columns defaulting to NOW() AT TIME ZONE 'UTC', whatever the session time zone. This runs
+    once at startup, together with creating indexes and the partitions around the current time.
+
     Args:
         conn (psycopg2.extensions.connection): A database connection object.
     """
@@ -33,7 +79,7 @@ def ensure_table_exists(conn: psycopg2.extensions.connection) -> None:
     commands = (
         """
         CREATE TABLE IF NOT EXISTS realtime_trip_updates (
-            id SERIAL PRIMARY KEY,
+            id BIGSERIAL,
             trip_id VARCHAR(255) NOT NULL,
             route_id VARCHAR(255),
             start_date DATE,
@@ -41,38 +87,213 @@ def ensure_table_exists(conn: psycopg2.extensions.connection) -> None:
             arrival_time TIME,
             departure_time TIME,
             stop_id VARCHAR(255),
-            last_updated TIMESTAMP DEFAULT NOW()
-        )
+            direction_id SMALLINT,
+            trip_headsign TEXT,
+            service_id VARCHAR(255),
+            parent_station VARCHAR(255),
+            last_updated TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
+            PRIMARY KEY (id, last_updated)
+        ) PARTITION BY RANGE (last_updated)
         """,
         """
         CREATE TABLE IF NOT EXISTS realtime_vehicle_positions (
-            id SERIAL PRIMARY KEY,
+            id BIGSERIAL,
             trip_id VARCHAR(255),
             route_id VARCHAR(255),
             current_stop_sequence INTEGER,
             stop_id VARCHAR(255),
             current_status INTEGER,
             timestamp TIMESTAMP,
-            last_updated TIMESTAMP DEFAULT NOW()
-        )
+            direction_id SMALLINT,
+            trip_headsign TEXT,
+            service_id VARCHAR(255),
+            parent_station VARCHAR(255),
+            last_updated TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
+            PRIMARY KEY (id, last_updated)
+        ) PARTITION BY RANGE (last_updated)
         """,
         """
         CREATE TABLE IF NOT EXISTS realtime_alerts (
-            id SERIAL PRIMARY KEY,
+            id BIGSERIAL,
             alert_id VARCHAR(255),
             trip_id VARCHAR(255),
             route_id VARCHAR(255),
             description_text TEXT,
-            last_updated TIMESTAMP DEFAULT NOW()
+            last_updated TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
+            PRIMARY KEY (id, last_updated)
+        ) PARTITION BY RANGE (last_updated)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS realtime_trip_events (
+            id BIGSERIAL,
+            trip_id VARCHAR(255) NOT NULL,
+            route_id VARCHAR(255),
+            event VARCHAR(32) NOT NULL,
+            last_updated TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
+            PRIMARY KEY (id, last_updated)
+        ) PARTITION BY RANGE (last_updated)
+        """,
+        # Alerts are stored once per distinct content rather than once per poll (see alert_store.py)
+        """
+        CREATE TABLE IF NOT EXISTS realtime_alert_texts (
+            text_hash CHAR(40) PRIMARY KEY,
+            text TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS realtime_alert_versions (
+            id BIGSERIAL PRIMARY KEY,
+            feed VARCHAR(255) NOT NULL,
+            alert_id VARCHAR(255) NOT NULL,
+            content_hash CHAR(40) NOT NULL,
+            cause SMALLINT,
+            effect SMALLINT,
+            first_seen TIMESTAMP NOT NULL,
+            cleared_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS realtime_alert_entities (
+            version_id BIGINT NOT NULL REFERENCES realtime_alert_versions (id) ON DELETE CASCADE,
+            agency_id VARCHAR(255),
+            route_id VARCHAR(255),
+            route_type INTEGER,
+            trip_id VARCHAR(255),
+            stop_id VARCHAR(255)
         )
         """,
         """
+        CREATE TABLE IF NOT EXISTS realtime_alert_active_periods (
+            version_id BIGINT NOT NULL REFERENCES realtime_alert_versions (id) ON DELETE CASCADE,
+            period_start TIMESTAMP,
+            period_end TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS realtime_alert_translations (
+            version_id BIGINT NOT NULL REFERENCES realtime_alert_versions (id) ON DELETE CASCADE,
+            field VARCHAR(16) NOT NULL,
+            language VARCHAR(35) NOT NULL,
+            text_hash CHAR(40) NOT NULL REFERENCES realtime_alert_texts (text_hash)
+        )
+        """,
+        # Latest state per key, upserted with every load (see current_state.py); the fillfactor
+        # leaves room on each page for updates that do not have to touch the indexes
+        """
+        CREATE TABLE IF NOT EXISTS realtime_current_trip_updates (
+            trip_id VARCHAR(255) NOT NULL,
+            route_id VARCHAR(255),
+            start_date DATE,
+            schedule_relationship INTEGER,
+            arrival_time TIME,
+            departure_time TIME,
+            stop_id VARCHAR(255) NOT NULL,
+            direction_id SMALLINT,
+            trip_headsign TEXT,
+            service_id VARCHAR(255),
+            parent_station VARCHAR(255),
+            last_updated TIMESTAMP NOT NULL,
+            PRIMARY KEY (trip_id, stop_id)
+        ) WITH (fillfactor = 70)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS realtime_current_vehicle_positions (
+            trip_id VARCHAR(255) PRIMARY KEY,
+            route_id VARCHAR(255),
+            current_stop_sequence INTEGER,
+            stop_id VARCHAR(255),
+            current_status INTEGER,
+            timestamp TIMESTAMP,
+            direction_id SMALLINT,
+            trip_headsign TEXT,
+            service_id VARCHAR(255),
+            parent_station VARCHAR(255),
+            last_updated TIMESTAMP NOT NULL
+        ) WITH (fillfactor = 70)
+        """,
+        # When each trip was last in its feed, changed or not; the current state expires by it
+        """
+        CREATE TABLE IF NOT EXISTS realtime_current_trips (
+            trip_id VARCHAR(255) PRIMARY KEY,
+            route_id VARCHAR(255),
+            last_seen TIMESTAMP NOT NULL
+        ) WITH (fillfactor = 70)
+        """,
+        """
         CREATE TABLE IF NOT EXISTS realtime_binary_data (
-            id SERIAL PRIMARY KEY,
+            id BIGSERIAL,
             binary_data BYTEA,
-            timestamp TIMESTAMP DEFAULT NOW()
-        )
+            timestamp TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS realtime_feed_archive (
+            id BIGSERIAL,
+            feed VARCHAR(255) NOT NULL,
+            header_timestamp BIGINT,
+            fetched_at TIMESTAMP NOT NULL,
+            segment TEXT NOT NULL,
+            byte_offset BIGINT NOT NULL,
+            length INTEGER NOT NULL,
+            last_updated TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
+            PRIMARY KEY (id, last_updated)
+        ) PARTITION BY RANGE (last_updated)
+        """,
         """
+        CREATE TABLE IF NOT EXISTS realtime_load_rejects (
+            id SERIAL PRIMARY KEY,
+            table_name VARCHAR(255) NOT NULL,
+            row_data TEXT,
+            error TEXT,
+            rejected_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'UTC')
+        )
+        """,
+        # Times are stored in UTC; tables created before defaulted to the session time zone
+        *(
+            f"ALTER TABLE {table} ALTER COLUMN {column} SET DEFAULT (NOW() AT TIME ZONE 'UTC')"
+            for table, column in (('realtime_trip_updates', 'last_updated'),
+                                  ('realtime_vehicle_positions', 'last_updated'),
+                                  ('realtime_alerts', 'last_updated'),
+                                  ('realtime_trip_events', 'last_updated'),
+                                  ('realtime_binary_data', 'timestamp'),
+                                  ('realtime_feed_archive', 'last_updated'),
+                                  ('realtime_load_rejects', 'rejected_at'))
+        ),
+        # Static GTFS enrichment columns for tables created before they existed
+        *(
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column}"
+            for table in ('realtime_trip_updates', 'realtime_vehicle_positions')
+            for column in ('direction_id SMALLINT', 'trip_headsign TEXT',
+                           'service_id VARCHAR(255)', 'parent_station VARCHAR(255)')
+        ),
+        # Indexes on the partitioned parents are created on every partition
+        "CREATE INDEX IF NOT EXISTS realtime_trip_updates_route_stop_time_idx "
+        "ON realtime_trip_updates (route_id, stop_id, last_updated)",
+        "CREATE INDEX IF NOT EXISTS realtime_trip_updates_trip_idx ON realtime_trip_updates (trip_id)",
+        "CREATE INDEX IF NOT EXISTS realtime_vehicle_positions_route_stop_time_idx "
+        "ON realtime_vehicle_positions (route_id, stop_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS realtime_alerts_route_time_idx ON realtime_alerts (route_id, last_updated)",
+        "CREATE INDEX IF NOT EXISTS realtime_trip_events_trip_time_idx ON realtime_trip_events (trip_id, last_updated)",
+        # At most one open version per alert
+        "CREATE UNIQUE INDEX IF NOT EXISTS realtime_alert_versions_open_idx "
+        "ON realtime_alert_versions (feed, alert_id) WHERE cleared_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS realtime_alert_versions_alert_idx "
+        "ON realtime_alert_versions (feed, alert_id, first_seen)",
+        "CREATE INDEX IF NOT EXISTS realtime_alert_versions_cleared_idx ON realtime_alert_versions (cleared_at)",
+        "CREATE INDEX IF NOT EXISTS realtime_alert_entities_version_idx ON realtime_alert_entities (version_id)",
+        "CREATE INDEX IF NOT EXISTS realtime_alert_entities_route_idx ON realtime_alert_entities (route_id)",
+        "CREATE INDEX IF NOT EXISTS realtime_alert_active_periods_version_idx "
+        "ON realtime_alert_active_periods (version_id)",
+        "CREATE INDEX IF NOT EXISTS realtime_alert_translations_version_idx ON realtime_alert_translations (version_id)",
+        "CREATE INDEX IF NOT EXISTS realtime_alert_translations_text_idx ON realtime_alert_translations (text_hash)",
+        "CREATE INDEX IF NOT EXISTS realtime_current_trip_updates_stop_idx ON realtime_current_trip_updates (stop_id)",
+        "CREATE INDEX IF NOT EXISTS realtime_current_trip_updates_time_idx ON realtime_current_trip_updates (last_updated)",
+        "CREATE INDEX IF NOT EXISTS realtime_current_vehicle_positions_route_idx "
+        "ON realtime_current_vehicle_positions (route_id)",
+        "CREATE INDEX IF NOT EXISTS realtime_current_vehicle_positions_time_idx "
+        "ON realtime_current_vehicle_positions (last_updated)",
+        "CREATE INDEX IF NOT EXISTS realtime_feed_archive_feed_time_idx ON realtime_feed_archive (feed, header_timestamp)",
     )
     try:
         with conn.cursor() as cur:
@@ -85,4 +306,7 @@ def ensure_table_exists(conn: psycopg2.extensions.connection) -> None:
     except (psycopg2.DatabaseError, Exception) as error:
         logging.exception("An error occurred while creating tables: %s", error)
         # in case of error, rollback the transaction
-        conn.rollback()
\ No newline at end of file
+        conn.rollback()
+        return
+
+    maintain_partitions(conn)
@@ -0,0 +1,257 @@
+import datetime
+import logging
+import os
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.data_loading.tf_loader import (_as_tuples, Rows, TRIP_UPDATE_COLUMNS, VEHICLE_POSITION_COLUMNS,
+                                        ALERT_COLUMNS)
+from config import export_path, export_compression, export_buffer_rows
+
+# Exported tables and their columns; every file also has last_updated, which sets the date partition
+EXPORT_TABLES: Dict[str, Sequence[str]] = {
+    'realtime_trip_updates': TRIP_UPDATE_COLUMNS,
+    'realtime_vehicle_positions': VEHICLE_POSITION_COLUMNS,
+    'realtime_alerts': ALERT_COLUMNS,
+}
+
+# Hive's name for the partition of NULL values, which pyarrow and Spark read back as null
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+# Declared rather than inferred, as a partition key that is NULL everywhere, e.g. the route of
+# most alerts, has no type to infer
+PARTITIONING = ds.partitioning(pa.schema([('date', pa.date32()), ('route', pa.string())]), flavor='hive')
+
+
+def _date(value) -> Optional[datetime.date]:
+    """Accepts a date from the database or a YYYYMMDD string from a decoded feed."""
+    if value is None or isinstance(value, datetime.date):
+        return value
+    return datetime.datetime.strptime(value.replace('-', ''), '%Y%m%d').date() if value else None
+
+
+def _time(value) -> Optional[datetime.time]:
+    """Accepts a time from the database or an HH:MM:SS string from a decoded feed."""
+    if value is None or isinstance(value, datetime.time):
+        return value
+    return datetime.time(*(int(part) for part in value.split(':')))
+
+
+def _timestamp(value) -> Optional[datetime.datetime]:
+    """Accepts a datetime from the database or an ISO string from a column batch."""
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(value)
+
+
+# column -> (Arrow type, converter from the values the loaders and the database produce)
+_COLUMN_TYPES: Dict[str, Tuple[pa.DataType, Optional[Callable]]] = {
+    'trip_id': (pa.string(), None),
+    'route_id': (pa.string(), None),
+    'start_date': (pa.date32(), _date),
+    'schedule_relationship': (pa.int32(), None),
+    'arrival_time': (pa.time32('s'), _time),
+    'departure_time': (pa.time32('s'), _time),
+    'stop_id': (pa.string(), None),
+    'direction_id': (pa.int16(), None),
+    'trip_headsign': (pa.string(), None),
+    'service_id': (pa.string(), None),
+    'parent_station': (pa.string(), None),
+    'current_stop_sequence': (pa.int32(), None),
+    'current_status': (pa.int32(), None),
+    'timestamp': (pa.timestamp('s'), _timestamp),
+    'alert_id': (pa.string(), None),
+    'description_text': (pa.string(), None),
+    'last_updated': (pa.timestamp('us'), _timestamp),
+}
+
+
+class PartitionedParquetWriter:
+    """
+    Writes the rows of one realtime table to Parquet files partitioned by date and route.
+
+    Files are laid out as `<root>/<table>/date=YYYY-MM-DD/route=<route_id>/part-<file_tag>.parquet`,
+    which pyarrow.dataset, pandas.read_parquet, DuckDB and Spark read as a hive-partitioned
+    dataset. The partition keys are named date and route so they do not clash with the
+    route_id column that every file keeps. Rows are buffered per partition and written as row
+    groups once `buffer_rows` rows are held, so memory stays bounded however many rows are
+    written. Files are written under a hidden temporary name and only renamed by close(), so
+    readers never see partial files, and writing the same `file_tag` again replaces them.
+
+    Args:
+        root (str): The root directory of the dataset.
+        table (str): The exported table, a key of EXPORT_TABLES.
+        file_tag (str): Names the files of this writer within each partition.
+        compression (str): The Parquet compression codec.
+        buffer_rows (int): Rows held in memory before the largest partitions are written out.
+    """
+
+    def __init__(self, root: str, table: str, file_tag: str, compression: str = export_compression,
+                 buffer_rows: int = export_buffer_rows):
+        self.table = table
+        self.directory = os.path.join(root, table)
+        self.file_tag = file_tag
+        self.compression = compression
+        self.buffer_rows = buffer_rows
+        self.columns = tuple(EXPORT_TABLES[table]) + ('last_updated',)
+        self.schema = pa.schema([(column, _COLUMN_TYPES[column][0]) for column in self.columns])
+        self.rows = 0
+        self._route = self.columns.index('route_id')
+        self._buffers: Dict[Tuple[datetime.date, Optional[str]], List[tuple]] = {}
+        self._buffered = 0
+        self._writers: Dict[Tuple[datetime.date, Optional[str]], Tuple[pq.ParquetWriter, str, str]] = {}
+
+    def write(self, rows: List[tuple]) -> None:
+        """
+        Adds rows ordered like the table's columns followed by last_updated.
+
+        Args:
+            rows (List[tuple]): The rows to write.
+        """
+        for row in rows:
+            # Empty route ids, as decoded feeds report them, share the NULL partition
+            key = (_timestamp(row[-1]).date(), row[self._route] or None)
+            self._buffers.setdefault(key, []).append(row)
+        self._buffered += len(rows)
+        self.rows += len(rows)
+        if self._buffered >= self.buffer_rows:
+            # Write the largest partitions first so the row groups stay large
+            for key in sorted(self._buffers, key=lambda key: len(self._buffers[key]), reverse=True):
+                if self._buffered <= self.buffer_rows // 2:
+                    break
+                self._flush(key)
+
+    def _flush(self, key: Tuple[datetime.date, Optional[str]]) -> None:
+        """Writes the buffered rows of one partition as a row group."""
+        rows = self._buffers.pop(key)
+        self._buffered -= len(rows)
+        arrays = []
+        for column, values in zip(self.columns, zip(*rows)):
+            arrow_type, convert = _COLUMN_TYPES[column]
+            arrays.append(pa.array([convert(value) for value in values] if convert else values, type=arrow_type))
+        self._writer(key).write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def _writer(self, key: Tuple[datetime.date, Optional[str]]) -> pq.ParquetWriter:
+        if key not in self._writers:
+            date, route_id = key
+            directory = os.path.join(self.directory, f"date={date.isoformat()}",
+                                     f"route={quote(route_id, safe='') if route_id else NULL_PARTITION}")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-{self.file_tag}.parquet")
+            # Dot-prefixed files are skipped by the dataset readers
+            temporary = os.path.join(directory, f".part-{self.file_tag}.parquet.tmp")
+            self._writers[key] = (pq.ParquetWriter(temporary, self.schema, compression=self.compression),
+                                  temporary, path)
+        return self._writers[key][0]
+
+    def close(self) -> List[str]:
+        """
+        Writes the remaining rows and publishes the files.
+
+        Returns:
+            List[str]: The paths of the written files.
+        """
+        for key in list(self._buffers):
+            self._flush(key)
+        paths = []
+        for writer, temporary, path in self._writers.values():
+            writer.close()
+            os.replace(temporary, path)
+            paths.append(path)
+        self._writers = {}
+        if paths:
+            logging.debug(f"Wrote {self.rows} rows of {self.table} to {len(paths)} files")
+        return paths
+
+    def abort(self) -> None:
+        """Discards the buffered rows and the unpublished files."""
+        self._buffers, self._buffered = {}, 0
+        for writer, temporary, _ in self._writers.values():
+            writer.close()
+            os.remove(temporary)
+        self._writers = {}
+
+    def __enter__(self) -> 'PartitionedParquetWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class FeedParquetWriter:
+    """
+    Writes the rows of decoded feeds straight to the partitioned Parquet dataset, one
+    PartitionedParquetWriter per table, without going through the database.
+
+    Args:
+        root (str): The root directory of the dataset.
+        file_tag (str): Names the files of this writer within each partition.
+        compression (str): The Parquet compression codec.
+        buffer_rows (int): Rows held in memory per table before they are written out.
+    """
+
+    def __init__(self, root: str, file_tag: str, compression: str = export_compression,
+                 buffer_rows: int = export_buffer_rows):
+        self.writers = {table: PartitionedParquetWriter(root, table, file_tag, compression, buffer_rows)
+                        for table in EXPORT_TABLES}
+
+    def write_feed(self, trip_updates: Rows, vehicle_positions: Rows, alerts: Rows,
+                   fetched: datetime.datetime) -> None:
+        """
+        Adds the rows of one feed snapshot, as returned by process_feed.
+
+        Args:
+            trip_updates (Rows): Trip update dictionaries or a ColumnBatch.
+            vehicle_positions (Rows): Vehicle position dictionaries or a ColumnBatch.
+            alerts (Rows): Alert dictionaries or a ColumnBatch.
+            fetched (datetime.datetime): The fetch time, written as last_updated like the live loader does.
+        """
+        for table, rows in (('realtime_trip_updates', trip_updates),
+                            ('realtime_vehicle_positions', vehicle_positions),
+                            ('realtime_alerts', alerts)):
+            self.writers[table].write([row + (fetched,) for row in _as_tuples(rows, EXPORT_TABLES[table])])
+
+    @property
+    def rows(self) -> Dict[str, int]:
+        return {table: writer.rows for table, writer in self.writers.items()}
+
+    def close(self) -> List[str]:
+        """Writes the remaining rows of every table and returns the paths of the written files."""
+        return [path for writer in self.writers.values() for path in writer.close()]
+
+    def abort(self) -> None:
+        for writer in self.writers.values():
+            writer.abort()
+
+    def __enter__(self) -> 'FeedParquetWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def open_dataset(table: str, root: str = export_path) -> ds.Dataset:
+    """
+    Opens the exported files of a table as one dataset, with date and route as partition columns.
+
+    Filters on the partition columns skip the other partitions' files, e.g.
+    `open_dataset('realtime_trip_updates').to_table(filter=ds.field('route') == 'A').to_pandas()`.
+
+    Args:
+        table (str): The exported table, a key of EXPORT_TABLES.
+        root (str): The root directory of the dataset.
+
+    Returns:
+        pyarrow.dataset.Dataset: The dataset.
+    """
+    return ds.dataset(os.path.join(root, table), format='parquet', partitioning=PARTITIONING)
@@ -0,0 +1,223 @@
+import datetime
+import logging
+from typing import Dict, List
+
+import psycopg2
+
+from config import partition_interval, partitions_ahead, retention_days
+
+# Partitioned realtime tables and the column they are partitioned on
+PARTITIONED_TABLES: Dict[str, str] = {
+    'realtime_trip_updates': 'last_updated',
+    'realtime_vehicle_positions': 'last_updated',
+    'realtime_alerts': 'last_updated',
+    'realtime_trip_events': 'last_updated',
+    'realtime_binary_data': 'timestamp',
+    'realtime_feed_archive': 'last_updated',
+}
+
+# Partition name suffix format and width for each interval
+_INTERVALS = {
+    'day': ('%Y%m%d', datetime.timedelta(days=1)),
+    'hour': ('%Y%m%d%H', datetime.timedelta(hours=1)),
+}
+
+
+def _interval(interval: str):
+    if interval not in _INTERVALS:
+        raise ValueError(f"Unknown partition interval {interval!r}, expected one of {list(_INTERVALS)}")
+    return _INTERVALS[interval]
+
+
+def partition_name(table: str, start: datetime.datetime, interval: str = partition_interval) -> str:
+    """
+    Returns the name of the partition of `table` that starts at `start`.
+
+    Args:
+        table (str): The partitioned parent table.
+        start (datetime.datetime): The lower bound of the partition.
+        interval (str): 'day' or 'hour'.
+
+    Returns:
+        str: e.g. realtime_trip_updates_p20231017.
+    """
+    suffix_format, _ = _interval(interval)
+    return f"{table}_p{start.strftime(suffix_format)}"
+
+
+def create_partitions(
+        conn: psycopg2.extensions.connection,
+        ahead: int = partitions_ahead,
+        interval: str = partition_interval
+    ) -> List[str]:
+    """
+    Creates the current partition and the next `ahead` ones for every realtime table.
+
+    The current time is taken from the database in UTC, like the defaults of the partition columns.
+
+    Args:
+        conn (psycopg2.extensions.connection): A database connection object.
+        ahead (int): Number of future partitions to pre-create.
+        interval (str): 'day' or 'hour'.
+
+    Returns:
+        List[str]: The partitions that were created.
+    """
+
+    _, width = _interval(interval)
+    created = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT date_trunc(%s, NOW() AT TIME ZONE 'UTC')", (interval,))
+        current = cur.fetchone()[0]
+        for table in PARTITIONED_TABLES:
+            cur.execute("SELECT relkind FROM pg_class WHERE relname = %s", (table,))
+            if cur.fetchone() != ('p',):
+                logging.warning(f"{table} is not a partitioned table, it was created by an older version "
+                                f"and must be migrated before partitions can be managed")
+                continue
+            for step in range(ahead + 1):
+                start = current + step * width
+                name = partition_name(table, start, interval)
+                cur.execute("SELECT to_regclass(%s)", (name,))
+                if cur.fetchone()[0] is not None:
+                    continue
+                cur.execute(
+                    f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+                    (start, start + width)
+                )
+                created.append(name)
+            # Catches rows outside the pre-created range so inserts never fail; emptied again by
+            # drain_default_partitions
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT")
+    conn.commit()
+    if created:
+        logging.info(f"Created partitions: {', '.join(created)}")
+    return created
+
+
+def drain_default_partitions(
+        conn: psycopg2.extensions.connection,
+        retention: float = retention_days,
+        interval: str = partition_interval
+    ) -> Dict[str, int]:
+    """
+    Moves the rows of every table's DEFAULT partition into regular partitions.
+
+    Rows end up in the default partition when no partition covers their time, e.g. a spooled
+    batch fetched before an outage that outlasted the pre-created partitions. Left there they
+    would escape the retention window, and create_partitions would fail once a new partition
+    overlaps them. Rows past the retention window are deleted. All other rows are moved, one
+    range at a time, into a new table that is then attached as the partition of the range.
+
+    Args:
+        conn (psycopg2.extensions.connection): A database connection object.
+        retention (float): Days of data to keep.
+        interval (str): 'day' or 'hour'.
+
+    Returns:
+        Dict[str, int]: The number of rows moved or deleted per table.
+    """
+
+    _, width = _interval(interval)
+    drained = {}
+    with conn.cursor() as cur:
+        cur.execute("SELECT NOW() AT TIME ZONE 'UTC' - make_interval(secs => %s)", (retention * 86400,))
+        cutoff = cur.fetchone()[0]
+        for table, column in PARTITIONED_TABLES.items():
+            default = f"{table}_default"
+            cur.execute("SELECT to_regclass(%s)", (default,))
+            if cur.fetchone()[0] is None:
+                continue
+            # NULL times can only be held by the default partition
+            cur.execute(f'SELECT date_trunc(%s, "{column}"), count(*) FROM {default} '
+                        f'WHERE "{column}" IS NOT NULL GROUP BY 1 ORDER BY 1', (interval,))
+            ranges = cur.fetchall()
+            if not ranges:
+                continue
+            logging.warning(f"{sum(count for _, count in ranges)} rows of {table} are in its default partition: "
+                            + ', '.join(f"{count} at {start}" for start, count in ranges))
+            for start, count in ranges:
+                bounds = (start, start + width)
+                if start + width <= cutoff:
+                    cur.execute(f'DELETE FROM {default} WHERE "{column}" >= %s AND "{column}" < %s', bounds)
+                    logging.info(f"Deleted {count} rows of {table} from {start}, past the retention window")
+                else:
+                    name = partition_name(table, start, interval)
+                    cur.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)")
+                    cur.execute(
+                        f'WITH moved AS (DELETE FROM {default} WHERE "{column}" >= %s AND "{column}" < %s '
+                        f"RETURNING *) INSERT INTO {name} SELECT * FROM moved",
+                        bounds
+                    )
+                    cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", bounds)
+                    logging.info(f"Moved {count} rows of {table} from its default partition into {name}")
+                drained[table] = drained.get(table, 0) + count
+            conn.commit()
+    return drained
+
+
+def drop_expired_partitions(
+        conn: psycopg2.extensions.connection,
+        retention: float = retention_days,
+        interval: str = partition_interval
+    ) -> List[str]:
+    """
+    Drops partitions whose whole range is older than the retention window.
+
+    Dropping a partition is a metadata operation, unlike DELETE it leaves no dead rows to vacuum.
+
+    Args:
+        conn (psycopg2.extensions.connection): A database connection object.
+        retention (float): Days of data to keep.
+        interval (str): 'day' or 'hour'.
+
+    Returns:
+        List[str]: The partitions that were dropped.
+    """
+
+    suffix_format, width = _interval(interval)
+    dropped = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT NOW() AT TIME ZONE 'UTC' - make_interval(secs => %s)", (retention * 86400,))
+        cutoff = cur.fetchone()[0]
+        for table in PARTITIONED_TABLES:
+            cur.execute(
+                """
+                SELECT child.relname
+                FROM pg_inherits
+                JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE parent.relname = %s
+                """,
+                (table,)
+            )
+            for (name,) in cur.fetchall():
+                try:
+                    start = datetime.datetime.strptime(name[len(table) + 2:], suffix_format)
+                except ValueError:
+                    continue  # default partition or a partition of another interval
+                if start + width <= cutoff:
+                    cur.execute(f"DROP TABLE {name}")
+                    dropped.append(name)
+    conn.commit()
+    if dropped:
+        logging.info(f"Dropped expired partitions: {', '.join(dropped)}")
+    return dropped
+
+
+def maintain_partitions(conn: psycopg2.extensions.connection) -> None:
+    """
+    Empties the default partitions, pre-creates upcoming partitions and enforces the retention window.
+
+    Args:
+        conn (psycopg2.extensions.connection): A database connection object.
+    """
+
+    try:
+        # First, as a new partition cannot be created while the default partition holds rows of its range
+        drain_default_partitions(conn)
+        create_partitions(conn)
+        drop_expired_partitions(conn)
+    except psycopg2.Error as e:
+        logging.exception(f"An error occurred while maintaining partitions: {e}")
+        conn.rollback()
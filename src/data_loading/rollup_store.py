@@ -0,0 +1,130 @@
+import logging
+
+import psycopg2
+import psycopg2.extras
+
+from src.data_transformation.headways import HeadwayAggregator, ROLLUP_COLUMNS
+
+ROLLUP_TABLE = 'realtime_headway_rollups'
+ROLLUP_KEY = ROLLUP_COLUMNS[:5]
+
+
+def _merge(column: str) -> str:
+    """SQL merging the stored value of a statistic with a newly flushed one."""
+    if column.endswith('_min'):
+        return f"{column} = LEAST({ROLLUP_TABLE}.{column}, EXCLUDED.{column})"
+    if column.endswith('_max'):
+        return f"{column} = GREATEST({ROLLUP_TABLE}.{column}, EXCLUDED.{column})"
+    return f"{column} = {ROLLUP_TABLE}.{column} + EXCLUDED.{column}"
+
+
+def ensure_rollup_tables(conn: psycopg2.extensions.connection) -> None:
+    """
+    Creates the headway rollup table and the realtime_headway_stats view over it.
+
+    Args:
+        conn (psycopg2.extensions.connection): A database connection object.
+    """
+
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+                route_id VARCHAR(255) NOT NULL,
+                stop_id VARCHAR(255) NOT NULL,
+                direction_id SMALLINT NOT NULL,
+                window_seconds INTEGER NOT NULL,
+                window_start TIMESTAMP NOT NULL,
+                arrivals INTEGER NOT NULL,
+                headway_count INTEGER NOT NULL,
+                headway_sum BIGINT NOT NULL,
+                headway_sum_sq BIGINT NOT NULL,
+                headway_min INTEGER,
+                headway_max INTEGER,
+                bunched INTEGER NOT NULL,
+                delay_count INTEGER NOT NULL,
+                delay_sum BIGINT NOT NULL,
+                delay_sum_sq BIGINT NOT NULL,
+                delay_max INTEGER,
+                dwell_count INTEGER NOT NULL,
+                dwell_sum BIGINT NOT NULL,
+                dwell_max INTEGER,
+                updated_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
+                PRIMARY KEY (route_id, stop_id, direction_id, window_seconds, window_start)
+            )
+            """
+        )
+        cur.execute(f"ALTER TABLE {ROLLUP_TABLE} ALTER COLUMN updated_at SET DEFAULT (NOW() AT TIME ZONE 'UTC')")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {ROLLUP_TABLE}_window_idx "
+                    f"ON {ROLLUP_TABLE} (window_seconds, window_start)")
+        # Means, standard deviations and ratios from the additive sums
+        cur.execute(
+            f"""
+            CREATE OR REPLACE VIEW realtime_headway_stats AS
+            SELECT route_id, stop_id, direction_id, window_seconds, window_start, arrivals,
+                   headway_sum::float / NULLIF(headway_count, 0) AS headway_mean,
+                   sqrt(GREATEST(headway_sum_sq::float / NULLIF(headway_count, 0)
+                                 - (headway_sum::float / NULLIF(headway_count, 0)) ^ 2, 0)) AS headway_stddev,
+                   headway_min, headway_max,
+                   bunched::float / NULLIF(headway_count, 0) AS bunched_ratio,
+                   delay_sum::float / NULLIF(delay_count, 0) AS delay_mean,
+                   sqrt(GREATEST(delay_sum_sq::float / NULLIF(delay_count, 0)
+                                 - (delay_sum::float / NULLIF(delay_count, 0)) ^ 2, 0)) AS delay_stddev,
+                   delay_max,
+                   dwell_sum::float / NULLIF(dwell_count, 0) AS dwell_mean,
+                   dwell_max
+            FROM {ROLLUP_TABLE}
+            """
+        )
+    conn.commit()
+
+
+def write_rollups(cur, rows: list) -> None:
+    """
+    Merges rollup rows into the rollup table inside the caller's transaction.
+
+    Counts and sums are added to the stored ones and minima and maxima combined, so a window
+    can be flushed many times while it is still open.
+
+    Args:
+        cur (psycopg2.extensions.cursor): The cursor of the open transaction.
+        rows (list): Rows from HeadwayAggregator.drain(), at most one per window and stop.
+    """
+    psycopg2.extras.execute_values(
+        cur,
+        f"INSERT INTO {ROLLUP_TABLE} ({', '.join(ROLLUP_COLUMNS)}) VALUES %s "
+        f"ON CONFLICT ({', '.join(ROLLUP_KEY)}) DO UPDATE SET "
+        + ', '.join(_merge(column) for column in ROLLUP_COLUMNS[5:]) + ", updated_at = NOW() AT TIME ZONE 'UTC'",
+        rows,
+        page_size=1000
+    )
+
+
+def flush_rollups(aggregator: HeadwayAggregator, conn: psycopg2.extensions.connection) -> int:
+    """
+    Writes everything the aggregator accumulated since the last flush in one transaction.
+
+    On failure the statistics are handed back to the aggregator and written by the next flush.
+
+    Args:
+        aggregator (HeadwayAggregator): The aggregator to drain.
+        conn (psycopg2.extensions.connection): A database connection object.
+
+    Returns:
+        int: The number of rollup rows written.
+    """
+
+    rows = aggregator.drain()
+    if not rows:
+        return 0
+    try:
+        with conn.cursor() as cur:
+            write_rollups(cur, rows)
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        aggregator.restore(rows)
+        logging.error(f"Could not flush {len(rows)} headway rollups, retrying on the next flush: {e}")
+        return 0
+    logging.info(f"Flushed {len(rows)} headway rollups")
+    return len(rows)
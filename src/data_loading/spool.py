@@ -0,0 +1,474 @@
+import logging
+import os
+import pickle
+import struct
+import threading
+import time
+import uuid
+import zlib
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import psycopg2
+import psycopg2.pool
+
+from src.data_loading.db_pool import ConnectionPool
+from src.data_loading.feed_archive import feed_slug
+from config import (spool_path, spool_max_bytes, spool_segment_bytes, spool_fsync_interval, spool_fsync_batch,
+                    spool_max_attempts, db_reconnect_max_backoff)
+
+# Record header: payload length, CRC32 of the payload
+_RECORD_HEADER = struct.Struct('<II')
+
+SEGMENT_PREFIX = 'spool-'
+SEGMENT_SUFFIX = '.log'
+
+# Subdirectory of a spool holding the batches that could not be loaded
+QUARANTINE_DIR = 'quarantine'
+
+LOADED_BATCHES_TABLE = 'realtime_loaded_batches'
+
+
+class SpoolFull(Exception):
+    """Raised when a batch does not fit within the spool's size limit."""
+
+
+def ensure_spool_tables(conn: psycopg2.extensions.connection) -> None:
+    """
+    Creates the table of loaded batch ids that makes replays from the spool idempotent.
+
+    Args:
+        conn (psycopg2.extensions.connection): A database connection object.
+    """
+
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {LOADED_BATCHES_TABLE} (
+                batch_id VARCHAR(32) PRIMARY KEY,
+                loaded_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC')
+            )
+            """
+        )
+        cur.execute(f"ALTER TABLE {LOADED_BATCHES_TABLE} ALTER COLUMN loaded_at SET DEFAULT (NOW() AT TIME ZONE 'UTC')")
+    conn.commit()
+
+
+def prune_loaded_batches(conn: psycopg2.extensions.connection, days: float = 2) -> None:
+    """
+    Forgets loaded batch ids older than `days`, long after any spool segment holding them is gone.
+
+    Args:
+        conn (psycopg2.extensions.connection): A database connection object.
+        days (float): Days of batch ids to keep.
+    """
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DELETE FROM {LOADED_BATCHES_TABLE} "
+                        f"WHERE loaded_at < NOW() AT TIME ZONE 'UTC' - make_interval(secs => %s)", (days * 86400,))
+        conn.commit()
+    except psycopg2.Error as e:
+        logging.error(f"Could not prune {LOADED_BATCHES_TABLE}: {e}")
+        conn.rollback()
+
+
+def claim_batch(cur, batch_id: str) -> bool:
+    """
+    Records a batch as loaded inside the caller's transaction.
+
+    Args:
+        cur (psycopg2.extensions.cursor): The cursor of the open transaction.
+        batch_id (str): The spool batch id.
+
+    Returns:
+        bool: False if the batch was already loaded, in which case the caller should roll back.
+    """
+    cur.execute(f"INSERT INTO {LOADED_BATCHES_TABLE} (batch_id) VALUES (%s) ON CONFLICT DO NOTHING RETURNING 1",
+                (batch_id,))
+    return cur.fetchone() is not None
+
+
+class Spool:
+    """
+    A write-ahead spool of transformed batches in local append-only segment files.
+
+    Batches are pickled, compressed and appended with a length and CRC header. Writes are
+    flushed to the OS right away and fsynced in groups, every `fsync_batch` records or
+    `fsync_interval` seconds, so at most that window is lost if the host (not just the process)
+    crashes. Drainer threads read records in order and hand them to a load function; a segment
+    is deleted once every record in it has been loaded. Each batch has an id that the load
+    function records in the same transaction as the rows (see claim_batch), so batches replayed
+    after a crash are skipped: delivery is at least once, the effect exactly once.
+
+    Args:
+        path (str): The spool directory.
+        max_bytes (int): Upper bound on the spool size; appends beyond it raise SpoolFull.
+        segment_bytes (int): Size after which a new segment is started.
+        fsync_interval (float): Longest time in seconds between fsyncs.
+        fsync_batch (int): Records after which an fsync is forced.
+    """
+
+    def __init__(
+            self,
+            path: str = spool_path,
+            max_bytes: int = spool_max_bytes,
+            segment_bytes: int = spool_segment_bytes,
+            fsync_interval: float = spool_fsync_interval,
+            fsync_batch: int = spool_fsync_batch
+        ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+        os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._readable = threading.Condition(self._lock)
+        self._segments = sorted(
+            int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(path) if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+        self._size = sum(os.path.getsize(self._segment_path(seq)) for seq in self._segments)
+        self._writer = None
+        self._write_seq = (self._segments[-1] + 1) if self._segments else 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+        # Read position and records handed out but not yet acknowledged, per segment
+        self._read_seq = self._segments[0] if self._segments else self._write_seq
+        self._read_offset = 0
+        self._reader = None
+        self._in_flight: Dict[int, int] = {}
+        self._closed = False
+        self._counters = {"appended": 0, "loaded": 0, "rejected": 0, "corrupt": 0, "quarantined": 0}
+        if self._segments:
+            logging.info(f"Spool has {len(self._segments)} segment(s), {self._size} bytes left from a previous run")
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.path, f"{SEGMENT_PREFIX}{seq:012d}{SEGMENT_SUFFIX}")
+
+    def _sync(self) -> None:
+        if self._writer is not None and self._unsynced:
+            os.fsync(self._writer.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def append(self, record: Any, force: bool = False) -> str:
+        """
+        Persists one batch.
+
+        Args:
+            record: A picklable batch. If it is a dict, its `batch_id` is set here unless it has one.
+            force (bool): Ignore `max_bytes`, for batches moved from another spool.
+
+        Returns:
+            str: The batch id.
+        """
+
+        batch_id = (record.get('batch_id') if isinstance(record, dict) else None) or uuid.uuid4().hex
+        if isinstance(record, dict):
+            record = dict(record, batch_id=batch_id)
+        payload = zlib.compress(pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        data = _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if not force and self._size + len(data) > self.max_bytes:
+                self._counters["rejected"] += 1
+                raise SpoolFull(f"Spool is full ({self._size} of {self.max_bytes} bytes)")
+            if self._writer is None or self._writer.tell() >= self.segment_bytes:
+                self._rotate()
+            self._writer.write(data)
+            self._writer.flush()
+            self._size += len(data)
+            self._unsynced += 1
+            self._counters["appended"] += 1
+            if self._unsynced >= self.fsync_batch or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+            self._readable.notify()
+        return batch_id
+
+    def _rotate(self) -> None:
+        """Closes the current segment and starts a new one. Caller holds the lock."""
+        if self._writer is not None:
+            self._sync()
+            self._writer.close()
+        seq = self._write_seq
+        self._write_seq += 1
+        self._writer = open(self._segment_path(seq), 'ab')
+        self._segments.append(seq)
+
+    def sync(self) -> None:
+        """Fsyncs pending writes, e.g. from a timer when appends are rare."""
+        with self._lock:
+            if time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def _next_record(self) -> Optional[Tuple[int, Any]]:
+        """Reads the next complete record. Caller holds the lock."""
+        while True:
+            if self._read_seq not in self._segments:
+                later = [seq for seq in self._segments if seq > self._read_seq]
+                if not later:
+                    return None
+                self._read_seq, self._read_offset = later[0], 0
+            if self._reader is None or self._reader.name != self._segment_path(self._read_seq):
+                if self._reader is not None:
+                    self._reader.close()
+                self._reader = open(self._segment_path(self._read_seq), 'rb')
+            self._reader.seek(self._read_offset)
+            header = self._reader.read(_RECORD_HEADER.size)
+            if len(header) == _RECORD_HEADER.size:
+                length, crc = _RECORD_HEADER.unpack(header)
+                payload = self._reader.read(length)
+                if len(payload) == length:
+                    seq = self._read_seq
+                    self._read_offset += _RECORD_HEADER.size + length
+                    self._in_flight[seq] = self._in_flight.get(seq, 0) + 1
+                    if zlib.crc32(payload) != crc:
+                        self._counters["corrupt"] += 1
+                        logging.error(f"Skipping corrupt spool record in segment {seq}")
+                        self._ack(seq)
+                        continue
+                    return seq, payload
+            # The end of the segment, or a record that is still being written
+            if self._read_seq == self._write_seq - 1 and self._writer is not None:
+                return None
+            # A finished segment ends here; anything left is a torn write from a crash
+            finished = self._read_seq
+            later = [seq for seq in self._segments if seq > finished]
+            self._read_seq, self._read_offset = (later[0] if later else self._write_seq), 0
+            self._maybe_delete(finished)
+
+    def _ack(self, seq: int) -> None:
+        """Marks one record of a segment as loaded. Caller holds the lock."""
+        self._in_flight[seq] -= 1
+        self._maybe_delete(seq)
+
+    def _maybe_delete(self, seq: int) -> None:
+        """Deletes a segment once it is fully read and all of its records are loaded. Caller holds the lock."""
+        if seq >= self._read_seq or self._in_flight.get(seq, 0) > 0 or seq not in self._segments:
+            return
+        path = self._segment_path(seq)
+        self._size -= os.path.getsize(path)
+        os.remove(path)
+        self._segments.remove(seq)
+        self._in_flight.pop(seq, None)
+
+    def take(self, timeout: float) -> Optional[Tuple[int, Any]]:
+        """
+        Returns the next unread batch, waiting up to `timeout` seconds for one.
+
+        Returns:
+            Optional[Tuple[int, Any]]: The segment of the batch (to pass to done) and the batch.
+        """
+        with self._lock:
+            entry = self._next_record()
+            if entry is None and not self._closed:
+                self._readable.wait(timeout)
+                entry = self._next_record()
+        if entry is None:
+            return None
+        seq, payload = entry
+        try:
+            return seq, pickle.loads(zlib.decompress(payload))
+        except Exception as e:
+            logging.error(f"Skipping unreadable spool record in segment {seq}: {e}")
+            with self._lock:
+                self._counters["corrupt"] += 1
+                self._ack(seq)
+            return None
+
+    def done(self, seq: int) -> None:
+        """Acknowledges a batch returned by take once it has been loaded."""
+        with self._lock:
+            self._counters["loaded"] += 1
+            self._ack(seq)
+
+    def quarantine(self, seq: int, batch: Any) -> str:
+        """
+        Moves a batch returned by take that cannot be loaded to the quarantine directory and
+        acknowledges it, so the batches after it are loaded.
+
+        Args:
+            seq (int): The segment of the batch, as returned by take.
+            batch: The batch.
+
+        Returns:
+            str: The path of the quarantined batch, which can be read back with pickle and zlib.
+        """
+        directory = os.path.join(self.path, QUARANTINE_DIR)
+        os.makedirs(directory, exist_ok=True)
+        batch_id = (batch.get('batch_id') if isinstance(batch, dict) else None) or uuid.uuid4().hex
+        path = os.path.join(directory, f"{batch_id}.batch")
+        with open(path, 'wb') as f:
+            f.write(zlib.compress(pickle.dumps(batch, protocol=pickle.HIGHEST_PROTOCOL), 1))
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock:
+            self._counters["quarantined"] += 1
+            self._ack(seq)
+        return path
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the backlog (bytes and segments not yet loaded) and the counters since start."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["backlog_bytes"] = self._size
+            stats["segments"] = len(self._segments)
+            stats["max_bytes"] = self.max_bytes
+            return stats
+
+    def close(self) -> None:
+        """Fsyncs and closes the spool; unloaded batches stay on disk for the next start."""
+        with self._lock:
+            self._closed = True
+            self._sync()
+            for handle in (self._writer, self._reader):
+                if handle is not None:
+                    handle.close()
+            self._writer = self._reader = None
+            self._readable.notify_all()
+
+
+class FeedSpools:
+    """
+    One Spool per feed, in a subdirectory of `path` named after the feed, so that each feed's
+    batches can be drained in order by a drainer of its own.
+
+    A feed's batches must be committed in the order they were diffed: a later batch loaded
+    before an earlier one would, e.g., open an alert version after its replacement or restore a
+    trip that already disappeared. Batches of different feeds are independent and are loaded
+    concurrently. Segments left in `path` itself by a single shared spool are moved into the
+    feed spools, in order, when they are opened.
+
+    Args:
+        urls (Sequence[str]): The feed endpoints; spools left by other feeds are drained as well.
+        path (str): The spool directory.
+        max_bytes (int): Upper bound on the size of all spools, split evenly between the feeds.
+        segment_bytes (int): Size after which a new segment is started.
+        fsync_interval (float): Longest time in seconds between fsyncs.
+        fsync_batch (int): Records after which an fsync is forced.
+    """
+
+    def __init__(
+            self,
+            urls: Sequence[str],
+            path: str = spool_path,
+            max_bytes: int = spool_max_bytes,
+            segment_bytes: int = spool_segment_bytes,
+            fsync_interval: float = spool_fsync_interval,
+            fsync_batch: int = spool_fsync_batch
+        ):
+        os.makedirs(path, exist_ok=True)
+        slugs = {feed_slug(url) for url in urls}
+        slugs.update(name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name)))
+        self.max_bytes = max_bytes
+        self.spools: Dict[str, Spool] = {
+            slug: Spool(os.path.join(path, slug), max_bytes // len(slugs), segment_bytes, fsync_interval, fsync_batch)
+            for slug in sorted(slugs)
+        }
+        self._migrate(Spool(path, max_bytes, segment_bytes, fsync_interval, fsync_batch))
+
+    def _migrate(self, shared: Spool) -> None:
+        """Moves the batches of a shared spool into the feed spools, keeping their order and ids."""
+        moved = 0
+        while True:
+            entry = shared.take(timeout=0)
+            if entry is None:
+                if not shared.stats()["segments"]:
+                    break
+                continue  # a corrupt record was skipped
+            seq, batch = entry
+            slug = feed_slug(batch['url'])
+            if slug not in self.spools:
+                self.spools[slug] = Spool(os.path.join(shared.path, slug), shared.max_bytes // (len(self.spools) + 1),
+                                          shared.segment_bytes, shared.fsync_interval, shared.fsync_batch)
+            # The batches are on disk already, so the size limit does not apply
+            self.spools[slug].append(batch, force=True)
+            shared.done(seq)
+            moved += 1
+        shared.close()
+        if moved:
+            for spool in self.spools.values():
+                spool.sync()
+            logging.info(f"Moved {moved} spooled batches into the spools of their feeds")
+
+    def append(self, record: Dict) -> str:
+        """
+        Persists one batch in the spool of its feed.
+
+        Args:
+            record (Dict): A picklable batch with the feed's `url`.
+
+        Returns:
+            str: The batch id.
+        """
+        return self.spools[feed_slug(record['url'])].append(record)
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the backlog and counters of all feed spools, summed."""
+        totals: Dict[str, float] = {}
+        for spool in self.spools.values():
+            for stat, value in spool.stats().items():
+                totals[stat] = totals.get(stat, 0) + value
+        return totals
+
+    def close(self) -> None:
+        """Fsyncs and closes every feed spool."""
+        for spool in self.spools.values():
+            spool.close()
+
+
+def run_drainer(spool: Spool, pool: ConnectionPool, load: Callable[[Any, psycopg2.extensions.connection], None],
+                stop_event: threading.Event, max_attempts: int = spool_max_attempts,
+                on_quarantine: Optional[Callable[[Any], None]] = None) -> None:
+    """
+    Loads batches from the spool until `stop_event` is set, retrying with backoff while the
+    database is unreachable. Batches are loaded one at a time in spool order, so a spool must
+    have a single drainer.
+
+    A batch that fails `max_attempts` times for any other reason, e.g. a row the database
+    refuses outright or a bug in the load function, is moved to the spool's quarantine
+    directory, so one bad batch does not hold up every later batch of the feed.
+
+    Args:
+        spool (Spool): The spool to drain.
+        pool (ConnectionPool): The database connection pool.
+        load (Callable): Loads one batch in one transaction on the given connection, raising
+            if it did not commit.
+        stop_event (threading.Event): Set to stop after the current batch.
+        max_attempts (int): Failed loads after which a batch is quarantined.
+        on_quarantine (Optional[Callable[[Any], None]]): Called with every quarantined batch.
+    """
+
+    while not stop_event.is_set():
+        entry = spool.take(timeout=1)
+        if entry is None:
+            spool.sync()
+            continue
+        seq, batch = entry
+        delay = 0.5
+        attempts = 0
+        while True:
+            try:
+                with pool.connection() as conn:
+                    load(batch, conn)
+                spool.done(seq)
+                break
+            except Exception as e:
+                if stop_event.is_set():
+                    # Left on disk, loaded again after the next start
+                    return
+                # An unreachable database is waited out, however long it takes
+                if not isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError,
+                                      psycopg2.pool.PoolError)):
+                    attempts += 1
+                    if attempts >= max_attempts:
+                        path = spool.quarantine(seq, batch)
+                        logging.exception(f"Spooled batch failed {attempts} times, moved it to {path}: {e}")
+                        if on_quarantine is not None:
+                            on_quarantine(batch)
+                        break
+                logging.warning(f"Spooled batch not loaded, retrying in {delay:.1f}s: {e}")
+                stop_event.wait(delay)
+                delay = min(delay * 2, db_reconnect_max_backoff)
@@ -1,101 +1,271 @@
-from typing import List, Dict
+from typing import Any, Callable, List, Dict, Optional, Sequence, Tuple, Union
+import datetime
+import io
+import json
 import psycopg2
+import psycopg2.extras
 import logging
+from src.data_transformation.columnar import ColumnBatch
+from src.data_transformation.alert_state import AlertChanges
+from src.data_loading.alert_store import write_alert_changes
+from src.data_loading.current_state import write_current_state
+from src.monitoring.metrics import STAGE_SECONDS, ROWS_LOADED, ROWS_REJECTED, ERRORS, current_feed
+from config import current_state_tables
 
-def load_trip_updates(trip_updates: List[Dict], conn: psycopg2.extensions.connection) -> None:
+# Rows may be passed as lists of dictionaries, as columnar batches from the transformer, or as
+# tuples already ordered like the load columns
+Rows = Union[List[Dict], ColumnBatch, List[tuple]]
+
+TRIP_UPDATE_COLUMNS = ('trip_id', 'route_id', 'start_date', 'schedule_relationship',
+                       'arrival_time', 'departure_time', 'stop_id',
+                       'direction_id', 'trip_headsign', 'service_id', 'parent_station')
+VEHICLE_POSITION_COLUMNS = ('trip_id', 'route_id', 'current_stop_sequence',
+                            'stop_id', 'current_status', 'timestamp',
+                            'direction_id', 'trip_headsign', 'service_id', 'parent_station')
+ALERT_COLUMNS = ('alert_id', 'trip_id', 'route_id', 'description_text')
+TRIP_EVENT_COLUMNS = ('trip_id', 'route_id', 'event')
+
+# Table that receives rows which Postgres refused during a bulk load
+REJECT_TABLE = 'realtime_load_rejects'
+
+
+def _copy_value(value) -> str:
+    """
+    Formats a single value for Postgres' COPY text format.
+
+    Args:
+        value: The value to format.
+
+    Returns:
+        str: The escaped value, or \\N for NULL.
+    """
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _as_tuples(rows: Rows, columns: Sequence[str]) -> List[tuple]:
+    """Converts dictionaries or a column batch into value tuples ordered like `columns`, missing values as None."""
+    if isinstance(rows, ColumnBatch):
+        return rows.to_tuples(columns)
+    if rows and isinstance(rows[0], tuple):
+        return rows  # already ordered like `columns`
+    return [tuple(row.get(col) for col in columns) for row in rows]
+
+
+def _copy_batch(cur, table: str, columns: Sequence[str], rows: Sequence[tuple]) -> None:
+    """Streams a batch of row tuples into `table` with COPY FROM STDIN."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def _store_rejects(cur, table: str, columns: Sequence[str], rejects: List[Tuple[tuple, str]]) -> None:
+    """Writes rows that could not be loaded to the reject table with the database error."""
+    psycopg2.extras.execute_values(
+        cur,
+        f"INSERT INTO {REJECT_TABLE} (table_name, row_data, error) VALUES %s",
+        [(table, json.dumps(dict(zip(columns, row)), default=str), error) for row, error in rejects]
+    )
+
+
+def copy_rows(cur, table: str, columns: Sequence[str], rows: Rows) -> int:
+    """
+    Bulk loads rows into a table with COPY, inside the caller's transaction.
+
+    The whole batch is copied under a savepoint. If Postgres rejects its data, the batch is
+    split in half and each half retried, so a few bad rows only cost a handful of extra
+    round-trips. Rows that fail on their own are written to the reject table. Any other error,
+    e.g. a missing table or column or a lost connection, fails every row alike and is raised
+    right away.
+
+    Args:
+        cur (psycopg2.extensions.cursor): The cursor of the open transaction.
+        table (str): The destination table.
+        columns (Sequence[str]): The columns to load, matching keys of each row.
+        rows (Rows): The rows to load, as dictionaries or a ColumnBatch.
+
+    Returns:
+        int: The number of rows loaded.
+
+    Raises:
+        psycopg2.Error: For errors other than rejected data; the transaction must be rolled back.
+    """
+
+    rows = _as_tuples(rows, columns)
+    loaded = 0
+    rejects = []
+    pending = [rows] if rows else []
+    while pending:
+        batch = pending.pop()
+        cur.execute("SAVEPOINT bulk_copy")
+        try:
+            _copy_batch(cur, table, columns, batch)
+        except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+            cur.execute("ROLLBACK TO SAVEPOINT bulk_copy")
+            if len(batch) == 1:
+                rejects.append((batch[0], str(e).strip()))
+            else:
+                middle = len(batch) // 2
+                pending.extend((batch[middle:], batch[:middle]))
+        else:
+            loaded += len(batch)
+        cur.execute("RELEASE SAVEPOINT bulk_copy")
+
+    if rejects:
+        _store_rejects(cur, table, columns, rejects)
+        ROWS_REJECTED.inc(current_feed(), table, amount=len(rejects))
+        logging.warning(f"Rejected {len(rejects)} of {len(rows)} rows for {table}")
+    return loaded
+
+
+def _load(table: str, columns: Sequence[str], rows: Rows, conn: psycopg2.extensions.connection) -> None:
+    """Loads one batch of rows into `table` in a single transaction."""
+    try:
+        with conn.cursor() as cur:
+            loaded = copy_rows(cur, table, columns, rows)
+        conn.commit()
+        ROWS_LOADED.inc(current_feed(), table, amount=loaded)
+        logging.info(f"Loaded {loaded} rows into {table}")
+    except psycopg2.Error as e:
+        ERRORS.inc('load', current_feed())
+        logging.error(f"Failed to load {table}: {e}")
+        conn.rollback()
+
+
+def load_trip_updates(trip_updates: Rows, conn: psycopg2.extensions.connection) -> None:
     """
     Load trip updates into the database.
 
     Args:
-        trip_updates (list): A list of trip update dictionaries.
+        trip_updates (Rows): Trip update dictionaries or a ColumnBatch.
         conn (psycopg2.extensions.connection): The database connection object.
     """
-    
-    with conn.cursor() as cur:
-        for trip_update in trip_updates:
-            try:
-                cur.execute("""
-                    INSERT INTO realtime_trip_updates (trip_id, route_id, start_date, schedule_relationship,
-                                                       arrival_time, departure_time, stop_id)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    trip_update['trip_id'], trip_update['route_id'], trip_update['start_date'],
-                    trip_update['schedule_relationship'], trip_update['arrival_time'],
-                    trip_update['departure_time'], trip_update['stop_id']
-                ))
-            except Exception as e:
-                logging.error(f"Failed to insert trip update: {e}")
-                conn.rollback()
-            else:
-                conn.commit()
 
-def load_vehicle_positions(vehicle_positions: List[Dict], conn: psycopg2.extensions.connection) -> None:
+    _load('realtime_trip_updates', TRIP_UPDATE_COLUMNS, trip_updates, conn)
+
+def load_vehicle_positions(vehicle_positions: Rows, conn: psycopg2.extensions.connection) -> None:
     """
     Load vehicle positions into the database.
-    
+
     Args:
-        vehicle_positions (list): A list of vehicle position dictionaries.
+        vehicle_positions (Rows): Vehicle position dictionaries or a ColumnBatch.
         conn (psycopg2.extensions.connection): The database connection object.
     """
-    
-    with conn.cursor() as cur:
-        for vehicle_position in vehicle_positions:
-            try:
-                cur.execute("""
-                    INSERT INTO realtime_vehicle_positions (trip_id, route_id, current_stop_sequence,
-                                                           stop_id, current_status, timestamp)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """, (
-                    vehicle_position['trip_id'], vehicle_position['route_id'],
-                    vehicle_position['current_stop_sequence'], vehicle_position['stop_id'],
-                    vehicle_position['current_status'], vehicle_position['timestamp']
-                ))
-            except Exception as e:
-                logging.error(f"Failed to insert vehicle position: {e}")
-                conn.rollback()
-            else:
-                conn.commit()
 
-def load_alerts(alerts: List[Dict], conn: psycopg2.extensions.connection) -> None:
+    _load('realtime_vehicle_positions', VEHICLE_POSITION_COLUMNS, vehicle_positions, conn)
+
+def load_alerts(alerts: Rows, conn: psycopg2.extensions.connection) -> None:
     """
     Load alerts into the database.
-    
+
     Args:
-        alerts (list): A list of alert dictionaries.
+        alerts (Rows): Alert dictionaries or a ColumnBatch.
         conn (psycopg2.extensions.connection): The database connection object.
     """
-    
-    with conn.cursor() as cur:
-        for alert in alerts:
-            try:
-                cur.execute("""
-                    INSERT INTO realtime_alerts (alert_id, trip_id, route_id, description_text)
-                    VALUES (%s, %s, %s, %s)
-                """, (
-                    alert['alert_id'], alert['trip_id'], alert['route_id'], alert['description_text']
-                ))
-            except Exception as e:
-                logging.error(f"Failed to insert alert: {e}")
-                conn.rollback()
-            else:
-                conn.commit()
+
+    _load('realtime_alerts', ALERT_COLUMNS, alerts, conn)
+
+def copy_all(
+        cur,
+        trip_updates: Rows,
+        vehicle_positions: Rows,
+        alerts: Rows,
+        trip_events: Optional[List[Dict]] = None,
+        last_updated: Optional[datetime.datetime] = None,
+        seen_trips: Optional[List[Tuple[str, str]]] = None
+    ) -> Dict[str, int]:
+    """
+    Copies all rows extracted from one feed inside the caller's transaction.
+
+    Rows get the insert time as last_updated unless `last_updated` is given, e.g. the fetch time
+    of a batch that is loaded late. Unless disabled, the trip updates and vehicle positions are
+    also applied to the current-state tables.
+
+    Args:
+        cur (psycopg2.extensions.cursor): The cursor of the open transaction.
+        trip_updates (Rows): Trip update dictionaries or a ColumnBatch.
+        vehicle_positions (Rows): Vehicle position dictionaries or a ColumnBatch.
+        alerts (Rows): Alert dictionaries or a ColumnBatch.
+        trip_events (list, optional): A list of trip event dictionaries, e.g. disappeared trips.
+        last_updated (datetime.datetime, optional): The last_updated value of every row.
+        seen_trips (list, optional): (trip_id, route_id) of every trip of the snapshot, changed
+            or not, for the current-state tables.
+
+    Returns:
+        Dict[str, int]: The number of rows loaded per table.
+    """
+
+    trip_updates = _as_tuples(trip_updates, TRIP_UPDATE_COLUMNS)
+    vehicle_positions = _as_tuples(vehicle_positions, VEHICLE_POSITION_COLUMNS)
+    loaded = {}
+    for table, columns, rows in (('realtime_trip_updates', TRIP_UPDATE_COLUMNS, trip_updates),
+                                 ('realtime_vehicle_positions', VEHICLE_POSITION_COLUMNS, vehicle_positions),
+                                 ('realtime_alerts', ALERT_COLUMNS, alerts),
+                                 ('realtime_trip_events', TRIP_EVENT_COLUMNS, trip_events or [])):
+        if last_updated is not None:
+            rows = [row + (last_updated,) for row in _as_tuples(rows, columns)]
+            columns = tuple(columns) + ('last_updated',)
+        loaded[table] = copy_rows(cur, table, columns, rows)
+    if current_state_tables:
+        loaded.update(write_current_state(cur, trip_updates, TRIP_UPDATE_COLUMNS, vehicle_positions,
+                                          VEHICLE_POSITION_COLUMNS, trip_events, last_updated, seen_trips))
+    return loaded
 
 def load_all_data(
-        trip_updates: List[Dict],
-        vehicle_positions: List[Dict],
-        alerts: List[Dict],
-        conn: psycopg2.extensions.connection
-    ) -> None:
+        trip_updates: Rows,
+        vehicle_positions: Rows,
+        alerts: Rows,
+        conn: psycopg2.extensions.connection,
+        trip_events: Optional[List[Dict]] = None,
+        alert_changes: Optional[AlertChanges] = None,
+        seen_trips: Optional[List[Tuple[str, str]]] = None,
+        may_commit: Optional[Callable[[Any], bool]] = None
+    ) -> bool:
     """
-    A wrapper function to load all extracted data into the database.
+    A wrapper function to load all data extracted from one feed into the database
+    in a single transaction.
 
     Args:
-        trip_updates (list): A list of trip update dictionaries.
-        vehicle_positions (list): A list of vehicle position dictionaries.
-        alerts (list): A list of alert dictionaries.
+        trip_updates (Rows): Trip update dictionaries or a ColumnBatch.
+        vehicle_positions (Rows): Vehicle position dictionaries or a ColumnBatch.
+        alerts (Rows): Alert dictionaries or a ColumnBatch.
         conn (psycopg2.extensions.connection): The database connection object.
+        trip_events (list, optional): A list of trip event dictionaries, e.g. disappeared trips.
+        alert_changes (AlertChanges, optional): Alerts that appeared, changed or were cleared.
+        seen_trips (list, optional): (trip_id, route_id) of every trip of the snapshot.
+        may_commit (Callable, optional): Called with the cursor just before the commit; if it
+            returns False the transaction is rolled back, e.g. when the feed's lease was lost.
+
+    Returns:
+        bool: Whether the transaction was committed; on failure it is rolled back.
     """
-    
-    load_trip_updates(trip_updates, conn)
-    load_vehicle_positions(vehicle_positions, conn)
-    load_alerts(alerts, conn)
+
+    feed = current_feed()
+    try:
+        with STAGE_SECONDS.time('load', feed):
+            with conn.cursor() as cur:
+                loaded = copy_all(cur, trip_updates, vehicle_positions, alerts, trip_events,
+                                  seen_trips=seen_trips)
+                if alert_changes is not None:
+                    loaded['realtime_alert_versions'] = write_alert_changes(cur, alert_changes)
+                if may_commit is not None and not may_commit(cur):
+                    conn.rollback()
+                    logging.warning("Not committing the feed data, the load was called off")
+                    return False
+            conn.commit()
+        for table, count in loaded.items():
+            ROWS_LOADED.inc(feed, table, amount=count)
+        logging.info(f"Loaded {loaded['realtime_trip_updates']} trip updates, "
+                     f"{loaded['realtime_vehicle_positions']} vehicle positions "
+                     f"and {loaded['realtime_alerts']} alerts")
+        return True
+    except psycopg2.Error as e:
+        ERRORS.inc('load', feed)
+        logging.error(f"Failed to load feed data: {e}")
+        conn.rollback()
+        return False
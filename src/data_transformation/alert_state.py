@@ -0,0 +1,170 @@
+import hashlib
+import logging
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from . import gtfs_realtime_pb2
+from .wire_decoder import _iter_fields, _string, _LEN
+
+# TranslatedString fields of an Alert, stored per language
+ALERT_TEXT_FIELDS = ('header', 'description', 'url')
+
+
+class AlertRecord(NamedTuple):
+    """One alert of a feed snapshot, with all of its informed entities, periods and translations."""
+    alert_id: str
+    cause: int
+    effect: int
+    # (start, end) epoch seconds, 0 when open-ended
+    active_periods: Tuple[Tuple[int, int], ...]
+    # (agency_id, route_id, route_type, trip_id, stop_id), missing values as None
+    informed_entities: Tuple[Tuple[Optional[str], Optional[str], Optional[int], Optional[str], Optional[str]], ...]
+    # (field, language, text) with field one of ALERT_TEXT_FIELDS
+    translations: Tuple[Tuple[str, str, str], ...]
+
+    @property
+    def content_hash(self) -> str:
+        """A hash of everything but the id, stable across processes so it can be compared with stored versions."""
+        return hashlib.sha1(repr(self[1:]).encode('utf-8')).hexdigest()
+
+
+class AlertChanges(NamedTuple):
+    """The alerts of one feed snapshot that appeared, changed or were cleared since the previous one."""
+    feed: str
+    seen_at: float
+    changed: List[AlertRecord]
+    cleared: List[str]
+    # Every alert id of the snapshot, set when the previous state of the feed is unknown (after a
+    # restart), so stored alerts missing from the snapshot can be cleared
+    present: Optional[List[str]] = None
+
+    def __bool__(self) -> bool:
+        return bool(self.changed or self.cleared or self.present is not None)
+
+
+def _translations(field: str, translated_string) -> List[Tuple[str, str, str]]:
+    return [(field, translation.language or '', translation.text) for translation in translated_string.translation]
+
+
+def _alert_record(alert_id: str, alert) -> AlertRecord:
+    """Builds an AlertRecord from a gtfs_realtime_pb2.Alert."""
+    entities = tuple(
+        (
+            entity.agency_id or None,
+            entity.route_id or entity.trip.route_id or None,
+            entity.route_type if entity.HasField('route_type') else None,
+            entity.trip.trip_id or None,
+            entity.stop_id or None,
+        )
+        for entity in alert.informed_entity
+    )
+    return AlertRecord(
+        alert_id=alert_id,
+        cause=alert.cause,
+        effect=alert.effect,
+        active_periods=tuple((period.start, period.end) for period in alert.active_period),
+        informed_entities=entities,
+        translations=tuple(
+            _translations('header', alert.header_text)
+            + _translations('description', alert.description_text)
+            + _translations('url', alert.url)
+        ),
+    )
+
+
+def extract_alert_records(binary_data: bytes) -> List[AlertRecord]:
+    """
+    Extracts the alerts of a feed with all of their fields.
+
+    Entities are located with the wire scanner and only the Alert messages are parsed, so feeds
+    without alerts cost one pass over the entity headers.
+
+    Args:
+        binary_data (bytes): The binary FeedMessage.
+
+    Returns:
+        List[AlertRecord]: The alerts, in feed order.
+    """
+
+    records = []
+    for field_number, wire_type, entity in _iter_fields(binary_data, 0, len(binary_data)):
+        if field_number != 2 or wire_type != _LEN:
+            continue
+        entity_id, alert, other = '', None, False
+        for entity_field, entity_wire_type, value in _iter_fields(binary_data, *entity):
+            if entity_wire_type != _LEN:
+                continue
+            if entity_field == 1:
+                entity_id = _string(binary_data, value)
+            elif entity_field in (3, 4):
+                other = True
+            elif entity_field == 5:
+                alert = value
+        # Same precedence as process_feed: trip updates and vehicles win over alerts
+        if alert is not None and not other:
+            message = gtfs_realtime_pb2.Alert.FromString(binary_data[alert[0]:alert[1]])
+            records.append(_alert_record(entity_id, message))
+    return records
+
+
+class AlertStateDiffer:
+    """
+    Keeps the content hash of every active alert per feed, so that only alerts that appeared,
+    changed or were cleared are written.
+
+    Alerts are few and long-lived, so unlike trips they are kept until they leave the feed.
+    Like TripStateDiffer, the state advances with every diff and must be reset() when the
+    changes were not written.
+    """
+
+    def __init__(self):
+        # feed -> {alert_id: content hash}
+        self._feeds: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def diff(self, feed_key: str, records: List[AlertRecord], now: Optional[float] = None) -> AlertChanges:
+        """
+        Compares the alerts of a snapshot with the previous snapshot of the feed.
+
+        Args:
+            feed_key (str): Identifies the feed, e.g. its endpoint url.
+            records (List[AlertRecord]): All alerts of the snapshot.
+            now (Optional[float]): The epoch time the snapshot was fetched, defaults to time.time().
+
+        Returns:
+            AlertChanges: The changes to apply. The first snapshot of a feed lists every alert
+            as changed, with `present` set.
+        """
+
+        now = time.time() if now is None else now
+        with self._lock:
+            previous = self._feeds.get(feed_key)
+            current = {}
+            changed = []
+            for record in records:
+                if record.alert_id in current:
+                    continue  # duplicate entity ids, keep the first like the store does
+                current[record.alert_id] = record.content_hash
+                if previous is None or previous.get(record.alert_id) != current[record.alert_id]:
+                    changed.append(record)
+            cleared = [alert_id for alert_id in previous if alert_id not in current] if previous is not None else []
+            self._feeds[feed_key] = current
+
+        logging.debug(f"Alert diff for {feed_key}: {len(changed)}/{len(records)} changed, {len(cleared)} cleared")
+        return AlertChanges(feed_key, now, changed, cleared, list(current) if previous is None else None)
+
+    def reset(self, feed_key: str) -> None:
+        """
+        Forgets the alerts of a feed, so that its next snapshot lists them all with `present` set.
+
+        Args:
+            feed_key (str): Identifies the feed, e.g. its endpoint url.
+        """
+        with self._lock:
+            self._feeds.pop(feed_key, None)
+
+    def tracked_alerts(self) -> int:
+        """Returns the number of alerts currently held in memory across all feeds."""
+        with self._lock:
+            return sum(len(alerts) for alerts in self._feeds.values())
@@ -1,4 +1,45 @@
-from . import gtfs_realtime_pb2
+import importlib.util
+import logging
+import os
+import sys
+from typing import Optional, Tuple
+
+
+def _prefer_fast_backend() -> None:
+    """
+    Selects the C++ protobuf backend when it is installed and nothing else was requested.
+
+    The backend is fixed when protobuf is first imported, so this must run before the generated
+    module is loaded. Newer protobuf releases default to the upb backend, which is left alone.
+    """
+
+    if 'PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION' in os.environ or 'google.protobuf.message' in sys.modules:
+        return
+    try:
+        if importlib.util.find_spec('google._upb._message') is not None:
+            return
+        if importlib.util.find_spec('google.protobuf.pyext._message') is not None:
+            os.environ['PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION'] = 'cpp'
+    except ImportError:
+        pass
+
+
+_prefer_fast_backend()
+
+from . import gtfs_realtime_pb2  # noqa: E402
+from src.monitoring.metrics import STAGE_SECONDS, current_feed  # noqa: E402
+
+
+def protobuf_backend() -> str:
+    """
+    Reports which protobuf implementation decodes feeds in this process.
+
+    Returns:
+        str: 'upb', 'cpp' or 'python'.
+    """
+
+    from google.protobuf.internal import api_implementation
+    return api_implementation.Type()
 
 def decode_binary(binary_data: bytes) -> gtfs_realtime_pb2.FeedMessage:
     """
@@ -15,6 +56,76 @@ def decode_binary(binary_data: bytes) -> gtfs_realtime_pb2.FeedMessage:
     feed_message = gtfs_realtime_pb2.FeedMessage()
     
     # Parse the binary data into the FeedMessage object
-    feed_message.ParseFromString(binary_data)
+    with STAGE_SECONDS.time('decode', current_feed()):
+        feed_message.ParseFromString(binary_data)
     
     return feed_message
+
+
+def _read_varint(buffer: bytes, pos: int) -> Tuple[int, int]:
+    """
+    Reads a protobuf base-128 varint.
+
+    Args:
+        buffer (bytes): The wire-format data.
+        pos (int): The offset of the first byte of the varint.
+
+    Returns:
+        Tuple[int, int]: The decoded value and the offset just past it.
+    """
+
+    result = 0
+    shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _skip_field(buffer: bytes, pos: int, wire_type: int) -> int:
+    """Returns the offset just past a field value of the given wire type."""
+    if wire_type == 0:
+        return _read_varint(buffer, pos)[1]
+    if wire_type == 1:
+        return pos + 8
+    if wire_type == 2:
+        length, pos = _read_varint(buffer, pos)
+        return pos + length
+    if wire_type == 5:
+        return pos + 4
+    raise ValueError(f"Unsupported wire type {wire_type}")
+
+
+def read_header_timestamp(binary_data: bytes) -> Optional[int]:
+    """
+    Reads FeedHeader.timestamp straight from the wire format without decoding the feed entities.
+
+    Args:
+        binary_data (bytes): The binary FeedMessage.
+
+    Returns:
+        Optional[int]: The header timestamp, or None if it is absent or the data is malformed.
+    """
+
+    try:
+        pos = 0
+        end = len(binary_data)
+        while pos < end:
+            key, pos = _read_varint(binary_data, pos)
+            field_number, wire_type = key >> 3, key & 0x7
+            if field_number == 1 and wire_type == 2:  # FeedMessage.header
+                length, pos = _read_varint(binary_data, pos)
+                header_end = pos + length
+                while pos < header_end:
+                    key, pos = _read_varint(binary_data, pos)
+                    if key >> 3 == 3 and key & 0x7 == 0:  # FeedHeader.timestamp
+                        return _read_varint(binary_data, pos)[0]
+                    pos = _skip_field(binary_data, pos, key & 0x7)
+                return None
+            pos = _skip_field(binary_data, pos, wire_type)
+    except (IndexError, ValueError):
+        logging.warning("Could not read feed header timestamp from binary data")
+    return None
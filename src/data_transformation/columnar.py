@@ -0,0 +1,147 @@
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Column kinds:
+#   'str'       interned string id, -1 for None
+#   'int'       integer
+#   'nint'      non-negative integer, -1 for None
+#   'time'      epoch seconds rendered as HH:MM:SS (UTC), -1 for None
+#   'timestamp' epoch seconds rendered as a UTC timestamp
+_TYPECODES = {'str': 'q', 'int': 'q', 'nint': 'q', 'time': 'q', 'timestamp': 'q'}
+
+TRIP_UPDATE_SCHEMA = (
+    ('trip_id', 'str'), ('route_id', 'str'), ('start_date', 'str'), ('schedule_relationship', 'int'),
+    ('arrival_time', 'time'), ('departure_time', 'time'), ('stop_id', 'str'),
+)
+VEHICLE_POSITION_SCHEMA = (
+    ('trip_id', 'str'), ('route_id', 'str'), ('current_stop_sequence', 'int'),
+    ('stop_id', 'str'), ('current_status', 'int'), ('timestamp', 'timestamp'),
+)
+ALERT_SCHEMA = (
+    ('alert_id', 'str'), ('trip_id', 'str'), ('route_id', 'str'), ('description_text', 'str'),
+)
+
+
+class StringPool:
+    """Interns strings so that string columns only store integer ids."""
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self.strings: List[str] = []
+
+    def intern(self, value: Optional[str]) -> int:
+        """
+        Returns the id of a string, adding it to the pool if needed.
+
+        Args:
+            value (Optional[str]): The string to intern.
+
+        Returns:
+            int: The string id, or -1 for None.
+        """
+        if value is None:
+            return -1
+        string_id = self._ids.get(value)
+        if string_id is None:
+            string_id = self._ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+
+class ColumnBatch:
+    """
+    A batch of rows for one entity type stored as typed column buffers.
+
+    Extraction appends raw values (string ids, integers, epoch seconds) to `columns`;
+    conversion to the loader's representation happens once per column in `to_tuples`.
+    """
+
+    def __init__(self, schema: Sequence[Tuple[str, str]], strings: StringPool):
+        self.schema = dict(schema)
+        self.strings = strings
+        self.columns: Dict[str, array] = {name: array(_TYPECODES[kind]) for name, kind in schema}
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def add_column(self, name: str, kind: str, values: array) -> None:
+        """
+        Adds a column computed after extraction, e.g. by enrichment.
+
+        Args:
+            name (str): The column name.
+            kind (str): The column kind.
+            values (array): One value per row, using the typecode of `kind`.
+        """
+        if len(values) != len(self):
+            raise ValueError(f"Column {name} has {len(values)} values for {len(self)} rows")
+        self.schema[name] = kind
+        self.columns[name] = values
+
+    def select(self, indices: Sequence[int]) -> 'ColumnBatch':
+        """
+        Returns a new batch holding only the given rows.
+
+        Args:
+            indices (Sequence[int]): The row positions to keep, in order.
+
+        Returns:
+            ColumnBatch: The selected rows, sharing this batch's string pool.
+        """
+        batch = ColumnBatch(self.schema.items(), self.strings)
+        for name, column in self.columns.items():
+            batch.columns[name] = array(column.typecode, (column[i] for i in indices))
+        return batch
+
+    def decoded(self, name: str) -> list:
+        """Returns a column as Python values, with string ids resolved and -1 ids as None."""
+        column = self.columns[name]
+        if self.schema[name] == 'str':
+            strings = self.strings.strings
+            return [strings[i] if i >= 0 else None for i in column]
+        return column.tolist()
+
+    def _converted(self, name: str) -> list:
+        """Converts a whole column to the values expected by the loaders in one vectorized pass."""
+        kind = self.schema[name]
+        if kind == 'str':
+            # Resolve ids through an object array so the lookup is a single take()
+            lookup = np.array(self.strings.strings + [None], dtype=object)
+            return lookup.take(np.frombuffer(self.columns[name], dtype=np.int64)).tolist()  # -1 picks the trailing None
+        if kind == 'int':
+            return self.columns[name].tolist()
+        if kind == 'nint':
+            # Through an object array of Python ints, so the negative rows can become None
+            values = np.frombuffer(self.columns[name], dtype=np.int64)
+            return np.where(values >= 0, values.astype(object), None).tolist()
+
+        epochs = np.frombuffer(self.columns[name], dtype=np.int64)
+        if kind == 'timestamp':
+            return np.datetime_as_string(epochs.astype('datetime64[s]'), unit='s').tolist()
+
+        # Format each distinct second of the day once, then map every row onto it
+        seconds = np.where(epochs >= 0, epochs % 86400, -1)
+        unique, inverse = np.unique(seconds, return_inverse=True)
+        formatted = np.array(
+            [None if s < 0 else f"{s // 3600:02d}:{s % 3600 // 60:02d}:{s % 60:02d}" for s in unique.tolist()],
+            dtype=object
+        )
+        return formatted.take(inverse).tolist()
+
+    def to_tuples(self, columns: Sequence[str]) -> List[tuple]:
+        """
+        Materializes the batch as row tuples for loading.
+
+        Args:
+            columns (Sequence[str]): The columns to include, in order. Columns the batch does not
+                have, such as enrichment columns when enrichment is off, are filled with None.
+
+        Returns:
+            List[tuple]: One tuple per row.
+        """
+        rows = len(self)
+        if not rows:
+            return []
+        return list(zip(*(self._converted(name) if name in self.columns else [None] * rows for name in columns)))
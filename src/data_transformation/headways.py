@@ -0,0 +1,297 @@
+import calendar
+import datetime
+import logging
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from config import headway_windows, headway_bunching_ratio, headway_max_seconds, diff_trip_ttl
+from .columnar import ColumnBatch
+
+Rows = Union[List[Dict], ColumnBatch]
+
+# (route_id, stop_id, direction_id), direction_id -1 when unknown
+StopKey = Tuple[str, str, int]
+
+# VehiclePosition.current_status STOPPED_AT
+_STOPPED_AT = 1
+
+# A stop that leaves the predictions this many seconds before its predicted time still counts as reached
+_ARRIVAL_SLACK = 60
+
+# Weight of the newest headway in the moving average that bunching is judged against
+_EWMA_ALPHA = 0.1
+# Headways seen at a stop before bunching is judged
+_EWMA_MIN_COUNT = 3
+
+# Accumulated fields of a rollup bucket, in ROLLUP_COLUMNS order after the key
+_STAT_FIELDS = ('arrivals', 'headway_count', 'headway_sum', 'headway_sum_sq', 'headway_min', 'headway_max',
+                'bunched', 'delay_count', 'delay_sum', 'delay_sum_sq', 'delay_max',
+                'dwell_count', 'dwell_sum', 'dwell_max')
+
+ROLLUP_COLUMNS = ('route_id', 'stop_id', 'direction_id', 'window_seconds', 'window_start') + _STAT_FIELDS
+
+
+def _direction(direction_id: Optional[int], stop_id: str) -> int:
+    """Uses the static direction_id when enriched, else the N/S platform suffix of NYCT stop ids, else -1."""
+    if direction_id is not None and direction_id >= 0:
+        return direction_id
+    if stop_id.endswith('N'):
+        return 0
+    if stop_id.endswith('S'):
+        return 1
+    return -1
+
+
+def _time_of_day_epoch(value: str, reference: float) -> int:
+    """Turns an HH:MM:SS (UTC) prediction into the epoch closest to `reference`."""
+    hours, minutes, seconds = (int(part) for part in value.split(':'))
+    day_start = int(reference) - int(reference) % 86400
+    epoch = day_start + hours * 3600 + minutes * 60 + seconds
+    if epoch - reference > 43200:
+        epoch -= 86400
+    elif reference - epoch > 43200:
+        epoch += 86400
+    return epoch
+
+
+def _predictions(rows: Rows, reference: float) -> Iterator[Tuple[str, str, str, int, int]]:
+    """Yields (trip_id, route_id, stop_id, direction, predicted arrival epoch) per trip update row."""
+    if isinstance(rows, ColumnBatch):
+        directions = rows.decoded('direction_id') if 'direction_id' in rows.columns else [None] * len(rows)
+        for trip_id, route_id, stop_id, arrival, departure, direction_id in zip(
+                rows.decoded('trip_id'), rows.decoded('route_id'), rows.decoded('stop_id'),
+                rows.decoded('arrival_time'), rows.decoded('departure_time'), directions):
+            epoch = arrival if arrival > 0 else departure
+            if epoch > 0 and trip_id and stop_id:
+                yield trip_id, route_id or '', stop_id, _direction(direction_id, stop_id), epoch
+    else:
+        for row in rows:
+            value = row.get('arrival_time') or row.get('departure_time')
+            if value and row['trip_id'] and row['stop_id']:
+                yield (row['trip_id'], row['route_id'] or '', row['stop_id'],
+                       _direction(row.get('direction_id'), row['stop_id']), _time_of_day_epoch(value, reference))
+
+
+def _stops(rows: Rows) -> Iterator[Tuple[str, str, str, int, int, int]]:
+    """Yields (trip_id, route_id, stop_id, direction, current_status, epoch timestamp) per vehicle row."""
+    if isinstance(rows, ColumnBatch):
+        directions = rows.decoded('direction_id') if 'direction_id' in rows.columns else [None] * len(rows)
+        yield from ((trip_id, route_id or '', stop_id, _direction(direction_id, stop_id or ''), status, timestamp)
+                    for trip_id, route_id, stop_id, status, timestamp, direction_id in zip(
+                        rows.decoded('trip_id'), rows.decoded('route_id'), rows.decoded('stop_id'),
+                        rows.decoded('current_status'), rows.decoded('timestamp'), directions))
+    else:
+        for row in rows:
+            timestamp = row['timestamp']
+            if isinstance(timestamp, datetime.datetime):
+                timestamp = calendar.timegm(timestamp.utctimetuple())
+            yield (row['trip_id'], row['route_id'] or '', row['stop_id'],
+                   _direction(row.get('direction_id'), row['stop_id'] or ''), row['current_status'], timestamp)
+
+
+class _Bucket:
+    """Sums of one (stop, window) rollup since the last flush."""
+    __slots__ = _STAT_FIELDS
+
+    def __init__(self):
+        for field in _STAT_FIELDS:
+            setattr(self, field, 0)
+        self.headway_min = self.headway_max = self.delay_max = self.dwell_max = None
+
+    def values(self) -> tuple:
+        return tuple(getattr(self, field) for field in _STAT_FIELDS)
+
+
+def _max(current: Optional[float], value: float) -> float:
+    return value if current is None or value > current else current
+
+
+class HeadwayAggregator:
+    """
+    Turns feed snapshots into per-stop arrival, headway, delay and dwell statistics.
+
+    An arrival is observed when a stop drops out of a trip's predictions (or the trip leaves
+    the feed) once its predicted time has passed; the last prediction is taken as the arrival
+    time. Headways are the gaps between successive arrivals at a (route, stop, direction), and
+    an arrival counts as bunched when its headway is under `bunching_ratio` times the moving
+    average headway of the stop. Delay is the arrival minus the first prediction seen for that
+    trip and stop, as the static schedule carries no stop times. Dwell is the time a vehicle
+    reports STOPPED_AT the same stop.
+
+    Statistics are accumulated as sums per stop and tumbling window (one per entry of
+    `windows`, in seconds, aligned to the epoch) and handed out by drain(), so they can be
+    merged into the rollup tables with additive upserts.
+
+    Args:
+        windows (Sequence[int]): Rollup window lengths in seconds.
+        bunching_ratio (float): Fraction of the average headway under which an arrival is bunched.
+        max_headway (float): Gaps longer than this, e.g. overnight, are not counted as headways.
+        ttl (float): Forget trips not seen for this many seconds.
+    """
+
+    def __init__(
+            self,
+            windows: Sequence[int] = headway_windows,
+            bunching_ratio: float = headway_bunching_ratio,
+            max_headway: float = headway_max_seconds,
+            ttl: float = diff_trip_ttl
+        ):
+        self.windows = tuple(windows)
+        self.bunching_ratio = bunching_ratio
+        self.max_headway = max_headway
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # feed -> trip_id -> stop_id -> (route_id, direction, last prediction, first prediction)
+        self._predictions: Dict[str, Dict[str, Dict[str, Tuple[str, int, int, int]]]] = {}
+        # feed -> trip_id -> last time the trip was seen
+        self._seen: Dict[str, Dict[str, float]] = {}
+        # feed -> trip_id -> (stop key, first and last STOPPED_AT timestamp)
+        self._stopped: Dict[str, Dict[str, Tuple[StopKey, int, int]]] = {}
+        # stop key -> (last arrival, moving average headway, headways seen)
+        self._last_arrival: Dict[StopKey, Tuple[int, float, int]] = {}
+        # (stop key, window seconds, window start) -> bucket
+        self._buckets: Dict[Tuple[StopKey, int, int], _Bucket] = {}
+
+    def _buckets_of(self, key: StopKey, epoch: int) -> List[_Bucket]:
+        buckets = []
+        for window in self.windows:
+            bucket_key = (key, window, epoch - epoch % window)
+            bucket = self._buckets.get(bucket_key)
+            if bucket is None:
+                bucket = self._buckets[bucket_key] = _Bucket()
+            buckets.append(bucket)
+        return buckets
+
+    def _arrival(self, key: StopKey, arrival: int, first_prediction: int) -> None:
+        buckets = self._buckets_of(key, arrival)
+        headway = None
+        previous = self._last_arrival.get(key)
+        average, count = (previous[1], previous[2]) if previous else (0.0, 0)
+        if previous is not None and 0 < arrival - previous[0] <= self.max_headway:
+            headway = arrival - previous[0]
+        if previous is None or arrival > previous[0]:
+            if headway is not None:
+                average = headway if count == 0 else average + _EWMA_ALPHA * (headway - average)
+                count += 1
+            self._last_arrival[key] = (arrival, average, count)
+        delay = arrival - first_prediction
+        for bucket in buckets:
+            bucket.arrivals += 1
+            bucket.delay_count += 1
+            bucket.delay_sum += delay
+            bucket.delay_sum_sq += delay * delay
+            bucket.delay_max = _max(bucket.delay_max, delay)
+            if headway is not None:
+                bucket.headway_count += 1
+                bucket.headway_sum += headway
+                bucket.headway_sum_sq += headway * headway
+                bucket.headway_min = headway if bucket.headway_min is None else min(bucket.headway_min, headway)
+                bucket.headway_max = _max(bucket.headway_max, headway)
+                if count > _EWMA_MIN_COUNT and headway < self.bunching_ratio * average:
+                    bucket.bunched += 1
+
+    def _dwell(self, key: StopKey, start: int, end: int) -> None:
+        dwell = end - start
+        if dwell <= 0:
+            return
+        for bucket in self._buckets_of(key, start):
+            bucket.dwell_count += 1
+            bucket.dwell_sum += dwell
+            bucket.dwell_max = _max(bucket.dwell_max, dwell)
+
+    def observe(self, feed_key: str, trip_updates: Rows, vehicle_positions: Rows, now: Optional[float] = None) -> int:
+        """
+        Updates the statistics with one complete snapshot of a feed (before diffing).
+
+        Args:
+            feed_key (str): Identifies the feed, e.g. its endpoint url.
+            trip_updates (Rows): All trip update rows of the snapshot.
+            vehicle_positions (Rows): All vehicle position rows of the snapshot.
+            now (Optional[float]): The epoch time of the snapshot, defaults to time.time().
+
+        Returns:
+            int: The number of arrivals observed.
+        """
+
+        now = time.time() if now is None else now
+        current: Dict[str, Dict[str, Tuple[str, int, int, int]]] = {}
+        arrivals = 0
+        with self._lock:
+            previous = self._predictions.get(feed_key, {})
+            seen = self._seen.setdefault(feed_key, {})
+            for trip_id, route_id, stop_id, direction, epoch in _predictions(trip_updates, now):
+                first = previous.get(trip_id, {}).get(stop_id)
+                current.setdefault(trip_id, {})[stop_id] = (route_id, direction, epoch, first[3] if first else epoch)
+                seen[trip_id] = now
+
+            for trip_id, stops in previous.items():
+                if trip_id not in current and now - seen.get(trip_id, now) <= self.ttl:
+                    # Gone from this snapshot; kept until the ttl unless it has no future stops left
+                    if any(epoch > now + _ARRIVAL_SLACK for _, _, epoch, _ in stops.values()):
+                        current[trip_id] = stops
+                        continue
+                remaining = current.get(trip_id, {})
+                for stop_id, (route_id, direction, epoch, first) in stops.items():
+                    if stop_id not in remaining and epoch <= now + _ARRIVAL_SLACK:
+                        self._arrival((route_id, stop_id, direction), epoch, first)
+                        arrivals += 1
+                if trip_id not in current:
+                    seen.pop(trip_id, None)
+            self._predictions[feed_key] = current
+
+            stopped = self._stopped.setdefault(feed_key, {})
+            vehicles = set()
+            for trip_id, route_id, stop_id, direction, status, timestamp in _stops(vehicle_positions):
+                if not trip_id:
+                    continue
+                vehicles.add(trip_id)
+                key = (route_id, stop_id, direction)
+                dwelling = stopped.get(trip_id)
+                if dwelling is not None and (status != _STOPPED_AT or dwelling[0] != key):
+                    self._dwell(*dwelling)
+                    dwelling = None
+                    del stopped[trip_id]
+                if status == _STOPPED_AT and stop_id:
+                    stopped[trip_id] = (key, dwelling[1] if dwelling else timestamp, timestamp)
+            for trip_id in [trip_id for trip_id in stopped if trip_id not in vehicles]:
+                self._dwell(*stopped.pop(trip_id))
+
+        if arrivals:
+            logging.debug(f"Observed {arrivals} arrivals in {feed_key}")
+        return arrivals
+
+    def drain(self) -> List[tuple]:
+        """
+        Hands out the statistics accumulated since the last call and resets them.
+
+        Returns:
+            List[tuple]: Rows ordered like ROLLUP_COLUMNS, with window_start as a naive UTC datetime.
+        """
+        with self._lock:
+            buckets, self._buckets = self._buckets, {}
+        return [
+            key + (window, datetime.datetime.utcfromtimestamp(start)) + bucket.values()
+            for (key, window, start), bucket in buckets.items()
+        ]
+
+    def restore(self, rows: List[tuple]) -> None:
+        """Puts back rows returned by drain() that could not be written, merging them with newer ones."""
+        with self._lock:
+            for row in rows:
+                key, window, start = tuple(row[:3]), row[3], calendar.timegm(row[4].timetuple())
+                bucket = self._buckets.setdefault((key, window, start), _Bucket())
+                for field, value in zip(_STAT_FIELDS, row[5:]):
+                    current = getattr(bucket, field)
+                    if field.endswith('_max'):
+                        value = value if current is None else (current if value is None else max(current, value))
+                    elif field.endswith('_min'):
+                        value = value if current is None else (current if value is None else min(current, value))
+                    else:
+                        value = current + value
+                    setattr(bucket, field, value)
+
+    def tracked_trips(self) -> int:
+        """Returns the number of trips whose predictions are held in memory."""
+        with self._lock:
+            return sum(len(trips) for trips in self._predictions.values())
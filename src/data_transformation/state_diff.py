@@ -0,0 +1,189 @@
+import logging
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from config import diff_trip_ttl, diff_max_trips
+from .columnar import ColumnBatch
+
+Rows = Union[List[Dict], ColumnBatch]
+
+TRIP_UPDATE_VALUE_FIELDS = ('route_id', 'start_date', 'schedule_relationship', 'arrival_time', 'departure_time')
+VEHICLE_POSITION_VALUE_FIELDS = ('route_id', 'current_stop_sequence', 'stop_id', 'current_status', 'timestamp')
+
+
+class _FeedState:
+    """Last-known predictions and vehicle positions of the trips in one feed."""
+
+    def __init__(self):
+        # trip_id -> {stop_id: hash of the prediction values}
+        self.predictions: Dict[str, Dict[str, int]] = {}
+        # trip_id -> hash of the vehicle position values
+        self.vehicles: Dict[str, int] = {}
+        # trip_id -> (route_id, last time the trip was seen)
+        self.trips: Dict[str, Tuple[str, float]] = {}
+
+    def forget(self, trip_id: str) -> None:
+        self.predictions.pop(trip_id, None)
+        self.vehicles.pop(trip_id, None)
+        self.trips.pop(trip_id, None)
+
+
+def _keyed_rows(rows: Rows, key_field: str, value_fields: Tuple[str, ...]) -> Iterator[Tuple[str, str, str, int]]:
+    """Yields (trip_id, key, route_id, hash of the value fields) for each row of a list or a column batch."""
+    if isinstance(rows, ColumnBatch):
+        trip_ids, keys, route_ids = (rows.decoded(name) for name in ('trip_id', key_field, 'route_id'))
+        # Raw column values (epoch seconds, string ids resolved) are enough to detect a change
+        values = zip(*(rows.decoded(field) for field in value_fields))
+        for trip_id, key, route_id, value in zip(trip_ids, keys, route_ids, values):
+            yield trip_id, key, route_id, hash(value)
+    else:
+        for row in rows:
+            yield row['trip_id'], row[key_field], row['route_id'], hash(tuple(row[field] for field in value_fields))
+
+
+def _select(rows: Rows, indices: List[int]) -> Rows:
+    """Keeps the rows at the given positions."""
+    if isinstance(rows, ColumnBatch):
+        return rows.select(indices)
+    return [rows[i] for i in indices]
+
+
+class TripStateDiffer:
+    """
+    Diffs each feed snapshot against the last-known state of its trips so that only new or
+    changed trip updates and vehicle positions are passed to the loaders.
+
+    Predictions are keyed by (trip_id, stop_id) and vehicles by trip_id. Only a hash of the
+    row values is kept, and trips are forgotten once they disappear from their feed, have not
+    been seen for `ttl` seconds, or when more than `max_trips` trips are tracked.
+
+    diff() advances the state as soon as it returns, so a caller that fails to load the
+    returned rows must call reset(), or the lost changes are never emitted again. The methods
+    are thread-safe, as resets and the metrics come from other threads than the diffs.
+    """
+
+    def __init__(self, ttl: float = diff_trip_ttl, max_trips: int = diff_max_trips):
+        self.ttl = ttl
+        self.max_trips = max_trips
+        self._feeds: Dict[str, _FeedState] = {}
+        self._lock = threading.Lock()
+
+    def diff(
+            self,
+            feed_key: str,
+            trip_updates: Rows,
+            vehicle_positions: Rows,
+            now: Optional[float] = None
+        ) -> Tuple[Rows, Rows, List[Dict]]:
+        """
+        Compares a feed snapshot with the previous one and updates the stored state.
+
+        Args:
+            feed_key (str): Identifies the feed, e.g. its endpoint url.
+            trip_updates (Rows): All trip update rows of the snapshot, as dictionaries or a ColumnBatch.
+            vehicle_positions (Rows): All vehicle position rows of the snapshot, as dictionaries or a ColumnBatch.
+            now (Optional[float]): The current epoch time, defaults to time.time().
+
+        Returns:
+            Tuple[Rows, Rows, List[Dict]]: The new or changed trip updates, the new or changed
+            vehicle positions (in the same form as given), and trip events for trips that
+            disappeared from the feed.
+        """
+
+        now = time.time() if now is None else now
+        with self._lock:
+            state = self._feeds.setdefault(feed_key, _FeedState())
+            previous_trips = set(state.trips)
+            seen_trips = set()
+
+            changed_trip_updates = []
+            for i, (trip_id, stop_id, route_id, value) in enumerate(
+                    _keyed_rows(trip_updates, 'stop_id', TRIP_UPDATE_VALUE_FIELDS)):
+                stops = state.predictions.setdefault(trip_id, {})
+                if stops.get(stop_id) != value:
+                    stops[stop_id] = value
+                    changed_trip_updates.append(i)
+                if trip_id not in seen_trips:
+                    seen_trips.add(trip_id)
+                    state.trips[trip_id] = (route_id, now)
+
+            changed_vehicle_positions = []
+            for i, (trip_id, _, route_id, value) in enumerate(
+                    _keyed_rows(vehicle_positions, 'trip_id', VEHICLE_POSITION_VALUE_FIELDS)):
+                if state.vehicles.get(trip_id) != value:
+                    state.vehicles[trip_id] = value
+                    changed_vehicle_positions.append(i)
+                if trip_id not in seen_trips:
+                    seen_trips.add(trip_id)
+                    state.trips[trip_id] = (route_id, now)
+
+            trip_events = []
+            for trip_id in previous_trips - seen_trips:
+                route_id, _ = state.trips[trip_id]
+                trip_events.append({'trip_id': trip_id, 'route_id': route_id, 'event': 'disappeared'})
+                state.forget(trip_id)
+
+            self._expire(now)
+        logging.debug(f"Diff for {feed_key}: {len(changed_trip_updates)}/{len(trip_updates)} trip updates, "
+                      f"{len(changed_vehicle_positions)}/{len(vehicle_positions)} vehicle positions, "
+                      f"{len(trip_events)} trips disappeared")
+        return (_select(trip_updates, changed_trip_updates),
+                _select(vehicle_positions, changed_vehicle_positions),
+                trip_events)
+
+    def reset(self, feed_key: str) -> None:
+        """
+        Forgets the state of a feed, so that its next snapshot is passed on in full.
+
+        Args:
+            feed_key (str): Identifies the feed, e.g. its endpoint url.
+        """
+        with self._lock:
+            state = self._feeds.pop(feed_key, None)
+        if state is not None:
+            logging.info(f"Reset the trip state of {feed_key}, its next snapshot is loaded in full")
+
+    def trips(self, feed_key: str) -> List[Tuple[str, str]]:
+        """
+        Returns the trips of the feed's last diffed snapshot.
+
+        Args:
+            feed_key (str): Identifies the feed, e.g. its endpoint url.
+
+        Returns:
+            List[Tuple[str, str]]: (trip_id, route_id) of every trip, changed or not.
+        """
+        with self._lock:
+            state = self._feeds.get(feed_key)
+            if state is None:
+                return []
+            return [(trip_id, route_id) for trip_id, (route_id, _) in state.trips.items() if trip_id]
+
+    def tracked_trips(self) -> int:
+        """Returns the number of trips currently held in memory across all feeds."""
+        with self._lock:
+            return self._tracked_trips()
+
+    def _tracked_trips(self) -> int:
+        """Counts the tracked trips. Caller holds the lock."""
+        return sum(len(state.trips) for state in self._feeds.values())
+
+    def _expire(self, now: float) -> None:
+        """Forgets trips past their TTL, then the least recently seen trips beyond `max_trips`.
+
+        The caller holds the lock.
+        """
+        for state in self._feeds.values():
+            for trip_id in [trip_id for trip_id, (_, seen) in state.trips.items() if now - seen > self.ttl]:
+                state.forget(trip_id)
+
+        excess = self._tracked_trips() - self.max_trips
+        if excess > 0:
+            oldest = sorted(
+                ((seen, trip_id, state) for state in self._feeds.values() for trip_id, (_, seen) in state.trips.items()),
+                key=lambda entry: entry[0]
+            )[:excess]
+            for _, trip_id, state in oldest:
+                state.forget(trip_id)
+            logging.warning(f"Trip state over capacity, evicted {excess} least recently seen trips")
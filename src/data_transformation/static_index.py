@@ -0,0 +1,223 @@
+import csv
+import datetime
+import logging
+import os
+import threading
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from .columnar import StringPool
+
+# Realtime (trip_id, start_date) lookups remembered before the cache is reset
+_TRIP_CACHE_SIZE = 100000
+
+STATIC_FILES = ('trips.txt', 'stops.txt', 'routes.txt', 'calendar.txt', 'calendar_dates.txt')
+
+_WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+def _read_rows(file_path: str):
+    """Yields the rows of a GTFS file as dictionaries, or nothing if the file is missing."""
+    if not os.path.exists(file_path):
+        return
+    with open(file_path, newline='', encoding='utf-8-sig') as f:
+        yield from csv.DictReader(f)
+
+
+def _trip_suffix(trip_id: str) -> str:
+    """
+    Returns the part of a static trip_id that realtime feeds use.
+
+    NYCT static trip ids look like ASP23GEN-1091-Weekday-00_000650_1..S03R while the realtime
+    feeds only carry 000650_1..S03R.
+    """
+    return trip_id.split('_', 1)[1] if '_' in trip_id else trip_id
+
+
+class StaticGTFSIndex:
+    """
+    A compact in-memory index over the static GTFS files used to enrich realtime rows.
+
+    Strings are interned in one StringPool and every attribute is stored as an array of
+    string ids (or small integers), so each trip and stop costs a few machine words plus one
+    dictionary entry.
+    """
+
+    def __init__(self, gtfs_path: str):
+        self.gtfs_path = gtfs_path
+        self.strings = StringPool()
+        intern = self.strings.intern
+
+        # Trips: trip_id -> row; realtime trip id suffix -> rows
+        self._trip_rows: Dict[str, int] = {}
+        self._trip_suffix_rows: Dict[str, List[int]] = {}
+        self.trip_route = array('q')
+        self.trip_service = array('q')
+        self.trip_headsign = array('q')
+        self.trip_direction = array('b')
+        for row in _read_rows(os.path.join(gtfs_path, 'trips.txt')):
+            index = len(self.trip_route)
+            self.trip_route.append(intern(row.get('route_id') or None))
+            self.trip_service.append(intern(row.get('service_id') or None))
+            self.trip_headsign.append(intern(row.get('trip_headsign') or None))
+            direction = row.get('direction_id')
+            self.trip_direction.append(int(direction) if direction not in (None, '') else -1)
+            self._trip_rows[row['trip_id']] = index
+            self._trip_suffix_rows.setdefault(_trip_suffix(row['trip_id']), []).append(index)
+
+        # Stops: stop_id -> row
+        self._stop_rows: Dict[str, int] = {}
+        self.stop_name = array('q')
+        self.stop_parent = array('q')
+        for row in _read_rows(os.path.join(gtfs_path, 'stops.txt')):
+            self._stop_rows[row['stop_id']] = len(self.stop_name)
+            self.stop_name.append(intern(row.get('stop_name') or None))
+            self.stop_parent.append(intern(row.get('parent_station') or None))
+
+        # Routes: route_id -> (short name, long name) string ids
+        self._routes: Dict[str, Tuple[int, int]] = {
+            row['route_id']: (intern(row.get('route_short_name') or None), intern(row.get('route_long_name') or None))
+            for row in _read_rows(os.path.join(gtfs_path, 'routes.txt'))
+        }
+
+        # Service calendar, used to tell apart static trips that share a realtime trip id
+        self._calendar: Dict[str, Tuple[Tuple[bool, ...], str, str]] = {
+            row['service_id']: (tuple(row.get(day) == '1' for day in _WEEKDAYS), row['start_date'], row['end_date'])
+            for row in _read_rows(os.path.join(gtfs_path, 'calendar.txt'))
+        }
+        self._calendar_dates: Dict[Tuple[str, str], bool] = {
+            (row['service_id'], row['date']): row['exception_type'] == '1'
+            for row in _read_rows(os.path.join(gtfs_path, 'calendar_dates.txt'))
+        }
+        self._trip_cache: Dict[Tuple[str, str], int] = {}
+
+        logging.info(f"Built static GTFS index: {len(self.trip_route)} trips, {len(self.stop_name)} stops, "
+                     f"{len(self._routes)} routes, {len(self.strings.strings)} distinct strings")
+
+    def _string(self, string_id: int) -> Optional[str]:
+        return self.strings.strings[string_id] if string_id >= 0 else None
+
+    def service_active(self, service_id: str, date: str) -> bool:
+        """
+        Checks whether a service runs on a date, applying calendar_dates exceptions.
+
+        Args:
+            service_id (str): The service_id.
+            date (str): The date as YYYYMMDD.
+
+        Returns:
+            bool: True if the service runs that day.
+        """
+        exception = self._calendar_dates.get((service_id, date))
+        if exception is not None:
+            return exception
+        calendar = self._calendar.get(service_id)
+        if calendar is None:
+            return False
+        weekdays, start_date, end_date = calendar
+        try:
+            weekday = datetime.datetime.strptime(date, '%Y%m%d').weekday()
+        except ValueError:
+            return False
+        return start_date <= date <= end_date and weekdays[weekday]
+
+    def trip_row(self, trip_id: str, start_date: str = '') -> int:
+        """
+        Finds the static trip for a realtime trip id.
+
+        Exact ids are matched first. Otherwise the realtime id is matched against the suffix of the
+        static ids, and if several services share it, the one running on `start_date` is chosen.
+
+        Args:
+            trip_id (str): The realtime trip_id.
+            start_date (str): The realtime start_date as YYYYMMDD, if known.
+
+        Returns:
+            int: The trip row, or -1 if the trip is unknown.
+        """
+        key = (trip_id, start_date)
+        row = self._trip_cache.get(key)
+        if row is not None:
+            return row
+
+        row = self._trip_rows.get(trip_id, -1)
+        if row < 0:
+            candidates = self._trip_suffix_rows.get(trip_id, ())
+            if len(candidates) == 1 or (candidates and not start_date):
+                row = candidates[0]
+            elif candidates:
+                row = next(
+                    (c for c in candidates if self.service_active(self._string(self.trip_service[c]), start_date)),
+                    candidates[0]
+                )
+        if len(self._trip_cache) >= _TRIP_CACHE_SIZE:
+            self._trip_cache.clear()
+        self._trip_cache[key] = row
+        return row
+
+    def trip(self, trip_id: str, start_date: str = '') -> Dict[str, Optional[object]]:
+        """
+        Returns the static attributes of a realtime trip.
+
+        Args:
+            trip_id (str): The realtime trip_id.
+            start_date (str): The realtime start_date as YYYYMMDD, if known.
+
+        Returns:
+            Dict: direction_id, trip_headsign and service_id, with None values for unknown trips.
+        """
+        row = self.trip_row(trip_id, start_date)
+        if row < 0:
+            return {'direction_id': None, 'trip_headsign': None, 'service_id': None}
+        direction = self.trip_direction[row]
+        return {
+            'direction_id': direction if direction >= 0 else None,
+            'trip_headsign': self._string(self.trip_headsign[row]),
+            'service_id': self._string(self.trip_service[row]),
+        }
+
+    def parent_station(self, stop_id: str) -> Optional[str]:
+        """Returns the parent station of a stop, or None."""
+        row = self._stop_rows.get(stop_id)
+        return self._string(self.stop_parent[row]) if row is not None else None
+
+    def stop_name_of(self, stop_id: str) -> Optional[str]:
+        """Returns the name of a stop, or None."""
+        row = self._stop_rows.get(stop_id)
+        return self._string(self.stop_name[row]) if row is not None else None
+
+    def route_names(self, route_id: str) -> Tuple[Optional[str], Optional[str]]:
+        """Returns the short and long name of a route."""
+        short_name, long_name = self._routes.get(route_id, (-1, -1))
+        return self._string(short_name), self._string(long_name)
+
+
+_index: Optional[StaticGTFSIndex] = None
+_index_mtimes: Optional[Tuple[float, ...]] = None
+_index_lock = threading.Lock()
+
+
+def _mtimes(gtfs_path: str) -> Tuple[float, ...]:
+    return tuple(
+        os.stat(os.path.join(gtfs_path, name)).st_mtime if os.path.exists(os.path.join(gtfs_path, name)) else 0.0
+        for name in STATIC_FILES
+    )
+
+
+def get_static_index(gtfs_path: str) -> StaticGTFSIndex:
+    """
+    Returns the memoized index for a GTFS directory, rebuilding it when any file's mtime changed.
+
+    Args:
+        gtfs_path (str): Directory containing the static GTFS files.
+
+    Returns:
+        StaticGTFSIndex: The current index.
+    """
+    global _index, _index_mtimes
+    mtimes = _mtimes(gtfs_path)
+    with _index_lock:
+        if _index is None or _index.gtfs_path != gtfs_path or _index_mtimes != mtimes:
+            _index = StaticGTFSIndex(gtfs_path)
+            _index_mtimes = mtimes
+        return _index
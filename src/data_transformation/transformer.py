@@ -1,13 +1,14 @@
 import datetime
 import logging
 import time
+from array import array
 from typing import Optional, Tuple, List, Dict
 
-import psycopg2
-
 from .binary_decoder import decode_binary
-
-logging.basicConfig(level=logging.DEBUG)
+from .columnar import ColumnBatch, StringPool, TRIP_UPDATE_SCHEMA, VEHICLE_POSITION_SCHEMA, ALERT_SCHEMA
+from .wire_decoder import scan_feed
+from .static_index import StaticGTFSIndex
+from src.monitoring.metrics import STAGE_SECONDS, ROWS_EMITTED, current_feed
 
 def extract_trip_updates(trip_update) -> List[Dict]:
     """
@@ -95,22 +96,78 @@ def extract_alerts(alert) -> List[Dict]:
             alerts.append(values)  # Append extracted values to list
     return alerts  # Return list of extracted values
 
-def process_feed(binary_data: bytes, conn) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+def extract_columnar(feed_message) -> Tuple[ColumnBatch, ColumnBatch, ColumnBatch]:
     """
-    Processes a binary feed message by decoding it and extracting trip updates, 
-    vehicle positions, and alerts.
+    Extracts trip updates, vehicle positions and alerts from a decoded feed into column batches.
+
+    Produces the same rows as the dict-based extract_* functions, but appends raw values to typed
+    column buffers with interned strings and leaves time formatting to a per-column pass at load time.
 
     Args:
-        binary_data (bytes): The binary feed message to process.
-        conn (connection object): A database connection object.
+        feed_message (gtfs_realtime_pb2.FeedMessage): The decoded feed.
 
     Returns:
-        Tuple[List[Dict], List[Dict], List[Dict]]: A tuple containing three lists of dictionaries 
-        for trip updates, vehicle positions, and alerts.
+        Tuple[ColumnBatch, ColumnBatch, ColumnBatch]: Batches for trip updates, vehicle positions, and alerts.
+    """
+
+    strings = StringPool()
+    intern = strings.intern
+    trip_updates = ColumnBatch(TRIP_UPDATE_SCHEMA, strings)
+    vehicle_positions = ColumnBatch(VEHICLE_POSITION_SCHEMA, strings)
+    alerts = ColumnBatch(ALERT_SCHEMA, strings)
+
+    tu = trip_updates.columns
+    vp = vehicle_positions.columns
+    al = alerts.columns
+
+    for entity in feed_message.entity:
+        if entity.HasField('trip_update'):
+            trip = entity.trip_update.trip
+            trip_id, route_id, start_date = intern(trip.trip_id), intern(trip.route_id), intern(trip.start_date)
+            schedule_relationship = trip.schedule_relationship
+            for stop_time_update in entity.trip_update.stop_time_update:
+                tu['trip_id'].append(trip_id)
+                tu['route_id'].append(route_id)
+                tu['start_date'].append(start_date)
+                tu['schedule_relationship'].append(schedule_relationship)
+                tu['arrival_time'].append(stop_time_update.arrival.time if stop_time_update.HasField('arrival') else -1)
+                tu['departure_time'].append(stop_time_update.departure.time if stop_time_update.HasField('departure') else -1)
+                tu['stop_id'].append(intern(stop_time_update.stop_id))
+        elif entity.HasField('vehicle'):
+            vehicle = entity.vehicle
+            vp['trip_id'].append(intern(vehicle.trip.trip_id))
+            vp['route_id'].append(intern(vehicle.trip.route_id))
+            vp['current_stop_sequence'].append(vehicle.current_stop_sequence)
+            vp['stop_id'].append(intern(vehicle.stop_id))
+            vp['current_status'].append(vehicle.current_status)
+            vp['timestamp'].append(vehicle.timestamp)
+        elif entity.HasField('alert'):
+            alert_id = intern(entity.id)
+            for informed_entity in entity.alert.informed_entity:
+                has_trip = informed_entity.HasField('trip')
+                trip_id = intern(informed_entity.trip.trip_id) if has_trip else -1
+                route_id = intern(informed_entity.trip.route_id) if has_trip else -1
+                for translation in entity.alert.header_text.translation:
+                    al['alert_id'].append(alert_id)
+                    al['trip_id'].append(trip_id)
+                    al['route_id'].append(route_id)
+                    al['description_text'].append(intern(translation.text))
+        else:
+            logging.warning(f"Unhandled entity type in entity: {entity.id}")
+
+    return trip_updates, vehicle_positions, alerts
+
+def extract_rows(feed_message) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+    """
+    Extracts trip updates, vehicle positions and alerts from a decoded feed as dictionaries.
+
+    Args:
+        feed_message (gtfs_realtime_pb2.FeedMessage): The decoded feed.
+
+    Returns:
+        Tuple[List[Dict], List[Dict], List[Dict]]: Lists of dictionaries for trip updates,
+        vehicle positions, and alerts.
     """
-    
-    # Decode binary data using decode_binary
-    feed_message = decode_binary(binary_data)
 
     # Lists to aggregate extracted data
     trip_updates = []
@@ -127,9 +184,117 @@ def process_feed(binary_data: bytes, conn) -> Tuple[List[Dict], List[Dict], List
             elif entity.HasField('alert'):
                 alerts.extend(extract_alerts(entity))
             else:
-                logging.warning(f"Unhandled entity type in entity: {entity}")
+                logging.warning(f"Unhandled entity type in entity: {entity.id}")
     except Exception as e:
         logging.warning(f"Error processing entity: {e}")
 
+    return trip_updates, vehicle_positions, alerts
+
+def enrich_rows(rows, index: StaticGTFSIndex) -> None:
+    """
+    Attaches direction_id, trip_headsign, service_id and parent_station from the static GTFS
+    index to trip update or vehicle position rows, in place.
+
+    Each distinct trip and stop is looked up once per batch.
+
+    Args:
+        rows (List[Dict] or ColumnBatch): The rows to enrich.
+        index (StaticGTFSIndex): The static GTFS index.
+    """
+
+    if isinstance(rows, ColumnBatch):
+        if not len(rows):
+            return
+        intern = rows.strings.intern
+        columns = rows.columns
+        start_dates = columns['start_date'] if 'start_date' in columns else [-1] * len(rows)
+        trips = {}
+        stops = {}
+        direction_ids, headsigns, service_ids, parent_stations = (array('q') for _ in range(4))
+        for trip_id, start_date, stop_id in zip(columns['trip_id'], start_dates, columns['stop_id']):
+            trip = trips.get((trip_id, start_date))
+            if trip is None:
+                attributes = index.trip(rows.strings.strings[trip_id] if trip_id >= 0 else '',
+                                        rows.strings.strings[start_date] if start_date >= 0 else '')
+                direction_id = attributes['direction_id']
+                trip = trips[(trip_id, start_date)] = (
+                    direction_id if direction_id is not None else -1,
+                    intern(attributes['trip_headsign']),
+                    intern(attributes['service_id'])
+                )
+            parent = stops.get(stop_id)
+            if parent is None:
+                parent = stops[stop_id] = intern(index.parent_station(rows.strings.strings[stop_id])) if stop_id >= 0 else -1
+            direction_ids.append(trip[0])
+            headsigns.append(trip[1])
+            service_ids.append(trip[2])
+            parent_stations.append(parent)
+        rows.add_column('direction_id', 'nint', direction_ids)
+        rows.add_column('trip_headsign', 'str', headsigns)
+        rows.add_column('service_id', 'str', service_ids)
+        rows.add_column('parent_station', 'str', parent_stations)
+        return
+
+    trips = {}
+    stops = {}
+    for row in rows:
+        key = (row['trip_id'], row.get('start_date') or '')
+        trip = trips.get(key)
+        if trip is None:
+            trip = trips[key] = index.trip(*key)
+        row.update(trip)
+        stop_id = row['stop_id']
+        if stop_id not in stops:
+            stops[stop_id] = index.parent_station(stop_id)
+        row['parent_station'] = stops[stop_id]
+
+def process_feed(
+        binary_data: bytes,
+        conn,
+        columnar: bool = False,
+        selective: bool = False,
+        static_index: Optional[StaticGTFSIndex] = None
+    ) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+    """
+    Processes a binary feed message by decoding it and extracting trip updates, 
+    vehicle positions, and alerts.
+
+    Args:
+        binary_data (bytes): The binary feed message to process.
+        conn (connection object): A database connection object.
+        columnar (bool): Return ColumnBatch objects instead of lists of dictionaries.
+        selective (bool): Read only the needed fields straight from the wire format instead of
+            decoding a full FeedMessage.
+        static_index (Optional[StaticGTFSIndex]): If given, trip updates and vehicle positions are
+            enriched with direction_id, trip_headsign, service_id and parent_station.
+
+    Returns:
+        Tuple[List[Dict], List[Dict], List[Dict]]: A tuple containing three lists of dictionaries 
+        for trip updates, vehicle positions, and alerts, or three ColumnBatch objects when `columnar` is set.
+    """
+    
+    feed = current_feed()
+
+    # Decode binary data with the selective scanner or with decode_binary
+    if selective:
+        with STAGE_SECONDS.time('scan', feed):
+            trip_updates, vehicle_positions, alerts = scan_feed(binary_data, columnar)
+    else:
+        feed_message = decode_binary(binary_data)
+        with STAGE_SECONDS.time('transform', feed):
+            if columnar:
+                trip_updates, vehicle_positions, alerts = extract_columnar(feed_message)
+            else:
+                trip_updates, vehicle_positions, alerts = extract_rows(feed_message)
+
+    if static_index is not None:
+        with STAGE_SECONDS.time('enrich', feed):
+            enrich_rows(trip_updates, static_index)
+            enrich_rows(vehicle_positions, static_index)
+
+    ROWS_EMITTED.inc(feed, 'realtime_trip_updates', amount=len(trip_updates))
+    ROWS_EMITTED.inc(feed, 'realtime_vehicle_positions', amount=len(vehicle_positions))
+    ROWS_EMITTED.inc(feed, 'realtime_alerts', amount=len(alerts))
+
     return trip_updates, vehicle_positions, alerts  # Return all extracted data
 
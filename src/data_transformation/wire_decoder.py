@@ -0,0 +1,266 @@
+import abc
+import datetime
+import logging
+from typing import Dict, List, Optional, Tuple, Union
+
+from .binary_decoder import _read_varint, _skip_field
+from .columnar import ColumnBatch, StringPool, TRIP_UPDATE_SCHEMA, VEHICLE_POSITION_SCHEMA, ALERT_SCHEMA
+
+# Wire types
+_VARINT = 0
+_LEN = 2
+
+# Default of VehiclePosition.current_status in gtfs-realtime.proto (IN_TRANSIT_TO)
+_DEFAULT_CURRENT_STATUS = 2
+
+
+def _iter_fields(buffer: bytes, pos: int, end: int):
+    """
+    Yields (field_number, wire_type, value) for each field of a message.
+
+    Varints are decoded; length-delimited values are returned as (start, stop) offsets so that
+    nested messages are only parsed when needed. Other wire types are skipped.
+    """
+    while pos < end:
+        key, pos = _read_varint(buffer, pos)
+        field_number, wire_type = key >> 3, key & 0x7
+        if wire_type == _VARINT:
+            value, pos = _read_varint(buffer, pos)
+            yield field_number, wire_type, value
+        elif wire_type == _LEN:
+            length, pos = _read_varint(buffer, pos)
+            yield field_number, wire_type, (pos, pos + length)
+            pos += length
+        else:
+            pos = _skip_field(buffer, pos, wire_type)
+
+
+def _string(buffer: bytes, span: Tuple[int, int]) -> str:
+    return buffer[span[0]:span[1]].decode('utf-8')
+
+
+def _int64(value: int) -> int:
+    """Reinterprets a decoded varint as a signed 64-bit integer."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _trip_descriptor(buffer: bytes, span: Tuple[int, int], trip: List) -> List:
+    """Merges a TripDescriptor into [trip_id, route_id, start_date, schedule_relationship]."""
+    for field_number, wire_type, value in _iter_fields(buffer, *span):
+        if field_number == 1 and wire_type == _LEN:
+            trip[0] = _string(buffer, value)
+        elif field_number == 5 and wire_type == _LEN:
+            trip[1] = _string(buffer, value)
+        elif field_number == 3 and wire_type == _LEN:
+            trip[2] = _string(buffer, value)
+        elif field_number == 4 and wire_type == _VARINT:
+            trip[3] = value
+    return trip
+
+
+def _event_time(buffer: bytes, span: Tuple[int, int]) -> int:
+    """Reads StopTimeEvent.time."""
+    time = 0
+    for field_number, wire_type, value in _iter_fields(buffer, *span):
+        if field_number == 2 and wire_type == _VARINT:
+            time = _int64(value)
+    return time
+
+
+class _Sink(abc.ABC):
+    """Receives the rows found by the scanner."""
+
+    @abc.abstractmethod
+    def trip_update(self, trip: List, stop_id: str, arrival: Optional[int], departure: Optional[int]) -> None:
+        ...
+
+    @abc.abstractmethod
+    def vehicle_position(self, trip: List, current_stop_sequence: int, stop_id: str,
+                         current_status: int, timestamp: int) -> None:
+        ...
+
+    @abc.abstractmethod
+    def alert(self, alert_id: str, trip_id: Optional[str], route_id: Optional[str], text: str) -> None:
+        ...
+
+
+class _DictSink(_Sink):
+    """Builds the same dictionaries as the extract_* functions in transformer.py."""
+
+    def __init__(self):
+        from .transformer import epoch_to_time  # transformer imports this module
+        self.epoch_to_time = epoch_to_time
+        self.trip_updates, self.vehicle_positions, self.alerts = [], [], []
+
+    def trip_update(self, trip, stop_id, arrival, departure):
+        epoch_to_time = self.epoch_to_time
+        self.trip_updates.append({
+            'trip_id': trip[0],
+            'route_id': trip[1],
+            'start_date': trip[2],
+            'schedule_relationship': trip[3],
+            'arrival_time': epoch_to_time(arrival) if arrival is not None else None,
+            'departure_time': epoch_to_time(departure) if departure is not None else None,
+            'stop_id': stop_id
+        })
+
+    def vehicle_position(self, trip, current_stop_sequence, stop_id, current_status, timestamp):
+        self.vehicle_positions.append({
+            'trip_id': trip[0],
+            'route_id': trip[1],
+            'current_stop_sequence': current_stop_sequence,
+            'stop_id': stop_id,
+            'current_status': current_status,
+            'timestamp': datetime.datetime.utcfromtimestamp(timestamp),
+        })
+
+    def alert(self, alert_id, trip_id, route_id, text):
+        self.alerts.append({'alert_id': alert_id, 'trip_id': trip_id, 'route_id': route_id, 'description_text': text})
+
+
+class _ColumnarSink(_Sink):
+    """Fills column batches, like transformer.extract_columnar."""
+
+    def __init__(self):
+        strings = StringPool()
+        self.intern = strings.intern
+        self.trip_updates = ColumnBatch(TRIP_UPDATE_SCHEMA, strings)
+        self.vehicle_positions = ColumnBatch(VEHICLE_POSITION_SCHEMA, strings)
+        self.alerts = ColumnBatch(ALERT_SCHEMA, strings)
+
+    def trip_update(self, trip, stop_id, arrival, departure):
+        tu = self.trip_updates.columns
+        tu['trip_id'].append(self.intern(trip[0]))
+        tu['route_id'].append(self.intern(trip[1]))
+        tu['start_date'].append(self.intern(trip[2]))
+        tu['schedule_relationship'].append(trip[3])
+        tu['arrival_time'].append(-1 if arrival is None else arrival)
+        tu['departure_time'].append(-1 if departure is None else departure)
+        tu['stop_id'].append(self.intern(stop_id))
+
+    def vehicle_position(self, trip, current_stop_sequence, stop_id, current_status, timestamp):
+        vp = self.vehicle_positions.columns
+        vp['trip_id'].append(self.intern(trip[0]))
+        vp['route_id'].append(self.intern(trip[1]))
+        vp['current_stop_sequence'].append(current_stop_sequence)
+        vp['stop_id'].append(self.intern(stop_id))
+        vp['current_status'].append(current_status)
+        vp['timestamp'].append(timestamp)
+
+    def alert(self, alert_id, trip_id, route_id, text):
+        al = self.alerts.columns
+        al['alert_id'].append(self.intern(alert_id))
+        al['trip_id'].append(self.intern(trip_id))
+        al['route_id'].append(self.intern(route_id))
+        al['description_text'].append(self.intern(text))
+
+
+def _scan_trip_update(buffer: bytes, span: Tuple[int, int], sink: _Sink) -> None:
+    trip = ['', '', '', 0]
+    stop_time_updates = []
+    for field_number, wire_type, value in _iter_fields(buffer, *span):
+        if field_number == 1 and wire_type == _LEN:
+            _trip_descriptor(buffer, value, trip)
+        elif field_number == 2 and wire_type == _LEN:
+            stop_time_updates.append(value)
+
+    for stop_time_update in stop_time_updates:
+        stop_id, arrival, departure = '', None, None
+        for field_number, wire_type, value in _iter_fields(buffer, *stop_time_update):
+            if field_number == 4 and wire_type == _LEN:
+                stop_id = _string(buffer, value)
+            elif field_number == 2 and wire_type == _LEN:
+                arrival = _event_time(buffer, value)
+            elif field_number == 3 and wire_type == _LEN:
+                departure = _event_time(buffer, value)
+        sink.trip_update(trip, stop_id, arrival, departure)
+
+
+def _scan_vehicle(buffer: bytes, span: Tuple[int, int], sink: _Sink) -> None:
+    trip = ['', '', '', 0]
+    current_stop_sequence, stop_id, current_status, timestamp = 0, '', _DEFAULT_CURRENT_STATUS, 0
+    for field_number, wire_type, value in _iter_fields(buffer, *span):
+        if field_number == 1 and wire_type == _LEN:
+            _trip_descriptor(buffer, value, trip)
+        elif field_number == 3 and wire_type == _VARINT:
+            current_stop_sequence = value
+        elif field_number == 7 and wire_type == _LEN:
+            stop_id = _string(buffer, value)
+        elif field_number == 4 and wire_type == _VARINT:
+            current_status = value
+        elif field_number == 5 and wire_type == _VARINT:
+            timestamp = value
+    sink.vehicle_position(trip, current_stop_sequence, stop_id, current_status, timestamp)
+
+
+def _scan_alert(buffer: bytes, span: Tuple[int, int], alert_id: str, sink: _Sink) -> None:
+    informed_entities = []
+    texts = []
+    for field_number, wire_type, value in _iter_fields(buffer, *span):
+        if field_number == 5 and wire_type == _LEN:
+            trip = None
+            for entity_field, entity_wire_type, entity_value in _iter_fields(buffer, *value):
+                if entity_field == 4 and entity_wire_type == _LEN:
+                    trip = _trip_descriptor(buffer, entity_value, trip or ['', '', '', 0])
+            informed_entities.append((trip[0], trip[1]) if trip else (None, None))
+        elif field_number == 10 and wire_type == _LEN:
+            for string_field, string_wire_type, translation in _iter_fields(buffer, *value):
+                if string_field == 1 and string_wire_type == _LEN:
+                    for text_field, text_wire_type, text in _iter_fields(buffer, *translation):
+                        if text_field == 1 and text_wire_type == _LEN:
+                            texts.append(_string(buffer, text))
+
+    for trip_id, route_id in informed_entities:
+        for text in texts:
+            sink.alert(alert_id, trip_id, route_id, text)
+
+
+def _scan(binary_data: bytes, sink: _Sink) -> None:
+    """Walks the FeedMessage entities and hands the fields used by transformer.py to `sink`."""
+    for field_number, wire_type, entity in _iter_fields(binary_data, 0, len(binary_data)):
+        if field_number != 2 or wire_type != _LEN:
+            continue
+        entity_id, trip_update, vehicle, alert = '', None, None, None
+        for entity_field, entity_wire_type, value in _iter_fields(binary_data, *entity):
+            if entity_wire_type != _LEN:
+                continue
+            if entity_field == 1:
+                entity_id = _string(binary_data, value)
+            elif entity_field == 3:
+                trip_update = value
+            elif entity_field == 4:
+                vehicle = value
+            elif entity_field == 5:
+                alert = value
+
+        # Same precedence as process_feed
+        if trip_update is not None:
+            _scan_trip_update(binary_data, trip_update, sink)
+        elif vehicle is not None:
+            _scan_vehicle(binary_data, vehicle, sink)
+        elif alert is not None:
+            _scan_alert(binary_data, alert, entity_id, sink)
+        else:
+            logging.warning(f"Unhandled entity type in entity: {entity_id}")
+
+
+def scan_feed(binary_data: bytes, columnar: bool = False) -> Union[Tuple[List[Dict], List[Dict], List[Dict]],
+                                                                  Tuple[ColumnBatch, ColumnBatch, ColumnBatch]]:
+    """
+    Extracts trip updates, vehicle positions and alerts straight from the wire format.
+
+    Only the fields read by transformer.py are decoded and no message objects are built;
+    everything else, including feed extensions, is skipped by length. The output is identical
+    to decoding with the generated classes and running the extract_* functions.
+
+    Args:
+        binary_data (bytes): The binary FeedMessage.
+        columnar (bool): Return ColumnBatch objects instead of lists of dictionaries.
+
+    Returns:
+        Tuple: Trip updates, vehicle positions, and alerts, as lists of dictionaries or ColumnBatch objects.
+    """
+
+    sink = _ColumnarSink() if columnar else _DictSink()
+    _scan(binary_data, sink)
+    return sink.trip_updates, sink.vehicle_positions, sink.alerts
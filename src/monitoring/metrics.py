@@ -0,0 +1,262 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from a fast decode to a fetch close to its timeout
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: object) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Metric:
+    """Base class for a metric family with a fixed set of label names."""
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Sequence[object]) -> LabelValues:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {labels}")
+        return tuple(_escape(value) for value in labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """A monotonically increasing count."""
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: object, amount: float = 1) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels: object) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in values]
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down. Either set explicitly, or computed at scrape time by a function
+    returning a value or a mapping of label values to values.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 function: Optional[Callable[[], object]] = None):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self.function = function
+
+    def set(self, value: float, *labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> List[str]:
+        if self.function is not None:
+            try:
+                result = self.function()
+            except Exception as e:
+                logging.debug(f"Could not collect {self.name}: {e}")
+                return []
+            if not isinstance(result, dict):
+                result = {(): result}
+            values = [(tuple(_escape(v) for v in (key if isinstance(key, tuple) else (key,))), value)
+                      for key, value in result.items()]
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in values]
+
+
+class Histogram(_Metric):
+    """Counts observations in cumulative buckets, plus their sum and count."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *labels: object) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, *labels: object) -> Iterator[None]:
+        """Observes the duration of the block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = self.header()
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Holds metric families and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = Registry()
+
+# The feed a thread is currently working on, so decode, transform and load metrics can be
+# labelled per feed without passing the url through every function
+_context = threading.local()
+
+
+@contextmanager
+def feed_context(feed: str) -> Iterator[None]:
+    """
+    Labels the metrics recorded by this thread inside the block with `feed`.
+
+    Args:
+        feed (str): The feed url or name.
+    """
+    previous = getattr(_context, 'feed', '')
+    _context.feed = feed
+    try:
+        yield
+    finally:
+        _context.feed = previous
+
+
+def current_feed() -> str:
+    """Returns the feed set by feed_context in this thread, or an empty string."""
+    return getattr(_context, 'feed', '')
+
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'transit_stage_seconds', 'Time spent per pipeline stage and feed.', ('stage', 'feed')))
+FETCH_BYTES = REGISTRY.register(Counter(
+    'transit_fetch_bytes_total', 'Bytes of feed data fetched.', ('feed',)))
+FETCH_RESPONSES = REGISTRY.register(Counter(
+    'transit_fetch_responses_total', 'Fetch results by HTTP status, "error" when there was no response.',
+    ('feed', 'status')))
+ROWS_EMITTED = REGISTRY.register(Counter(
+    'transit_rows_emitted_total', 'Rows produced by the transform stage.', ('feed', 'table')))
+ROWS_LOADED = REGISTRY.register(Counter(
+    'transit_rows_loaded_total', 'Rows written to the database.', ('feed', 'table')))
+ROWS_REJECTED = REGISTRY.register(Counter(
+    'transit_rows_rejected_total', 'Rows refused by the database and written to the reject table.',
+    ('feed', 'table')))
+ERRORS = REGISTRY.register(Counter(
+    'transit_errors_total', 'Errors per pipeline stage and feed.', ('stage', 'feed')))
+
+# Header timestamp of the last feed fetched per endpoint, for the staleness gauge
+_header_timestamps: Dict[str, int] = {}
+
+
+def record_header_timestamp(feed: str, header_timestamp: Optional[int]) -> None:
+    """
+    Remembers the FeedHeader.timestamp of the last snapshot of a feed.
+
+    Args:
+        feed (str): The feed url.
+        header_timestamp (Optional[int]): The header timestamp, ignored if missing.
+    """
+    if header_timestamp:
+        _header_timestamps[feed] = header_timestamp
+
+
+FEED_STALENESS = REGISTRY.register(Gauge(
+    'transit_feed_staleness_seconds', 'Now minus the FeedHeader.timestamp of the last snapshot.', ('feed',),
+    function=lambda: {feed: round(time.time() - ts, 3) for feed, ts in list(_header_timestamps.items())}))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass  # scrapes are not worth a log line
+
+
+def start_metrics_server(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """
+    Serves the registry at http://host:port/metrics from a daemon thread.
+
+    Args:
+        port (int): The port to listen on.
+        host (str): The address to bind.
+
+    Returns:
+        ThreadingHTTPServer: The running server; call shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,142 @@
+import datetime
+import os
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional
+
+from config import (db_params, archive_path, spool_path, metrics_host, metrics_port, raw_feed_storage,
+                    api_endpoint_urls)
+
+# Metric families of a running ingest process worth showing in a status report
+STATUS_METRICS = ('transit_feed_staleness_seconds', 'transit_feed_publish_interval_seconds', 'transit_pipeline',
+                  'transit_spool', 'transit_poller', 'transit_feed_owned')
+
+
+def _human_bytes(size: float) -> str:
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def scrape_metrics(host: str = metrics_host, port: int = metrics_port, timeout: float = 2) -> Optional[List[str]]:
+    """
+    Reads the status metrics of a running ingest process from its metrics endpoint.
+
+    Returns:
+        Optional[List[str]]: The sample lines of STATUS_METRICS, or None if nothing is listening.
+    """
+    if not port:
+        return None
+    try:
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=timeout) as response:
+            text = response.read().decode()
+    except (urllib.error.URLError, OSError):
+        return None
+    return [line for line in text.splitlines() if line.startswith(STATUS_METRICS)]
+
+
+def local_storage() -> Dict[str, Dict[str, int]]:
+    """
+    Sizes of the on-disk archive per feed and of the spool backlog, read from the directory listings.
+
+    Returns:
+        Dict[str, Dict[str, int]]: Files and bytes per archive feed, and under 'spool'.
+    """
+
+    usage = {}
+    if os.path.isdir(archive_path):
+        for feed in sorted(os.listdir(archive_path)):
+            directory = os.path.join(archive_path, feed)
+            if os.path.isdir(directory):
+                files = [os.path.join(directory, name) for name in os.listdir(directory)]
+                usage[f"archive/{feed}"] = {"files": len(files), "bytes": sum(os.path.getsize(f) for f in files)}
+    if os.path.isdir(spool_path):
+        # One subdirectory per feed
+        files = [os.path.join(directory, name) for directory, _, names in os.walk(spool_path) for name in names]
+        usage["spool"] = {"files": len(files), "bytes": sum(os.path.getsize(f) for f in files)}
+    return usage
+
+
+def database_status(params: dict = db_params) -> Dict[str, object]:
+    """
+    Reads feed freshness, leases and alert counts from the database.
+
+    Tables that do not exist yet are left out.
+
+    Args:
+        params (dict): Connection parameters.
+
+    Returns:
+        Dict[str, object]: The status sections, or {'error': ...} if the database is unreachable.
+    """
+
+    import psycopg2  # imported here so the other status sections do not need it
+    import psycopg2.errors
+
+    try:
+        conn = psycopg2.connect(connect_timeout=3, **params)
+    except psycopg2.Error as e:
+        return {"error": str(e).strip()}
+    status: Dict[str, object] = {}
+    try:
+        with conn.cursor() as cur:
+            def query(sql: str, args: tuple = ()) -> Optional[list]:
+                try:
+                    cur.execute(sql, args)
+                    return cur.fetchall()
+                except psycopg2.errors.UndefinedTable:
+                    conn.rollback()
+                    return None
+
+            if raw_feed_storage == "archive":
+                # One index probe per feed on (feed, header_timestamp)
+                rows = query(
+                    "SELECT f.feed, (SELECT max(header_timestamp) FROM realtime_feed_archive a WHERE a.feed = f.feed) "
+                    "FROM unnest(%s::text[]) AS f (feed)", (api_endpoint_urls,)
+                )
+                if rows is not None:
+                    status["last_archived_snapshot"] = {
+                        feed: f"{datetime.datetime.utcfromtimestamp(ts).isoformat(sep=' ')} UTC" if ts else None
+                        for feed, ts in rows
+                    }
+            rows = query("SELECT feed, instance_id, round(extract(epoch FROM NOW() - heartbeat_at)) "
+                         "FROM realtime_feed_leases ORDER BY feed")
+            if rows is not None:
+                status["leases"] = {feed: f"{instance} (heartbeat {age:.0f}s ago)" for feed, instance, age in rows}
+            rows = query("SELECT count(*) FILTER (WHERE cleared_at IS NULL), count(*) FROM realtime_alert_versions")
+            if rows is not None:
+                status["alerts"] = {"open": rows[0][0], "versions": rows[0][1]}
+            rows = query("SELECT run_name, count(*), sum(rows), max(completed_at) FROM realtime_replay_checkpoints "
+                         "GROUP BY run_name ORDER BY max(completed_at) DESC LIMIT 5")
+            if rows is not None:
+                status["replay_runs"] = {run: f"{shards} shards, {rows_loaded} rows, last at {finished}"
+                                         for run, shards, rows_loaded, finished in rows}
+    finally:
+        conn.close()
+    return status
+
+
+def print_status() -> None:
+    """Prints the state of the ingest process, local storage and database."""
+
+    lines = scrape_metrics()
+    print(f"Ingest process (http://{metrics_host}:{metrics_port}/metrics):")
+    if lines is None:
+        print("  not reachable")
+    for line in lines or []:
+        print(f"  {line}")
+
+    print("Local storage:")
+    for name, usage in local_storage().items():
+        print(f"  {name}: {usage['files']} files, {_human_bytes(usage['bytes'])}")
+
+    print("Database:")
+    for section, values in database_status().items():
+        if isinstance(values, dict):
+            print(f"  {section}:")
+            for key, value in values.items():
+                print(f"    {key}: {value}")
+        else:
+            print(f"  {section}: {values}")
@@ -0,0 +1,121 @@
+import datetime
+import logging
+
+import pytest
+
+from src.data_loading.partitions import (PARTITIONED_TABLES, drain_default_partitions, drop_expired_partitions,
+                                         partition_name)
+
+CUTOFF = datetime.datetime(2024, 1, 10)
+
+
+class _Cursor:
+    """Answers the catalog queries of the partition functions from `partitions` and `defaults`."""
+
+    def __init__(self, partitions=(), defaults=None):
+        self.partitions = partitions
+        self.defaults = defaults or {}
+        self.statements = []
+        self._result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, args=None):
+        self.statements.append((statement, args))
+        if statement.startswith("SELECT NOW()"):
+            self._result = [(CUTOFF,)]
+        elif 'pg_inherits' in statement:
+            self._result = [(name,) for name in self.partitions if name.startswith(args[0] + '_')]
+        elif statement.startswith("SELECT to_regclass"):
+            self._result = [(args[0] if args[0] in self.defaults else None,)]
+        elif statement.startswith("SELECT date_trunc"):
+            self._result = self.defaults[statement.split(' FROM ')[1].split()[0]]
+        else:
+            self._result = None
+
+    def fetchone(self):
+        return self._result[0]
+
+    def fetchall(self):
+        return self._result
+
+    def executed(self, prefix):
+        return [(statement, args) for statement, args in self.statements if statement.lstrip().startswith(prefix)]
+
+
+class _Connection:
+    def __init__(self, cur):
+        self.cur = cur
+        self.commits = 0
+
+    def cursor(self):
+        return self.cur
+
+    def commit(self):
+        self.commits += 1
+
+
+@pytest.fixture(autouse=True)
+def quiet_default_partitions():
+    # Rows in a default partition are logged as a warning
+    logging.disable(logging.WARNING)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def test_partition_names_follow_the_interval():
+    start = datetime.datetime(2023, 10, 17, 5)
+
+    assert partition_name('realtime_alerts', start, 'day') == 'realtime_alerts_p20231017'
+    assert partition_name('realtime_alerts', start, 'hour') == 'realtime_alerts_p2023101705'
+    with pytest.raises(ValueError):
+        partition_name('realtime_alerts', start, 'week')
+
+
+def test_only_partitions_wholly_past_the_cutoff_are_dropped():
+    cur = _Cursor(partitions=(
+        'realtime_alerts_p20240108', 'realtime_alerts_p20240109', 'realtime_alerts_p20240110',
+        'realtime_alerts_default', 'realtime_alerts_p2024010800',
+    ))
+
+    dropped = drop_expired_partitions(_Connection(cur), retention=7, interval='day')
+
+    assert dropped == ['realtime_alerts_p20240108', 'realtime_alerts_p20240109']
+    assert [statement for statement, _ in cur.executed("DROP TABLE")] == [
+        'DROP TABLE realtime_alerts_p20240108', 'DROP TABLE realtime_alerts_p20240109']
+
+
+def test_hourly_partitions_are_parsed_with_their_own_format():
+    cur = _Cursor(partitions=('realtime_trip_updates_p2024010923', 'realtime_trip_updates_p20240101'))
+
+    assert drop_expired_partitions(_Connection(cur), retention=7, interval='hour') == [
+        'realtime_trip_updates_p2024010923']
+
+
+def test_default_partition_rows_are_deleted_or_moved_by_range():
+    expired = datetime.datetime(2024, 1, 5)
+    kept = datetime.datetime(2024, 1, 11)
+    cur = _Cursor(defaults={'realtime_alerts_default': [(expired, 3), (kept, 4)]})
+    conn = _Connection(cur)
+
+    assert drain_default_partitions(conn, retention=7, interval='day') == {'realtime_alerts': 7}
+
+    deletes = cur.executed("DELETE FROM realtime_alerts_default")
+    assert [args for _, args in deletes] == [(expired, expired + datetime.timedelta(days=1))]
+    assert [statement for statement, _ in cur.executed("CREATE TABLE")] == [
+        'CREATE TABLE realtime_alerts_p20240111 (LIKE realtime_alerts INCLUDING DEFAULTS)']
+    attach, = cur.executed("ALTER TABLE realtime_alerts ATTACH PARTITION realtime_alerts_p20240111")
+    assert attach[1] == (kept, kept + datetime.timedelta(days=1))
+    assert conn.commits == 1
+
+
+def test_tables_without_a_default_partition_are_skipped():
+    cur = _Cursor()
+
+    assert drain_default_partitions(_Connection(cur), retention=7, interval='day') == {}
+    assert len(cur.executed("SELECT to_regclass")) == len(PARTITIONED_TABLES)
+    assert cur.executed("SELECT date_trunc") == []
@@ -0,0 +1,86 @@
+import logging
+import threading
+
+import pytest
+
+from src.automation.pipeline import Pipeline, StageQueue
+
+
+@pytest.fixture(autouse=True)
+def quiet_drops():
+    # Every dropped item is logged as a warning
+    logging.disable(logging.WARNING)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def _filled(policy, dropped):
+    queue = StageQueue("test", 2, policy, dropped.append)
+    for item in (1, 2, 3):
+        queue.put(item)
+    return queue
+
+
+def _items(queue):
+    return [queue.get() for _ in range(queue.qsize())]
+
+
+def test_unknown_policy_is_refused():
+    with pytest.raises(ValueError):
+        StageQueue("test", 2, "drop_all")
+
+
+def test_drop_newest_discards_the_new_item():
+    dropped = []
+    queue = _filled("drop_newest", dropped)
+
+    assert _items(queue) == [1, 2]
+    assert dropped == [3]
+    assert queue.dropped == 1
+
+
+def test_drop_oldest_makes_room_for_the_new_item():
+    dropped = []
+    queue = _filled("drop_oldest", dropped)
+
+    assert _items(queue) == [2, 3]
+    assert dropped == [1]
+
+
+def test_block_waits_for_space():
+    queue = StageQueue("test", 1)
+    queue.put(1)
+    producer = threading.Thread(target=queue.put, args=(2,))
+    producer.start()
+    producer.join(0.1)
+    assert producer.is_alive()
+
+    assert queue.get() == 1
+    producer.join()
+    assert queue.get() == 2
+    assert queue.dropped == 0
+
+
+def test_items_with_the_same_key_are_loaded_in_order_by_one_thread():
+    feeds = [f"feed-{n}" for n in range(6)]
+    fetched = [(feed, n) for n in range(20) for feed in feeds]
+    loads = {}
+
+    def fetch():
+        pipeline.stop()
+        return fetched
+
+    def load(item):
+        feed, n = item
+        loads.setdefault(feed, []).append((n, threading.current_thread().name))
+
+    pipeline = Pipeline(fetch, lambda item: item, load, interval=60, queue_size=4, load_workers=3,
+                        load_key=lambda item: item[0])
+    pipeline.run()
+
+    assert sorted(loads) == feeds
+    for feed, loaded in loads.items():
+        assert [n for n, _ in loaded] == list(range(20)), feed
+        assert len({thread for _, thread in loaded}) == 1, feed
+    assert pipeline.stats()["load_queue_depth"] == 0
+
@@ -0,0 +1,101 @@
+import pytest
+
+from src.automation.polling import AdaptivePoller
+
+FEED = 'https://example.com/feed'
+OTHER = 'https://example.com/other'
+
+# Later than the poller's construction, so the request bucket refills with the test clock
+NOW = 2_000_000_000.0
+
+
+def _poller(feeds=(FEED,), **kwargs):
+    return AdaptivePoller(feeds, **dict({'default_interval': 30, 'min_interval': 5, 'max_interval': 300,
+                                         'publish_delay': 1, 'request_budget': 600}, **kwargs))
+
+
+def test_intervals_must_be_ordered():
+    with pytest.raises(ValueError):
+        _poller(default_interval=1)
+
+
+def test_every_feed_is_due_at_start_and_not_again_until_recorded():
+    poller = _poller((FEED, OTHER))
+
+    assert poller.due(now=NOW) == [FEED, OTHER]
+    assert poller.due(now=NOW + 1) == []
+    # A fetch whose result is never recorded is retried after min_interval
+    assert poller.due(now=NOW + 5) == [FEED, OTHER]
+
+
+def test_due_is_limited_to_the_given_feeds():
+    poller = _poller((FEED, OTHER))
+
+    assert poller.due([OTHER, 'https://example.com/unknown'], now=NOW) == [OTHER]
+
+
+def test_publish_interval_is_learned_from_header_timestamps():
+    poller = _poller()
+    for n, header in enumerate((NOW, NOW + 20, NOW + 40, NOW + 100)):
+        poller.record(FEED, True, int(header), fetched_at=header + 2 + n)
+
+    # Median of 20, 20 and 60
+    assert poller.intervals() == {FEED: 20}
+
+
+def test_next_fetch_follows_the_expected_publish_time():
+    poller = _poller()
+    poller.due(now=NOW)
+    poller.record(FEED, True, int(NOW), fetched_at=NOW + 3)
+    poller.record(FEED, True, int(NOW) + 30, fetched_at=NOW + 32)
+
+    # Next publish at NOW + 60, plus the smallest lag seen (2s) and the publish delay (1s)
+    assert poller.due(now=NOW + 62) == []
+    assert poller.next_delay(now=NOW + 62) == pytest.approx(1)
+    assert poller.due(now=NOW + 63) == [FEED]
+
+
+def test_unchanged_fetches_back_off_up_to_the_publish_interval():
+    poller = _poller()
+    poller.record(FEED, True, int(NOW), fetched_at=NOW)
+    delays = []
+    fetched_at = NOW
+    for _ in range(5):
+        poller.record(FEED, False, int(NOW), fetched_at=fetched_at)
+        delays.append(poller.next_delay(now=fetched_at))
+        fetched_at += delays[-1]
+
+    assert delays == [5, 10, 20, 30, 30]
+
+
+def test_failed_fetches_back_off_up_to_max_interval():
+    poller = _poller()
+    delays = []
+    for _ in range(6):
+        poller.record(FEED, False, None, failed=True, fetched_at=NOW)
+        delays.append(poller.next_delay(now=NOW))
+
+    assert delays == [30, 60, 120, 240, 300, 300]
+    assert poller.stats()['backing_off'] == 1
+    poller.record(FEED, True, None, fetched_at=NOW)
+    assert poller.stats()['backing_off'] == 0
+
+
+def test_feeds_without_header_timestamps_use_the_default_interval():
+    poller = _poller()
+    poller.record(FEED, True, None, fetched_at=NOW)
+
+    assert poller.next_delay(now=NOW) == 30
+
+
+def test_request_budget_defers_the_least_overdue_feeds():
+    poller = _poller((FEED, OTHER), request_budget=2)
+    poller.due(now=NOW)
+    poller.record(OTHER, True, None, fetched_at=NOW - 1)
+    poller.record(FEED, True, None, fetched_at=NOW)
+
+    # 30s at 2 requests per minute refill one token, not enough for both feeds
+    assert poller.due(now=NOW + 30) == [OTHER]
+    assert poller.stats()['deferred'] == 1
+    # FEED is overdue, but waits for the next token
+    assert poller.next_delay(now=NOW + 30) == pytest.approx(30)
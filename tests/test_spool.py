@@ -0,0 +1,205 @@
+import contextlib
+import logging
+import os
+import pickle
+import threading
+import time
+import zlib
+
+import psycopg2
+import pytest
+
+from src.data_loading import spool as spool_module
+from src.data_loading.feed_archive import feed_slug
+from src.data_loading.spool import QUARANTINE_DIR, FeedSpools, Spool, SpoolFull, run_drainer
+
+URLS = ('https://example.com/feed-a', 'https://example.com/feed-b')
+
+
+@pytest.fixture(autouse=True)
+def quiet_spool_errors():
+    # Corrupt records and failed loads are logged as errors
+    logging.disable(logging.ERROR)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def _spool(path, **kwargs):
+    return Spool(str(path), **dict({'max_bytes': 1024 ** 2, 'segment_bytes': 1024 ** 2}, **kwargs))
+
+
+def _drain(spool):
+    batches = []
+    while True:
+        entry = spool.take(timeout=0)
+        if entry is None:
+            return batches
+        seq, batch = entry
+        batches.append(batch)
+        spool.done(seq)
+
+
+def _segments(path):
+    return sorted(name for name in os.listdir(path) if name.endswith('.log'))
+
+
+def test_batches_are_taken_in_order_and_segments_deleted_once_loaded(tmp_path):
+    spool = _spool(tmp_path, segment_bytes=100)
+    ids = [spool.append({'url': URLS[0], 'n': n, 'rows': 'x' * 200}) for n in range(5)]
+
+    assert [batch['n'] for batch in _drain(spool)] == list(range(5))
+    # Only the segment still being written is left
+    assert len(_segments(tmp_path)) == 1
+    assert spool.stats()['loaded'] == 5
+    assert len(set(ids)) == 5
+
+
+def test_unloaded_batches_are_taken_again_after_a_restart(tmp_path):
+    spool = _spool(tmp_path)
+    batch_id = spool.append({'url': URLS[0], 'n': 1})
+    assert spool.take(timeout=0)[1]['batch_id'] == batch_id
+    spool.close()
+
+    reopened = _spool(tmp_path)
+
+    assert [batch['batch_id'] for batch in _drain(reopened)] == [batch_id]
+    assert _segments(tmp_path) == []
+
+
+def test_full_spool_refuses_batches(tmp_path):
+    spool = _spool(tmp_path, max_bytes=200)
+    spool.append({'url': URLS[0], 'rows': 'x'})
+
+    with pytest.raises(SpoolFull):
+        spool.append({'url': URLS[0], 'rows': os.urandom(400)})
+    assert spool.stats()['rejected'] == 1
+    spool.append({'url': URLS[0], 'rows': os.urandom(400)}, force=True)
+
+
+def test_records_failing_their_crc_are_skipped(tmp_path):
+    spool = _spool(tmp_path)
+    for n in range(3):
+        spool.append({'url': URLS[0], 'n': n})
+    spool.close()
+    segment = os.path.join(tmp_path, _segments(tmp_path)[0])
+    with open(segment, 'r+b') as f:
+        data = bytearray(f.read())
+        length = int.from_bytes(data[:4], 'little')
+        # Flip the last payload byte of the second record
+        second = 8 + length
+        data[second + 8 + int.from_bytes(data[second:second + 4], 'little') - 1] ^= 0xFF
+        f.seek(0)
+        f.write(data)
+
+    reopened = _spool(tmp_path)
+
+    assert [batch['n'] for batch in _drain(reopened)] == [0, 2]
+    assert reopened.stats()['corrupt'] == 1
+
+
+def test_a_torn_write_at_the_end_of_a_segment_is_skipped(tmp_path):
+    spool = _spool(tmp_path)
+    spool.append({'url': URLS[0], 'n': 0})
+    spool.close()
+    with open(os.path.join(tmp_path, _segments(tmp_path)[0]), 'ab') as f:
+        f.write(b'\x40\x00\x00\x00partial')
+    reopened = _spool(tmp_path)
+    reopened.append({'url': URLS[0], 'n': 1})
+
+    assert [batch['n'] for batch in _drain(reopened)] == [0, 1]
+    assert len(_segments(tmp_path)) == 1
+
+
+def test_feed_spools_split_a_shared_spool_by_feed_in_order(tmp_path):
+    shared = _spool(tmp_path)
+    ids = [shared.append({'url': URLS[n % 2], 'n': n}) for n in range(6)]
+    shared.close()
+
+    spools = FeedSpools(URLS, str(tmp_path), max_bytes=1024 ** 2)
+
+    assert _segments(tmp_path) == []
+    assert sorted(spools.spools) == sorted(feed_slug(url) for url in URLS)
+    first = _drain(spools.spools[feed_slug(URLS[0])])
+    second = _drain(spools.spools[feed_slug(URLS[1])])
+    assert [batch['n'] for batch in first] == [0, 2, 4]
+    assert [batch['n'] for batch in second] == [1, 3, 5]
+    assert sorted(batch['batch_id'] for batch in first + second) == sorted(ids)
+    assert spools.stats()['max_bytes'] == 1024 ** 2
+    spools.close()
+
+
+def test_feed_spools_append_to_the_spool_of_the_feed(tmp_path):
+    spools = FeedSpools(URLS, str(tmp_path))
+    spools.append({'url': URLS[1], 'n': 1})
+
+    assert _drain(spools.spools[feed_slug(URLS[0])]) == []
+    assert [batch['n'] for batch in _drain(spools.spools[feed_slug(URLS[1])])] == [1]
+
+
+class _Pool:
+    @contextlib.contextmanager
+    def connection(self):
+        yield None
+
+
+def _run_drainer(spool, load, **kwargs):
+    stop = threading.Event()
+    thread = threading.Thread(target=run_drainer, args=(spool, _Pool(), load, stop), kwargs=kwargs)
+    thread.start()
+    return stop, thread
+
+
+def _wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_drainer_quarantines_a_batch_that_keeps_failing(tmp_path, monkeypatch):
+    monkeypatch.setattr(spool_module, 'db_reconnect_max_backoff', 0.01)
+    spool = _spool(tmp_path)
+    bad_id = spool.append({'url': URLS[0], 'n': 0})
+    spool.append({'url': URLS[0], 'n': 1})
+    loaded, quarantined = [], []
+
+    def load(batch, conn):
+        if batch['n'] == 0:
+            raise LookupError('stale change')
+        loaded.append(batch['n'])
+
+    stop, thread = _run_drainer(spool, load, max_attempts=2, on_quarantine=quarantined.append)
+    try:
+        assert _wait_until(lambda: loaded == [1])
+    finally:
+        stop.set()
+        thread.join()
+
+    assert [batch['batch_id'] for batch in quarantined] == [bad_id]
+    with open(os.path.join(tmp_path, QUARANTINE_DIR, f"{bad_id}.batch"), 'rb') as f:
+        assert pickle.loads(zlib.decompress(f.read()))['n'] == 0
+    assert spool.stats()['quarantined'] == 1
+
+
+def test_drainer_waits_out_an_unreachable_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(spool_module, 'db_reconnect_max_backoff', 0.01)
+    spool = _spool(tmp_path)
+    spool.append({'url': URLS[0], 'n': 0})
+    attempts = []
+
+    def load(batch, conn):
+        attempts.append(batch['n'])
+        if len(attempts) < 5:
+            raise psycopg2.OperationalError('server closed the connection')
+
+    stop, thread = _run_drainer(spool, load, max_attempts=2)
+    try:
+        assert _wait_until(lambda: spool.stats()['loaded'] == 1)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert len(attempts) == 5
+    assert spool.stats()['quarantined'] == 0
@@ -0,0 +1,137 @@
+import threading
+
+from src.data_transformation.alert_state import AlertRecord, AlertStateDiffer
+from src.data_transformation.state_diff import TripStateDiffer
+
+FEED = 'https://example.com/feed'
+
+
+def _prediction(trip_id, stop_id, arrival=100, route_id='A'):
+    return {'trip_id': trip_id, 'route_id': route_id, 'start_date': '20240101', 'schedule_relationship': 0,
+            'arrival_time': arrival, 'departure_time': arrival, 'stop_id': stop_id}
+
+
+def _vehicle(trip_id, stop_id='S1', route_id='A'):
+    return {'trip_id': trip_id, 'route_id': route_id, 'current_stop_sequence': 1, 'stop_id': stop_id,
+            'current_status': 1, 'timestamp': 100}
+
+
+def _alert(alert_id, effect=1):
+    return AlertRecord(alert_id, 1, effect, ((0, 0),), ((None, 'A', None, None, None),), (('header', 'en', 'x'),))
+
+
+def test_first_snapshot_is_passed_in_full_and_repeats_are_dropped():
+    differ = TripStateDiffer()
+    trip_updates = [_prediction('t1', 'S1'), _prediction('t1', 'S2'), _prediction('t2', 'S1')]
+    vehicles = [_vehicle('t1')]
+
+    assert differ.diff(FEED, trip_updates, vehicles, now=0) == (trip_updates, vehicles, [])
+    assert differ.diff(FEED, trip_updates, vehicles, now=1) == ([], [], [])
+
+
+def test_only_changed_rows_are_passed():
+    differ = TripStateDiffer()
+    differ.diff(FEED, [_prediction('t1', 'S1'), _prediction('t1', 'S2')], [_vehicle('t1')], now=0)
+
+    changed = _prediction('t1', 'S2', arrival=160)
+    moved = _vehicle('t1', stop_id='S2')
+    assert differ.diff(FEED, [_prediction('t1', 'S1'), changed], [moved], now=1) == ([changed], [moved], [])
+
+
+def test_disappeared_trips_emit_an_event_and_are_forgotten():
+    differ = TripStateDiffer()
+    differ.diff(FEED, [_prediction('t1', 'S1'), _prediction('t2', 'S1', route_id='B')], [], now=0)
+
+    _, _, events = differ.diff(FEED, [_prediction('t1', 'S1')], [], now=1)
+
+    assert events == [{'trip_id': 't2', 'route_id': 'B', 'event': 'disappeared'}]
+    assert differ.trips(FEED) == [('t1', 'A')]
+    # A trip that comes back is new again
+    assert differ.diff(FEED, [_prediction('t1', 'S1'), _prediction('t2', 'S1', route_id='B')], [], now=2)[0] == [
+        _prediction('t2', 'S1', route_id='B')]
+
+
+def test_feeds_are_diffed_independently():
+    differ = TripStateDiffer()
+    differ.diff(FEED, [_prediction('t1', 'S1')], [], now=0)
+
+    assert differ.diff('other', [_prediction('t1', 'S1')], [], now=0)[0] == [_prediction('t1', 'S1')]
+    assert differ.diff(FEED, [], [], now=1)[2] == [{'trip_id': 't1', 'route_id': 'A', 'event': 'disappeared'}]
+    assert differ.trips('other') == [('t1', 'A')]
+
+
+def test_reset_passes_the_next_snapshot_in_full():
+    differ = TripStateDiffer()
+    trip_updates = [_prediction('t1', 'S1')]
+    differ.diff(FEED, trip_updates, [], now=0)
+
+    differ.reset(FEED)
+
+    assert differ.tracked_trips() == 0
+    assert differ.diff(FEED, trip_updates, [], now=1) == (trip_updates, [], [])
+
+
+def test_trips_past_their_ttl_are_forgotten():
+    differ = TripStateDiffer(ttl=10)
+    differ.diff(FEED, [_prediction('t1', 'S1')], [], now=0)
+    differ.diff('other', [_prediction('t2', 'S1')], [], now=5)
+
+    differ.diff('other', [_prediction('t2', 'S1')], [], now=11)
+
+    assert differ.trips(FEED) == []
+    assert differ.tracked_trips() == 1
+
+
+def test_least_recently_seen_trips_are_evicted_beyond_max_trips():
+    differ = TripStateDiffer(max_trips=2)
+    differ.diff(FEED, [_prediction('t1', 'S1')], [], now=0)
+    differ.diff('other', [_prediction('t2', 'S1')], [], now=1)
+    differ.diff('third', [_prediction('t3', 'S1')], [], now=2)
+
+    assert differ.tracked_trips() == 2
+    assert differ.trips(FEED) == []
+
+
+def test_resets_and_metrics_from_other_threads_do_not_break_a_diff():
+    differ = TripStateDiffer()
+    trip_updates = [_prediction(f"t{i}", 'S1') for i in range(200)]
+    stop = threading.Event()
+    errors = []
+
+    def interfere():
+        n = 0
+        while not stop.is_set():
+            n += 1
+            try:
+                differ.reset(f"feed-{n % 5}")
+                differ.tracked_trips()
+            except Exception as e:
+                errors.append(e)
+
+    thread = threading.Thread(target=interfere)
+    thread.start()
+    try:
+        for n in range(200):
+            differ.diff(f"feed-{n % 5}", trip_updates, [], now=n)
+    finally:
+        stop.set()
+        thread.join()
+    assert errors == []
+
+
+def test_alert_differ_lists_every_alert_after_a_reset():
+    differ = AlertStateDiffer()
+    first = differ.diff(FEED, [_alert('a1'), _alert('a2')], now=0)
+    assert [record.alert_id for record in first.changed] == ['a1', 'a2']
+    assert first.present == ['a1', 'a2']
+
+    second = differ.diff(FEED, [_alert('a1', effect=2)], now=1)
+    assert [record.alert_id for record in second.changed] == ['a1']
+    assert second.cleared == ['a2']
+    assert second.present is None
+    assert not differ.diff(FEED, [_alert('a1', effect=2)], now=2)
+
+    differ.reset(FEED)
+
+    assert differ.tracked_alerts() == 0
+    assert differ.diff(FEED, [_alert('a1', effect=2)], now=3).present == ['a1']
@@ -0,0 +1,85 @@
+import logging
+
+import psycopg2
+import pytest
+
+from src.data_loading import tf_loader
+from src.data_loading.tf_loader import ALERT_COLUMNS, copy_rows
+
+ROWS = [(f"a{n}", None, 'A', f"text {n}") for n in range(16)]
+
+
+class _CopyCursor:
+    """Accepts COPY batches unless a row contains one of `bad` texts, which raise `error`."""
+
+    def __init__(self, bad=(), error=psycopg2.DataError):
+        self.bad = bad
+        self.error = error
+        self.copied = []
+        self.copies = 0
+        self.statements = []
+
+    def execute(self, statement, args=None):
+        self.statements.append(statement)
+
+    def copy_expert(self, statement, buffer):
+        self.copies += 1
+        lines = buffer.read().splitlines()
+        if any(text in line for line in lines for text in self.bad):
+            raise self.error("invalid input syntax")
+        self.copied.extend(lines)
+
+
+@pytest.fixture
+def rejects(monkeypatch):
+    stored = []
+    monkeypatch.setattr(tf_loader, '_store_rejects', lambda cur, table, columns, rows: stored.extend(rows))
+    logging.disable(logging.WARNING)
+    yield stored
+    logging.disable(logging.NOTSET)
+
+
+def test_a_clean_batch_is_copied_at_once(rejects):
+    cur = _CopyCursor()
+
+    assert copy_rows(cur, 'realtime_alerts', ALERT_COLUMNS, ROWS) == len(ROWS)
+    assert cur.copies == 1
+    assert cur.copied[0] == 'a0\t\\N\tA\ttext 0'
+    assert rejects == []
+
+
+def test_bad_rows_are_bisected_out_and_rejected(rejects):
+    cur = _CopyCursor(bad=('text 3', 'text 12'))
+
+    assert copy_rows(cur, 'realtime_alerts', ALERT_COLUMNS, ROWS) == len(ROWS) - 2
+    assert [row for row, _ in rejects] == [ROWS[3], ROWS[12]]
+    assert all(error == 'invalid input syntax' for _, error in rejects)
+    # Every good row is copied exactly once, each attempt under its own savepoint
+    assert sorted(cur.copied) == sorted(f"a{n}\t\\N\tA\ttext {n}" for n in range(16) if n not in (3, 12))
+    assert cur.copies < len(ROWS)
+    assert cur.statements.count("SAVEPOINT bulk_copy") == cur.copies
+    assert cur.statements.count("RELEASE SAVEPOINT bulk_copy") == cur.copies
+
+
+def test_errors_other_than_rejected_data_are_raised(rejects):
+    cur = _CopyCursor(bad=('text',), error=psycopg2.ProgrammingError)
+
+    with pytest.raises(psycopg2.ProgrammingError):
+        copy_rows(cur, 'realtime_alerts', ALERT_COLUMNS, ROWS)
+    assert cur.copies == 1
+    assert rejects == []
+
+
+def test_dictionaries_are_ordered_like_the_columns(rejects):
+    cur = _CopyCursor()
+    rows = [{'description_text': 'tab\there', 'alert_id': 'a1', 'route_id': 'A'}]
+
+    assert copy_rows(cur, 'realtime_alerts', ALERT_COLUMNS, rows) == 1
+    assert cur.copied == ['a1\t\\N\tA\ttab\\there']
+
+
+def test_nothing_is_copied_for_no_rows(rejects):
+    cur = _CopyCursor()
+
+    assert copy_rows(cur, 'realtime_alerts', ALERT_COLUMNS, []) == 0
+    assert cur.statements == []
@@ -0,0 +1,67 @@
+import logging
+
+import pytest
+
+from src.data_transformation import gtfs_realtime_pb2
+from src.data_transformation.transformer import process_feed
+from src.data_transformation.wire_decoder import _Sink, scan_feed
+from src.data_loading.tf_loader import TRIP_UPDATE_COLUMNS, VEHICLE_POSITION_COLUMNS, ALERT_COLUMNS
+from benchmarks.bench_decode import add_edge_cases
+from benchmarks.feed_generator import FeedGenerator, FeedSpec
+
+COLUMNS = (TRIP_UPDATE_COLUMNS, VEHICLE_POSITION_COLUMNS, ALERT_COLUMNS)
+
+SPECS = [
+    FeedSpec(trips=0, stops_per_trip=0, vehicles=0, alerts=0),
+    FeedSpec(trips=1, stops_per_trip=1, vehicles=1, alerts=1),
+    FeedSpec(trips=50, stops_per_trip=20, vehicles=40, alerts=5),
+    FeedSpec(trips=200, stops_per_trip=30, vehicles=0, alerts=0),
+]
+
+
+@pytest.fixture(autouse=True)
+def quiet_unhandled_entities():
+    # The edge-case entities log "Unhandled entity type" on every decode
+    logging.disable(logging.WARNING)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def _feeds():
+    for seed, spec in enumerate(SPECS):
+        feed = FeedGenerator(seed=seed).generate(spec, now=1700000000 + seed)
+        yield pytest.param(feed.SerializeToString(), id=f"generated-{seed}")
+        add_edge_cases(feed, seed)
+        yield pytest.param(feed.SerializeToString(), id=f"edge-cases-{seed}")
+
+
+@pytest.mark.parametrize("binary_data", list(_feeds()))
+def test_dict_sink_matches_generated_classes(binary_data):
+    expected = process_feed(binary_data, None, columnar=False)
+    actual = scan_feed(binary_data, columnar=False)
+    for columns, expected_rows, actual_rows in zip(COLUMNS, expected, actual):
+        assert actual_rows == expected_rows, columns
+
+
+@pytest.mark.parametrize("binary_data", list(_feeds()))
+def test_columnar_sink_matches_generated_classes(binary_data):
+    expected = process_feed(binary_data, None, columnar=True)
+    actual = scan_feed(binary_data, columnar=True)
+    for columns, expected_rows, actual_rows in zip(COLUMNS, expected, actual):
+        assert len(actual_rows) == len(expected_rows), columns
+        assert actual_rows.to_tuples(columns) == expected_rows.to_tuples(columns), columns
+
+
+@pytest.mark.parametrize("binary_data", list(_feeds()))
+def test_row_counts_match_feed_message(binary_data):
+    feed = gtfs_realtime_pb2.FeedMessage.FromString(binary_data)
+    trip_updates, vehicle_positions, _ = scan_feed(binary_data, columnar=False)
+    assert len(trip_updates) == sum(len(entity.trip_update.stop_time_update)
+                                    for entity in feed.entity if entity.HasField('trip_update'))
+    assert len(vehicle_positions) == sum(1 for entity in feed.entity
+                                         if entity.HasField('vehicle') and not entity.HasField('trip_update'))
+
+
+def test_sink_is_abstract():
+    with pytest.raises(TypeError):
+        _Sink()